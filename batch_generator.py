@@ -0,0 +1,782 @@
+#!/usr/bin/env python3
+"""
+Vectorized batch generator for synthetic dataset records.
+
+Class profiles (value ranges, enum weights, sub-types and exact quotas) are
+declared in generator_profiles.json. A profile is checked against the signal
+types in Detection_Signals_Essentials_1.0.csv and compiled once into a
+sampling plan. The plan then draws every column of a batch as one NumPy
+array instead of building rows field by field.
+
+Shipped profiles mirror the existing generator scripts:
+- spam_records  -> generate_spam_records.py
+- spam_250_v2   -> generate_spam_250_v2.py
+- spam_250_v3   -> generate_spam_250_v3.py
+- no_action_50  -> generate_no_action_50.py
+
+spam_250_joint adds joint quotas to spam_250_v3.
+
+Sub-type counts (e.g. 60/140/50 clear/moderate/borderline) and quota columns
+(e.g. 170/80 bulk_message_indicator) are scaled to the requested row count
+and hold exactly across the whole run, not just per batch. A profile's
+"joint_quotas" fix counts per combination as well, e.g. sub-type x bulk flag
+as {"columns": ["subtype", "bulk_message_indicator"], "counts": [[50, 10],
+...]} with one row per sub-type and one column per quota branch
+(see quota_allocation.py).
+
+Large runs are cut into fixed-size shards that can be generated by a process
+pool. Every shard draws from its own RNG stream spawned from the run seed, so
+a given seed produces the same output whatever the number of workers.
+
+Output is streamed: each batch is drawn, formatted and written before the
+next one is generated, and shards are appended to the output as they finish,
+so peak memory depends on the batch size, not on the row count.
+
+Output goes to <output>.partial with an fsync'd checkpoint after every batch
+(or shard, with a pool) and is renamed into place when complete. --resume
+continues an interrupted run from its last published batch.
+
+--unique fingerprints every row (see row_fingerprint.py) and redraws rows
+that repeat one already generated or one in the --unique-against CSVs, using
+an exact hash set or a Bloom filter (membership_filter.py).
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import shutil
+
+import numpy as np
+
+from record_writer import (WRITE_BUFFER_SIZE, checkpoint_path, finish, load_checkpoint, open_csv, partial_path,
+                           publish, rollback, save_checkpoint)
+from data_paths import CODE_DIR, DATA_DIR
+from instrumentation import run, stage
+from membership_filter import DEFAULT_ERROR_RATE, FILTER_KINDS, filter_add, filter_contains, preloaded_filter
+from row_fingerprint import columns_fingerprints
+from quota_allocation import assign_rows, constraint_blocks, joint_table, take_counts, validate_constraints
+from signal_schema import signal_dtypes
+from signal_spec import CLASSES, LABEL_COLUMN, load_signal_spec
+
+PROFILES_FILE = os.path.join(CODE_DIR, 'generator_profiles.json')
+DEFAULT_BATCH_SIZE = 100000
+DEFAULT_SHARD_SIZE = 1000000
+# Redraw rounds per batch before a profile is judged unable to produce unique rows
+MAX_REDRAW_ROUNDS = 100
+
+SPEC_KINDS = ('const', 'choice', 'uniform', 'randint', 'bernoulli', 'quota')
+# Name of the sub-type dimension in joint quotas
+SUBTYPE_DIMENSION = 'subtype'
+
+
+def load_profiles(path=PROFILES_FILE):
+    """Load the profile configuration file"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def resolve_profile(config, name):
+    """Flatten 'extends' chains and enum references into one profile"""
+    profiles = config['profiles']
+    if name not in profiles:
+        raise ValueError(f"Unknown profile '{name}'. Available: {', '.join(sorted(profiles))}")
+    profile = profiles[name]
+    if 'extends' in profile:
+        resolved = resolve_profile(config, profile['extends'])
+    else:
+        resolved = {'classification': None, 'subtypes': {}, 'columns': {}, 'overrides': {}, 'joint_quotas': []}
+
+    resolved = {
+        'name': name,
+        'classification': profile.get('classification', resolved['classification']),
+        'subtypes': dict(profile.get('subtypes', resolved['subtypes'])),
+        'columns': dict(resolved['columns']),
+        'overrides': {subtype: dict(columns) for subtype, columns in resolved['overrides'].items()},
+        'joint_quotas': list(profile.get('joint_quotas', resolved['joint_quotas'])),
+    }
+    resolved['columns'].update(profile.get('columns', {}))
+    for subtype, columns in profile.get('overrides', {}).items():
+        resolved['overrides'].setdefault(subtype, {}).update(columns)
+
+    enums = config.get('enums', {})
+    resolved['columns'] = {column: resolve_enums(spec, enums) for column, spec in resolved['columns'].items()}
+    resolved['overrides'] = {subtype: {column: resolve_enums(spec, enums) for column, spec in columns.items()}
+                             for subtype, columns in resolved['overrides'].items()}
+    return resolved
+
+
+def resolve_enums(spec, enums):
+    """Replace a named enum list in a choice spec with its values"""
+    if 'choice' in spec and isinstance(spec['choice'], str):
+        if spec['choice'] not in enums:
+            raise ValueError(f"Unknown enum '{spec['choice']}'")
+        return dict(spec, choice=enums[spec['choice']])
+    if 'quota' in spec:
+        return {'quota': [[count, resolve_enums(branch, enums)] for count, branch in spec['quota']]}
+    return spec
+
+
+def spec_kind(spec):
+    """The distribution kind of a column spec"""
+    kinds = [kind for kind in SPEC_KINDS if kind in spec]
+    if len(kinds) != 1:
+        raise ValueError(f"Column spec must have exactly one of {SPEC_KINDS}: {spec!r}")
+    return kinds[0]
+
+
+def spec_issues(column, spec, signal):
+    """Errors and warnings for one column spec against its signal type"""
+    errors, warnings = [], []
+    try:
+        kind = spec_kind(spec)
+    except ValueError as e:
+        return [f"{column}: {e}"], []
+
+    if kind == 'quota':
+        if not spec['quota']:
+            errors.append(f"{column}: quota needs at least one branch")
+        for count, branch in spec['quota']:
+            if not isinstance(count, int) or count < 0:
+                errors.append(f"{column}: quota count must be a non-negative integer, got {count!r}")
+            branch_errors, branch_warnings = spec_issues(column, branch, signal)
+            errors += branch_errors
+            warnings += branch_warnings
+        return errors, warnings
+
+    if kind == 'const':
+        values = [spec['const']]
+    elif kind == 'choice':
+        values = list(spec['choice'])
+        if not values:
+            errors.append(f"{column}: choice needs at least one value")
+        weights = spec.get('weights')
+        if weights is not None and (len(weights) != len(values) or min(weights, default=0) < 0 or sum(weights) <= 0):
+            errors.append(f"{column}: weights must be non-negative, one per value, with a positive sum")
+    elif kind == 'uniform':
+        low, high = spec['uniform']
+        values = [low, high]
+        if low > high:
+            errors.append(f"{column}: uniform low {low} > high {high}")
+        if not isinstance(spec.get('decimals', 2), int):
+            errors.append(f"{column}: decimals must be an integer")
+    elif kind == 'randint':
+        low, high = spec['randint']
+        values = [low, high]
+        if low > high:
+            errors.append(f"{column}: randint low {low} > high {high}")
+    else:  # bernoulli
+        values = [0, 1]
+        if not 0 <= spec['bernoulli'] <= 1:
+            errors.append(f"{column}: bernoulli probability must be within [0, 1]")
+
+    signal_type = signal['type']
+    is_number = all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values)
+    if signal_type == 'bool':
+        if kind == 'uniform' or not set(values) <= {0, 1}:
+            errors.append(f"{column}: bool signal only takes 0/1, got {kind} {values}")
+    elif signal_type == 'int':
+        if kind == 'uniform' or not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+            errors.append(f"{column}: int signal needs integer values, got {kind} {values}")
+    elif signal_type == 'float':
+        if not is_number:
+            errors.append(f"{column}: float signal needs numeric values, got {values}")
+    elif signal_type == 'verdict':
+        if kind == 'uniform' or not set(values) <= set(signal['values']):
+            errors.append(f"{column}: verdict signal only takes {signal['values']}, got {values}")
+    else:  # categorical
+        if kind not in ('const', 'choice') or not all(isinstance(v, str) for v in values):
+            errors.append(f"{column}: categorical signal needs string values, got {kind} {values}")
+        elif signal['values'] is not None:
+            unknown = sorted(set(values) - set(signal['values']))
+            if unknown:
+                warnings.append(f"{column}: values {unknown} are not in the spec vocabulary")
+    return errors, warnings
+
+
+def validate_profile(profile, signal_spec=None):
+    """Check a resolved profile against the signal spec; returns (errors, warnings)"""
+    signal_spec = signal_spec or load_signal_spec()
+    errors, warnings = [], []
+
+    if profile['classification'] not in CLASSES:
+        errors.append(f"classification must be one of {CLASSES}, got {profile['classification']!r}")
+    if not profile['subtypes']:
+        errors.append("at least one subtype is required")
+    for subtype, count in profile['subtypes'].items():
+        if not isinstance(count, int) or count < 0:
+            errors.append(f"subtype '{subtype}': count must be a non-negative integer, got {count!r}")
+    if sum(profile['subtypes'].values()) <= 0:
+        errors.append("subtype counts must add up to more than zero")
+
+    missing = [column for column in signal_spec if column not in profile['columns']]
+    if missing:
+        errors.append(f"missing columns: {', '.join(missing)}")
+    for column in profile['columns']:
+        if column not in signal_spec:
+            errors.append(f"{column}: not a signal in the spec")
+
+    for subtype, columns in profile['overrides'].items():
+        if subtype not in profile['subtypes']:
+            errors.append(f"overrides for unknown subtype '{subtype}'")
+        for column, spec in columns.items():
+            if column in signal_spec and 'quota' in spec:
+                errors.append(f"{column}: quota columns cannot be overridden per subtype")
+
+    for column, signal in signal_spec.items():
+        specs = [profile['columns'][column]] if column in profile['columns'] else []
+        specs += [columns[column] for columns in profile['overrides'].values() if column in columns]
+        for spec in specs:
+            spec_errors, spec_warnings = spec_issues(column, spec, signal)
+            errors += spec_errors
+            warnings += spec_warnings
+
+    if profile['joint_quotas'] and not errors:
+        errors += joint_quota_issues(profile, signal_spec)
+    return errors, sorted(set(warnings))
+
+
+def quota_columns(profile, signal_spec):
+    """Columns drawn from exact quotas, in spec order"""
+    return [column for column in signal_spec if 'quota' in profile['columns'][column]]
+
+
+def quota_constraints(profile, signal_spec):
+    """(dimension names, sizes, constraints) of the sub-type, quota columns and joint quotas
+
+    Joint tables come first, in declaration order, then one marginal per
+    dimension, as quota_allocation.validate_constraints() expects.
+    """
+    columns = quota_columns(profile, signal_spec)
+    names = [SUBTYPE_DIMENSION] + columns
+    sizes = [len(profile['subtypes'])] + [len(profile['columns'][column]['quota']) for column in columns]
+    constraints = [(tuple(names.index(column) for column in joint['columns']), np.array(joint['counts']))
+                   for joint in profile['joint_quotas']]
+    constraints.append(((0,), np.array(list(profile['subtypes'].values()))))
+    for position, column in enumerate(columns, 1):
+        constraints.append(((position,), np.array([count for count, _ in profile['columns'][column]['quota']])))
+    return names, sizes, constraints
+
+
+def joint_quota_issues(profile, signal_spec):
+    """Errors in a profile's joint quotas"""
+    names = [SUBTYPE_DIMENSION] + quota_columns(profile, signal_spec)
+    errors = []
+    for joint in profile['joint_quotas']:
+        columns = joint.get('columns', [])
+        unknown = [column for column in columns if column not in names]
+        if len(columns) < 2 or unknown:
+            errors.append(f"joint quota columns must be two or more of {names}, got {columns}")
+            continue
+        try:
+            np.array(joint.get('counts'), dtype=np.int64)
+        except (TypeError, ValueError):
+            errors.append(f"joint quota {' x '.join(columns)}: counts must be a rectangular nested list of integers")
+    if errors:
+        return errors
+    names, sizes, constraints = quota_constraints(profile, signal_spec)
+    return [f"joint quota {error}" for error in validate_constraints(sizes, constraints, names)]
+
+
+def compile_sampler(spec):
+    """Precompute arrays for one column spec; returns a sampler tuple"""
+    kind = spec_kind(spec)
+    if kind == 'const':
+        return ('const', spec['const'])
+    if kind == 'choice':
+        # Repeated entries act as weights, as in the scripts
+        values, weights = [], []
+        for value, weight in zip(spec['choice'], spec.get('weights') or [1] * len(spec['choice'])):
+            if value in values:
+                weights[values.index(value)] += weight
+            else:
+                values.append(value)
+                weights.append(weight)
+        if len(values) == 1:
+            return ('const', values[0])
+        cumulative = np.cumsum(np.asarray(weights, dtype=np.float64))
+        if np.all(np.asarray(weights) == weights[0]):
+            return ('choice', np.asarray(values), None)
+        return ('choice', np.asarray(values), cumulative / cumulative[-1])
+    if kind == 'uniform':
+        low, high = spec['uniform']
+        return ('uniform', low, high, spec.get('decimals', 2))
+    if kind == 'randint':
+        low, high = spec['randint']
+        return ('randint', low, high + 1)
+    return ('bernoulli', spec['bernoulli'])
+
+
+def compile_profile(config, name, signal_spec=None):
+    """Resolve, validate and compile a profile into a sampling plan"""
+    signal_spec = signal_spec or load_signal_spec()
+    profile = resolve_profile(config, name)
+    errors, warnings = validate_profile(profile, signal_spec)
+    if errors:
+        raise ValueError(f"Invalid profile '{name}':\n" + '\n'.join(f"  - {error}" for error in errors))
+    for warning in warnings:
+        print(f"Warning ({name}): {warning}")
+
+    subtype_names = list(profile['subtypes'])
+    plan = {
+        'name': name,
+        'header': list(signal_spec) + [LABEL_COLUMN],
+        'subtype_names': subtype_names,
+        'shared': [(LABEL_COLUMN, ('const', profile['classification']))],
+        'by_subtype': [],
+        'quotas': [],
+        # Flags and counts are drawn straight into the spec's uint8/int32 dtypes. Scores
+        # stay float64, so written values and row fingerprints match the CSV read back.
+        'dtypes': {column: dtype for column, dtype in signal_dtypes(signal_spec).items()
+                   if isinstance(dtype, np.dtype) and dtype.kind in 'iu'},
+    }
+    for column in signal_spec:
+        spec = profile['columns'][column]
+        if 'quota' in spec:
+            counts = np.array([count for count, _ in spec['quota']], dtype=np.int64)
+            plan['quotas'].append((column, counts, [compile_sampler(branch) for _, branch in spec['quota']]))
+        elif any(column in profile['overrides'].get(subtype, {}) for subtype in subtype_names):
+            samplers = [compile_sampler(profile['overrides'].get(subtype, {}).get(column, spec))
+                        for subtype in subtype_names]
+            plan['by_subtype'].append((column, samplers))
+        else:
+            plan['shared'].append((column, compile_sampler(spec)))
+
+    # Sub-type and quota columns are allocation dimensions; joint quotas link them into blocks
+    names, sizes, constraints = quota_constraints(profile, signal_spec)
+    plan['dimensions'] = names
+    plan['blocks'] = [dict(block, sizes=[sizes[dim] for dim in block['dims']])
+                      for block in constraint_blocks(len(names), constraints)]
+    return plan
+
+
+def draw_column(sampler, n, rng):
+    """Draw n values from a compiled sampler"""
+    kind = sampler[0]
+    if kind == 'const':
+        return np.full(n, sampler[1])
+    if kind == 'choice':
+        _, values, cumulative = sampler
+        if cumulative is None:
+            return values[rng.integers(0, len(values), n)]
+        return values[np.searchsorted(cumulative, rng.random(n), side='right')]
+    if kind == 'uniform':
+        _, low, high, decimals = sampler
+        return np.round(rng.uniform(low, high, n), decimals)
+    if kind == 'randint':
+        return rng.integers(sampler[1], sampler[2], n)
+    if kind == 'bernoulli':
+        return (rng.random(n) < sampler[1]).astype(np.int64)
+    raise ValueError(f"Unknown sampler: {sampler!r}")
+
+
+def fill_by_label(samplers, labels, rng):
+    """Fill one column where row i is drawn from samplers[labels[i]]"""
+    parts = []
+    for index, sampler in enumerate(samplers):
+        mask = labels == index
+        parts.append((mask, draw_column(sampler, int(mask.sum()), rng)))
+    out = np.empty(len(labels), dtype=np.result_type(*[part for _, part in parts]))
+    for mask, part in parts:
+        out[mask] = part
+    return out
+
+
+def run_counts(plan, n_rows):
+    """Exact cell counts of every allocation block for a whole run of n_rows"""
+    return [joint_table(block['sizes'], block['constraints'], n_rows) for block in plan['blocks']]
+
+
+def dimension_counts(plan, n_rows):
+    """Exact row count per category of every allocation dimension for a run of n_rows"""
+    counts = {}
+    for block, table in zip(plan['blocks'], run_counts(plan, n_rows)):
+        for position, dim in enumerate(block['dims']):
+            other = tuple(axis for axis in range(table.ndim) if axis != position)
+            counts[plan['dimensions'][dim]] = table.sum(axis=other)
+    return counts
+
+
+def batch_labels(plan, counts, rng):
+    """Per-row sub-type and quota labels with exact block cell counts, in random order"""
+    labels = [None] * len(plan['dimensions'])
+    for block, table in zip(plan['blocks'], counts):
+        for dim, dim_labels in zip(block['dims'], assign_rows(table, rng)):
+            labels[dim] = dim_labels
+    return {
+        'subtype': labels[0],
+        'quotas': {column: labels[dim] for dim, column in enumerate(plan['dimensions'][1:], 1)},
+    }
+
+
+def select_labels(labels, rows):
+    """The labels of a subset of rows"""
+    return {
+        'subtype': labels['subtype'][rows],
+        'quotas': {column: column_labels[rows] for column, column_labels in labels['quotas'].items()},
+    }
+
+
+def draw_rows(plan, labels, rng):
+    """Draw every column for rows with the given labels"""
+    n = len(labels['subtype'])
+    columns = {}
+    for column, sampler in plan['shared']:
+        columns[column] = draw_column(sampler, n, rng)
+    for column, samplers in plan['by_subtype']:
+        columns[column] = fill_by_label(samplers, labels['subtype'], rng)
+    for column, _, samplers in plan['quotas']:
+        columns[column] = fill_by_label(samplers, labels['quotas'][column], rng)
+    for column, dtype in plan['dtypes'].items():
+        columns[column] = columns[column].astype(dtype, copy=False)
+    return {column: columns[column] for column in plan['header']}
+
+
+def generate_batch(plan, counts, rng):
+    """Generate one batch with exact sub-type and quota counts, column by column"""
+    return draw_rows(plan, batch_labels(plan, counts, rng), rng)
+
+
+def repeated_rows(fingerprints, pending, seen):
+    """Pending rows whose fingerprint is in seen or already taken in the batch"""
+    # Settled rows sort ahead of pending ones, so a repeat always rejects the pending copy
+    order = np.lexsort((pending, fingerprints))
+    ordered = fingerprints[order]
+    repeat = np.zeros(len(fingerprints), dtype=bool)
+    repeat[order[1:]] = ordered[1:] == ordered[:-1]
+    rows = np.flatnonzero(pending)
+    return rows[repeat[rows] | filter_contains(seen, fingerprints[rows])]
+
+
+def enforce_unique(plan, columns, labels, rng, seen):
+    """Redraw rows that repeat seen or the batch itself, keeping their labels
+
+    The batch's fingerprints are added to seen. Returns the number of rows
+    redrawn; raises ValueError if the profile keeps producing repeats.
+    """
+    fingerprints = columns_fingerprints(columns.values())
+    pending = np.ones(len(fingerprints), dtype=bool)
+    redrawn = 0
+    for _ in range(MAX_REDRAW_ROUNDS):
+        rows = repeated_rows(fingerprints, pending, seen)
+        if not len(rows):
+            filter_add(seen, fingerprints)
+            return redrawn
+        redrawn += len(rows)
+        fresh = draw_rows(plan, select_labels(labels, rows), rng)
+        for column, values in fresh.items():
+            columns[column][rows] = values
+        fingerprints[rows] = columns_fingerprints(fresh.values())
+        pending[:] = False
+        pending[rows] = True
+    raise ValueError(f"Profile '{plan['name']}' still repeated {len(rows)} rows after "
+                     f"{MAX_REDRAW_ROUNDS} redraws; it cannot produce enough unique records")
+
+
+def chunk_sizes(n_rows, chunk_size):
+    """Sizes of consecutive chunks covering n_rows"""
+    return [min(chunk_size, n_rows - start) for start in range(0, n_rows, chunk_size)]
+
+
+def batch_state(plan, n_rows, totals=None):
+    """Rows and exact counts still to be generated for a run or shard"""
+    return {
+        'rows_left': n_rows,
+        'cells_left': [np.array(table, dtype=np.int64) for table in totals or run_counts(plan, n_rows)],
+        'redrawn': 0,
+    }
+
+
+def next_labels(plan, state, rng, batch_size=DEFAULT_BATCH_SIZE):
+    """Labels for the next batch; advances state in place"""
+    n = min(batch_size, state['rows_left'])
+    counts = [take_counts(left.reshape(-1), n, rng).reshape(left.shape) for left in state['cells_left']]
+    state['rows_left'] -= n
+    return batch_labels(plan, counts, rng)
+
+
+def next_batch(plan, state, rng, batch_size=DEFAULT_BATCH_SIZE, seen=None):
+    """Generate the next batch and advance state in place
+
+    With a membership filter (seen), rows that repeat a fingerprint in it are
+    redrawn and the count is added to state['redrawn'].
+    """
+    with stage('shuffle', rows=min(batch_size, state['rows_left'])):
+        labels = next_labels(plan, state, rng, batch_size)
+    with stage('generate', rows=len(labels['subtype'])):
+        columns = draw_rows(plan, labels, rng)
+    if seen is not None:
+        with stage('hash', rows=len(labels['subtype'])):
+            state['redrawn'] += enforce_unique(plan, columns, labels, rng, seen)
+    return columns
+
+
+def generate_batches(plan, n_rows, rng, batch_size=DEFAULT_BATCH_SIZE, totals=None, seen=None):
+    """Yield column batches whose counts add up exactly to the run totals"""
+    state = batch_state(plan, n_rows, totals)
+    while state['rows_left'] > 0:
+        yield next_batch(plan, state, rng, batch_size, seen)
+
+
+def state_to_json(state, rng):
+    """Batch state plus RNG state in a JSON-serializable form"""
+    return {
+        'rows_left': state['rows_left'],
+        'cells_left': [left.tolist() for left in state['cells_left']],
+        'redrawn': state['redrawn'],
+        'rng': rng.bit_generator.state,
+    }
+
+
+def state_from_json(saved):
+    """Inverse of state_to_json; returns (state, rng)"""
+    rng = np.random.default_rng()
+    rng.bit_generator.state = saved['rng']
+    state = {
+        'rows_left': saved['rows_left'],
+        'cells_left': [np.array(left, dtype=np.int64) for left in saved['cells_left']],
+        'redrawn': saved['redrawn'],
+    }
+    return state, rng
+
+
+def plan_shards(plan, n_rows, seed, shard_size=DEFAULT_SHARD_SIZE):
+    """Per-shard row counts, exact class/quota counts and RNG seeds"""
+    sizes = chunk_sizes(n_rows, shard_size)
+    allocation_seed, *shard_seeds = np.random.SeedSequence(seed).spawn(len(sizes) + 1)
+    allocation_rng = np.random.default_rng(allocation_seed)
+
+    left = batch_state(plan, n_rows)
+    shards = []
+    for index, size in enumerate(sizes):
+        shards.append({
+            'index': index,
+            'rows': size,
+            'totals': [take_counts(cells.reshape(-1), size, allocation_rng).reshape(cells.shape)
+                       for cells in left['cells_left']],
+            'seed': shard_seeds[index],
+        })
+    return shards
+
+
+def write_shard(writer, plan, shard, batch_size, seen=None):
+    """Stream one shard batch by batch into a CSV writer; returns rows redrawn"""
+    rng = np.random.default_rng(shard['seed'])
+    state = batch_state(plan, shard['rows'], shard['totals'])
+    while state['rows_left'] > 0:
+        write_batch(writer, next_batch(plan, state, rng, batch_size, seen))
+    return state['redrawn']
+
+
+def generate_shard(task):
+    """Generate one shard into its own CSV file (runs in a worker process)"""
+    plan, shard, path, batch_size, write_header, seen = task
+    partial = partial_path(path)
+    with open_csv(partial) as f:
+        writer = csv.writer(f)
+        if write_header:
+            writer.writerow(plan['header'])
+        redrawn = write_shard(writer, plan, shard, batch_size, seen)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, path)
+    return shard['index'], shard['rows'], path, redrawn
+
+
+def shard_path(output, index):
+    """File name of one shard of output"""
+    stem, ext = os.path.splitext(output)
+    return f"{stem}.shard-{index:05d}{ext or '.csv'}"
+
+
+def shard_results(tasks, workers):
+    """Run shard tasks, in a pool when workers > 1; results come back in order"""
+    if workers > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(workers, len(tasks))) as pool:
+            yield from pool.imap(generate_shard, tasks)
+    else:
+        yield from map(generate_shard, tasks)
+
+
+def unique_filter(unique, n_rows, written=()):
+    """Membership filter holding the rows of unique['against'] and of files already written"""
+    return preloaded_filter(list(unique['against']) + list(written), unique['filter'],
+                            n_rows, unique['error_rate'])
+
+
+def generate_sharded(plan, n_rows, output, seed, workers=1, shard_size=DEFAULT_SHARD_SIZE,
+                     batch_size=DEFAULT_BATCH_SIZE, per_shard_files=False, resume=False, unique=None):
+    """Generate n_rows across a process pool; returns the written file paths
+
+    Progress is checkpointed next to the output. With resume=True an
+    interrupted run with the same settings continues where it stopped.
+
+    unique = {'filter', 'against', 'error_rate'} makes every row unique
+    within the run and against the CSVs in 'against': repeated rows are
+    redrawn with the same sub-type and quota labels, so counts stay exact.
+    This needs a single filter, so it runs without a pool.
+    """
+    if unique is not None and workers > 1:
+        raise ValueError("Unique generation checks every row against one filter; use a single worker")
+    shards = plan_shards(plan, n_rows, seed, shard_size)
+    run = {'profile': plan['name'], 'rows': n_rows, 'seed': seed, 'shard_size': shard_size,
+           'batch_size': batch_size, 'per_shard_files': per_shard_files, 'unique': unique}
+    checkpoint = checkpoint_path(output)
+    saved = load_checkpoint(checkpoint) if resume else None
+    if saved is not None and saved['run'] != run:
+        print("  Checkpoint belongs to a different run; starting over")
+        saved = None
+
+    if per_shard_files:
+        done = set(saved['done']) if saved else set()
+        redrawn = saved['redrawn'] if saved else 0
+        if done:
+            print(f"  Resuming: {len(done)} of {len(shards)} shard files already complete")
+        seen = None
+        if unique is not None:
+            seen = unique_filter(unique, n_rows, [shard_path(output, index) for index in sorted(done)])
+        tasks = [(plan, shard, shard_path(output, shard['index']), batch_size, True, seen)
+                 for shard in shards if shard['index'] not in done]
+        for index, rows, path, shard_redrawn in shard_results(tasks, workers):
+            done.add(index)
+            redrawn += shard_redrawn
+            save_checkpoint(checkpoint, {'run': run, 'done': sorted(done), 'redrawn': redrawn})
+            print(f"  Shard {index + 1}/{len(shards)}: wrote {rows} records to {path}")
+        os.remove(checkpoint)
+        if unique is not None:
+            print(f"  Redrew {redrawn} repeated records")
+        return [shard_path(output, shard['index']) for shard in shards]
+
+    # Merged output is built in a partial file and moved into place at the end
+    partial = partial_path(output)
+    if saved is not None:
+        print(f"  Resuming at shard {saved['shard'] + 1}/{len(shards)}")
+        # A pool restarts an unfinished shard from its seed, so it rolls back to the shard start
+        mid_shard = saved['batch'] is not None and workers <= 1
+        rollback(partial, saved['shard_start'] if saved['batch'] is not None and not mid_shard else saved['size'])
+        seen = unique_filter(unique, n_rows, [partial]) if unique is not None else None
+        out = open_csv(partial, 'a')
+    else:
+        mid_shard = False
+        seen = unique_filter(unique, n_rows) if unique is not None else None
+        out = open_csv(partial)
+        csv.writer(out).writerow(plan['header'])
+        saved = {'run': run, 'shard': 0, 'batch': None, 'redrawn': 0}
+        publish(out, checkpoint, saved)
+
+    with out:
+        writer = csv.writer(out)
+        pending = shards[saved['shard']:]
+        for shard in pending:
+            # Leftovers from workers of an interrupted run
+            for path in (shard_path(output, shard['index']), partial_path(shard_path(output, shard['index']))):
+                if os.path.exists(path):
+                    os.remove(path)
+        if workers <= 1 or len(pending) == 1:
+            # No pool: stream every shard straight into the output file
+            for shard in pending:
+                if mid_shard:
+                    state, rng = state_from_json(saved['batch'])
+                    mid_shard = False
+                else:
+                    state = batch_state(plan, shard['rows'], shard['totals'])
+                    rng = np.random.default_rng(shard['seed'])
+                    saved['shard_start'] = os.fstat(out.fileno()).st_size
+                while state['rows_left'] > 0:
+                    write_batch(writer, next_batch(plan, state, rng, batch_size, seen))
+                    saved.update(shard=shard['index'], batch=state_to_json(state, rng))
+                    publish(out, checkpoint, saved)
+                saved.update(shard=shard['index'] + 1, batch=None, redrawn=saved['redrawn'] + state['redrawn'])
+                publish(out, checkpoint, saved)
+                print(f"  Shard {shard['index'] + 1}/{len(shards)}: wrote {shard['rows']} records")
+        else:
+            # Shards arrive in order, so they can be appended as they finish
+            tasks = [(plan, shard, shard_path(output, shard['index']), batch_size, False, None)
+                     for shard in pending]
+            for index, rows, path, _ in shard_results(tasks, workers):
+                with open(path, newline='') as shard_file:
+                    shutil.copyfileobj(shard_file, out, WRITE_BUFFER_SIZE)
+                saved.update(shard=index + 1, batch=None)
+                publish(out, checkpoint, saved)
+                os.remove(path)
+                print(f"  Shard {index + 1}/{len(shards)}: merged {rows} records")
+
+    finish(partial, output, checkpoint)
+    if unique is not None:
+        print(f"  Redrew {saved['redrawn']} repeated records")
+    return [output]
+
+
+def format_column(values):
+    """Render a column as CSV strings through a lookup table of its distinct values"""
+    if values.dtype.kind in 'iuf':
+        distinct, codes = np.unique(values, return_inverse=True)
+        table = np.array([str(value) for value in distinct.tolist()], dtype=object)
+        return table[codes]
+    return values.astype(object)
+
+
+def write_batch(writer, columns):
+    """Write a column batch as CSV rows in column order"""
+    with stage('write', rows=len(next(iter(columns.values()), []))):
+        writer.writerows(zip(*(format_column(values) for values in columns.values())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', default='spam_250_v3', help='Profile name in the profiles file')
+    parser.add_argument('--profiles-file', default=PROFILES_FILE)
+    parser.add_argument('--rows', type=int, default=250, help='Total number of records to generate')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--seed', type=int, default=None, help='Run seed (random if omitted; printed for reuse)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE,
+                        help='Rows per shard; output depends on this, not on --workers')
+    parser.add_argument('--per-shard-files', action='store_true',
+                        help='Write one CSV per shard instead of merging them')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run with the same settings from its checkpoint')
+    parser.add_argument('--unique', action='store_true',
+                        help='Redraw rows that repeat an earlier row of the run (single worker only)')
+    parser.add_argument('--unique-against', nargs='+', default=[], metavar='CSV',
+                        help='Existing CSVs rows must also differ from (implies --unique)')
+    parser.add_argument('--unique-filter', choices=FILTER_KINDS, default='exact',
+                        help='exact hash set, or a smaller Bloom filter with rare needless redraws')
+    parser.add_argument('--bloom-error-rate', type=float, default=DEFAULT_ERROR_RATE)
+    parser.add_argument('--output', help='Output CSV (default: <profile>_<rows>.csv in the data directory)')
+    args = parser.parse_args()
+    if (args.unique or args.unique_against) and args.workers > 1:
+        parser.error('--unique needs --workers 1')
+
+    try:
+        plan = compile_profile(load_profiles(args.profiles_file), args.profile)
+    except ValueError as e:
+        parser.error(str(e))
+    output = args.output or os.path.join(DATA_DIR, f"{args.profile}_{args.rows}.csv")
+    seed = args.seed
+    if seed is None and args.resume:
+        saved = load_checkpoint(checkpoint_path(output))
+        seed = saved['run']['seed'] if saved else None
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    print(f"Generating {args.rows} '{args.profile}' records with seed {seed} "
+          f"({args.workers} worker(s), shards of {args.shard_size})...")
+    unique = None
+    if args.unique or args.unique_against:
+        unique = {'filter': args.unique_filter, 'error_rate': args.bloom_error_rate,
+                  'against': [os.path.abspath(path) for path in args.unique_against]}
+    try:
+        paths = generate_sharded(plan, args.rows, output, seed, args.workers, args.shard_size,
+                                 args.batch_size, args.per_shard_files, args.resume, unique)
+    except ValueError as e:
+        parser.exit(1, f"error: {e}\n")
+
+    print(f"\nSuccessfully created {len(paths)} file(s) with {args.rows} records:")
+    for path in paths:
+        print(f"  {path}")
+
+
+if __name__ == "__main__":
+    run(main)
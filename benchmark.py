@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmarks for generation, loading, analysis and dedup.
+
+Every stage runs at each size in --sizes on synthetic inputs drawn by
+batch_generator.py (profiles spam_250_v3 and no_action_50, fixed seed), in
+a fresh process so its peak RSS is its own:
+
+    generate:<profile>     batch_generator profile, written to CSV
+    legacy:<script>        the script's record function, one row at a time
+    load:read_dataset      CSV parse (row_fingerprint.read_dataset)
+    load:cache_cold        parse and store in an empty dataset cache
+    load:cache_warm        load from the dataset cache
+    load:splits            split-by-split parse (streaming_stats)
+    load:matrix_store      map a matrix_store.py store and read every array
+    analyze:no_action      the analyze_no_action_signals.py rule checks
+    dedup:check            the check_duplicates.py fingerprint and grouping
+    validate:spec          the signal_validator.py value checks
+    store:export           export the CSV to a matrix_store.py store
+    features:materialize   the feature_matrix.py design matrix, written to disk
+    analyze:reference      the reference_scorer.py class scores of every row
+
+A stage is repeated until it has run for MIN_STAGE_SECONDS (at most
+MAX_REPEATS times) and its fastest run is reported, with the time of each
+phase (e.g. load / fingerprint / group for dedup). Results are written as
+JSON and compared with a stored baseline (benchmark_baseline.json): a stage
+is a regression when its rows/sec drops, or its peak RSS grows, by more
+than --tolerance (slowdowns under MIN_REGRESSION_SECONDS are ignored).
+Stages and sizes with no baseline entry are listed, not compared.
+
+--save-baseline replaces the baseline entries of the stages and sizes that
+were run and keeps the rest. The stored baseline covers BASELINE_SIZES
+only: at 10M rows the load stages peak at about 11 GB of RSS, more than
+the machine it was measured on has.
+
+Usage:
+    python benchmark.py [--sizes 1k,100k,1M,10M] [--stages 'load:*'] [--save-baseline]
+"""
+
+import argparse
+import contextlib
+import csv
+import fnmatch
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+import generate_no_action_50
+import generate_spam_250_v3
+import generate_spam_records
+from batch_generator import compile_profile, generate_sharded, load_profiles
+from data_paths import CODE_DIR
+from feature_matrix import materialize
+from dataset_cache import load_dataset
+from instrumentation import peak_rss_mb, run
+from matrix_store import ARRAY_DTYPES, export_store, open_store
+from merge_corpus import source_plan
+from quota_allocation import scale_counts
+from reference_scorer import SCORING_FILE, compile_scoring, read_options, score_frame
+from record_writer import draw_quota, open_csv
+from row_fingerprint import duplicate_groups, frame_fingerprints, read_dataset
+from signal_rules import compile_rules, evaluate, load_rules, schema_family
+from signal_schema import apply_signal_dtypes
+from signal_validator import READ_OPTIONS, compile_checks, frame_violations
+from streaming_stats import DEFAULT_SPLIT_MB, file_splits, read_split
+
+BASELINE_FILE = os.path.join(CODE_DIR, 'benchmark_baseline.json')
+RESULTS_VERSION = 1
+DEFAULT_SIZES = '1k,100k,1M,10M'
+# Sizes benchmark_baseline.json is refreshed at
+BASELINE_SIZES = '1k,100k,1M'
+SIZE_SUFFIXES = {'k': 1000, 'M': 1000000, 'G': 1000000000}
+DEFAULT_TOLERANCE = 0.25
+INPUT_SEED = 20240601
+# Inputs each kind of stage reads (None: the stage writes its own rows)
+INPUT_PROFILES = {'spam': 'spam_250_v3', 'no_action': 'no_action_50'}
+MIN_STAGE_SECONDS = 0.5
+# Slowdowns smaller than this are timer noise, whatever the ratio
+MIN_REGRESSION_SECONDS = 0.05
+MAX_REPEATS = 20
+# Legacy scripts write a fixed 250 or 50 records; these are their quotas, scaled to the run
+LEGACY_QUOTAS = {
+    'spam_types': Counter({'clear': 60, 'moderate': 140, 'borderline': 50}),
+    'bulk_indicators': Counter({1: 170, 0: 80}),
+    'geo_distribution': Counter({True: 100, False: 150}),
+    'border_cases': Counter({False: 30, True: 20}),
+}
+LEGACY_CHUNK_SIZE = 10000
+
+
+def parse_size(text):
+    """Row count from text such as 250, 100k or 1M"""
+    text = text.strip()
+    scale = SIZE_SUFFIXES.get(text[-1:], 1)
+    return int(float(text[:-1] if text[-1:] in SIZE_SUFFIXES else text) * scale)
+
+
+def size_label(n):
+    """Short label for a row count (1k, 10M)"""
+    for suffix, scale in sorted(SIZE_SUFFIXES.items(), key=lambda item: -item[1]):
+        if n >= scale and n % scale == 0:
+            return f"{n // scale}{suffix}"
+    return str(n)
+
+
+@contextlib.contextmanager
+def timed(phases, name):
+    """Add the time spent in the block to phases[name]"""
+    start = time.perf_counter()
+    yield
+    phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+
+def scaled_quota(quota, n_rows):
+    """A legacy quota scaled to n_rows (largest remainder)"""
+    return Counter(dict(zip(quota, scale_counts(list(quota.values()), n_rows).tolist())))
+
+
+def generate_profile(profile, n_rows, output):
+    """Generate n_rows of a batch_generator profile into output, quietly"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        plan = compile_profile(load_profiles(), profile)
+        generate_sharded(plan, n_rows, output, INPUT_SEED)
+
+
+def stage_generate(profile):
+    """Stage: a batch_generator profile"""
+    def run(n_rows, path, workdir):
+        phases = {}
+        with timed(phases, 'generate'):
+            generate_profile(profile, n_rows, os.path.join(workdir, 'generated.csv'))
+        return phases
+    return run
+
+
+def legacy_spam_records(n_rows, writer_file):
+    """generate_spam_records.py: dict records written through a DictWriter"""
+    remaining = scaled_quota(LEGACY_QUOTAS['spam_types'], n_rows)
+    writer = None
+    for start in range(0, n_rows, LEGACY_CHUNK_SIZE):
+        spam_types = draw_quota(remaining, min(LEGACY_CHUNK_SIZE, n_rows - start))
+        batch = [generate_spam_records.generate_spam_record(spam_type, start + j)
+                 for j, spam_type in enumerate(spam_types)]
+        if writer is None:
+            writer = csv.DictWriter(writer_file, fieldnames=list(batch[0]))
+            writer.writeheader()
+        writer.writerows(batch)
+
+
+def legacy_spam_250_v3(n_rows, writer_file):
+    """generate_spam_250_v3.py: list records under three quotas"""
+    quotas = [scaled_quota(LEGACY_QUOTAS[name], n_rows)
+              for name in ('spam_types', 'bulk_indicators', 'geo_distribution')]
+    writer = csv.writer(writer_file)
+    writer.writerow(generate_spam_250_v3.header)
+    for start in range(0, n_rows, LEGACY_CHUNK_SIZE):
+        n = min(LEGACY_CHUNK_SIZE, n_rows - start)
+        writer.writerows(generate_spam_250_v3.generate_spam_record(*labels)
+                         for labels in zip(*(draw_quota(quota, n) for quota in quotas)))
+
+
+def legacy_no_action_50(n_rows, writer_file):
+    """generate_no_action_50.py: list records, clear or border case"""
+    border_cases = scaled_quota(LEGACY_QUOTAS['border_cases'], n_rows)
+    writer = csv.writer(writer_file)
+    writer.writerow(generate_no_action_50.header)
+    for start in range(0, n_rows, LEGACY_CHUNK_SIZE):
+        n = min(LEGACY_CHUNK_SIZE, n_rows - start)
+        writer.writerows(generate_no_action_50.generate_no_action_record(is_border_case=is_border_case)
+                         for is_border_case in draw_quota(border_cases, n))
+
+
+def stage_legacy(generate):
+    """Stage: a legacy generator script's record function"""
+    def run(n_rows, path, workdir):
+        phases = {}
+        with timed(phases, 'generate'):
+            with open_csv(os.path.join(workdir, 'legacy.csv')) as f:
+                generate(n_rows, f)
+        return phases
+    return run
+
+
+def stage_read_dataset(n_rows, path, workdir):
+    """Stage: parse the CSV"""
+    phases = {}
+    with timed(phases, 'parse'):
+        read_dataset(path)
+    return phases
+
+
+def stage_cache_cold(n_rows, path, workdir):
+    """Stage: parse the CSV and store it in an empty cache"""
+    cache_dir = tempfile.mkdtemp(dir=workdir)
+    phases = {}
+    with timed(phases, 'parse_and_store'):
+        load_dataset(path, cache_dir)
+    shutil.rmtree(cache_dir)
+    return phases
+
+
+def stage_cache_warm(n_rows, path, workdir):
+    """Stage: load the frame from a warm cache"""
+    cache_dir = os.path.join(workdir, 'cache')
+    load_dataset(path, cache_dir)
+    phases = {}
+    with timed(phases, 'load'):
+        load_dataset(path, cache_dir)
+    return phases
+
+
+def stage_splits(n_rows, path, workdir):
+    """Stage: parse the CSV split by split"""
+    header = list(pd.read_csv(path, nrows=0).columns)
+    phases = {}
+    with timed(phases, 'parse'):
+        for split in file_splits(path, DEFAULT_SPLIT_MB * 1024 * 1024):
+            read_split(*split, header)
+    return phases
+
+
+def stage_matrix_store(n_rows, path, workdir):
+    """Stage: map a matrix store and read every array through the mapping"""
+    store_dir = os.path.join(workdir, 'store')
+    if not os.path.exists(store_dir):
+        export_store([path], store_dir)
+    phases = {}
+    with timed(phases, 'open'):
+        store = open_store(store_dir)
+    with timed(phases, 'scan'):
+        for array in ARRAY_DTYPES:
+            store[array].sum()
+    return phases
+
+
+def stage_analyze(n_rows, path, workdir):
+    """Stage: the No Action rule checks (analyze_no_action_signals.analyze_file, by phase)"""
+    config = load_rules()
+    phases = {}
+    with timed(phases, 'load'):
+        df = read_dataset(path)
+    with timed(phases, 'dtypes'):
+        df = apply_signal_dtypes(df)
+    with timed(phases, 'rules'):
+        family = schema_family(config, df.columns)
+        evaluate(compile_rules(config, family, df.columns), df)
+    return phases
+
+
+def stage_dedup(n_rows, path, workdir):
+    """Stage: duplicate detection (check_duplicates.check_duplicates_in_file, by phase)"""
+    phases = {}
+    with timed(phases, 'load'):
+        df = read_dataset(path)
+    with timed(phases, 'fingerprint'):
+        fingerprints = frame_fingerprints(df)
+    with timed(phases, 'group'):
+        duplicate_groups(fingerprints)
+    return phases
+
+
+def stage_validate(n_rows, path, workdir):
+    """Stage: the spec value checks (signal_validator.split_violations, by phase)"""
+    header = list(pd.read_csv(path, nrows=0).columns)
+    validator = compile_checks(header)
+    phases = {}
+    for split in file_splits(path, DEFAULT_SPLIT_MB * 1024 * 1024):
+        with timed(phases, 'parse'):
+            df = read_split(*split, header, dtype=validator['dtypes'], **READ_OPTIONS)
+        if df is not None:
+            with timed(phases, 'check'):
+                frame_violations(df, validator)
+    return phases
+
+
+def stage_reference(n_rows, path, workdir):
+    """Stage: the reference_scorer.py class scores (by phase)"""
+    plan = source_plan(path)
+    with open(SCORING_FILE) as f:
+        scoring = compile_scoring(json.load(f), plan['columns'])
+    phases = {}
+    for split in file_splits(path, DEFAULT_SPLIT_MB * 1024 * 1024):
+        with timed(phases, 'parse'):
+            df = read_split(*split, plan['columns'], **read_options(plan))
+        if df is not None:
+            with timed(phases, 'score'):
+                score_frame(scoring, df)
+    return phases
+
+
+def stage_store_export(n_rows, path, workdir):
+    """Stage: export the CSV to a matrix store"""
+    store_dir = tempfile.mkdtemp(dir=workdir)
+    phases = {}
+    with timed(phases, 'export'):
+        export_store([path], os.path.join(store_dir, 'store'))
+    shutil.rmtree(store_dir)
+    return phases
+
+
+def stage_features(n_rows, path, workdir):
+    """Stage: materialize the design matrix of the CSV"""
+    features_dir = tempfile.mkdtemp(dir=workdir)
+    phases = {}
+    with timed(phases, 'materialize'):
+        materialize([path], os.path.join(features_dir, 'features'))
+    shutil.rmtree(features_dir)
+    return phases
+
+
+# name -> (input kind, stage function)
+STAGES = {
+    'generate:spam_records': (None, stage_generate('spam_records')),
+    'generate:spam_250_v3': (None, stage_generate('spam_250_v3')),
+    'generate:no_action_50': (None, stage_generate('no_action_50')),
+    'legacy:generate_spam_records': (None, stage_legacy(legacy_spam_records)),
+    'legacy:generate_spam_250_v3': (None, stage_legacy(legacy_spam_250_v3)),
+    'legacy:generate_no_action_50': (None, stage_legacy(legacy_no_action_50)),
+    'load:read_dataset': ('spam', stage_read_dataset),
+    'load:cache_cold': ('spam', stage_cache_cold),
+    'load:cache_warm': ('spam', stage_cache_warm),
+    'load:splits': ('spam', stage_splits),
+    'load:matrix_store': ('spam', stage_matrix_store),
+    'analyze:no_action': ('no_action', stage_analyze),
+    'dedup:check': ('spam', stage_dedup),
+    'validate:spec': ('spam', stage_validate),
+    'store:export': ('spam', stage_store_export),
+    'features:materialize': ('spam', stage_features),
+    'analyze:reference': ('spam', stage_reference),
+}
+
+
+def run_stage(task):
+    """Fastest of repeated runs of one stage at one size (runs in its own process)"""
+    name, n_rows, path, workdir = task
+    stage = STAGES[name][1]
+    stage_dir = tempfile.mkdtemp(dir=workdir)
+    best = None
+    spent = 0.0
+    for _ in range(MAX_REPEATS):
+        phases = stage(n_rows, path, stage_dir)
+        seconds = sum(phases.values())
+        spent += seconds
+        if best is None or seconds < sum(best.values()):
+            best = phases
+        if spent >= MIN_STAGE_SECONDS:
+            break
+    shutil.rmtree(stage_dir)
+    return {'phases': best, 'peak_rss_mb': round(peak_rss_mb(), 1)}
+
+
+def make_input(task):
+    """Write a synthetic input file (runs in its own process)"""
+    profile, n_rows, path = task
+    generate_profile(profile, n_rows, path)
+    return path
+
+
+def in_process(function, task):
+    """function(task) in a fresh process"""
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(function, (task,))
+
+
+def run_benchmarks(names, sizes, workdir):
+    """Results of every stage at every size"""
+    results = []
+    for n_rows in sizes:
+        inputs = {}
+        for name in names:
+            kind = STAGES[name][0]
+            if kind is not None and kind not in inputs:
+                path = os.path.join(workdir, f"{INPUT_PROFILES[kind]}_{size_label(n_rows)}.csv")
+                if not os.path.exists(path):
+                    print(f"Generating {size_label(n_rows)} {INPUT_PROFILES[kind]} input...")
+                    in_process(make_input, (INPUT_PROFILES[kind], n_rows, path))
+                inputs[kind] = path
+            outcome = in_process(run_stage, (name, n_rows, inputs.get(kind), workdir))
+            seconds = sum(outcome['phases'].values())
+            result = {'stage': name, 'rows': n_rows, 'seconds': round(seconds, 6),
+                      'rows_per_sec': round(n_rows / seconds, 1) if seconds else None,
+                      'peak_rss_mb': outcome['peak_rss_mb'],
+                      'phases': {phase: round(value, 6) for phase, value in outcome['phases'].items()}}
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def machine_info():
+    """Where the results were measured"""
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count(),
+            'numpy': np.__version__, 'pandas': pd.__version__}
+
+
+def merge_baseline(baseline, report):
+    """The baseline with the entries of report's stages and sizes replaced"""
+    measured = {(result['stage'], result['rows']) for result in report['results']}
+    kept = [entry for entry in baseline['results'] if (entry['stage'], entry['rows']) not in measured]
+    return dict(report, results=kept + report['results'])
+
+
+def missing_baseline(results, baseline):
+    """Results with no baseline entry for their stage and size"""
+    known = {(entry['stage'], entry['rows']) for entry in baseline['results']}
+    return [result for result in results if (result['stage'], result['rows']) not in known]
+
+
+def compare(results, baseline, tolerance):
+    """Regressions against the baseline: [(result, baseline result, reasons)]"""
+    known = {(entry['stage'], entry['rows']): entry for entry in baseline['results']}
+    regressions = []
+    for result in results:
+        before = known.get((result['stage'], result['rows']))
+        # Listed by missing_baseline
+        if before is None:
+            continue
+        reasons = []
+        if result['rows_per_sec'] and before['rows_per_sec'] and \
+                result['rows_per_sec'] < before['rows_per_sec'] * (1 - tolerance) and \
+                result['seconds'] - before['seconds'] > MIN_REGRESSION_SECONDS:
+            reasons.append(f"{result['rows_per_sec'] / before['rows_per_sec']:.2f}x the baseline rows/sec")
+        if result['peak_rss_mb'] > before['peak_rss_mb'] * (1 + tolerance):
+            reasons.append(f"peak RSS {before['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB")
+        if reasons:
+            regressions.append((result, before, reasons))
+    return regressions
+
+
+def print_result(result):
+    """One result line"""
+    phases = ', '.join(f"{phase} {seconds:.3f}s" for phase, seconds in result['phases'].items())
+    rate = f"{result['rows_per_sec']:,.0f}" if result['rows_per_sec'] else '-'
+    print(f"{result['stage']:<30} {size_label(result['rows']):>5} {result['seconds']:>10.3f}s "
+          f"{rate:>14} rows/s {result['peak_rss_mb']:>8.0f} MB  ({phases})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark generation, loading, analysis and dedup throughput')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Comma-separated row counts (e.g. 1k,100k,1M)')
+    parser.add_argument('--stages', nargs='+', default=['*'], metavar='PATTERN',
+                        help=f"Stages to run (glob patterns): {', '.join(STAGES)}")
+    parser.add_argument('--output', default='benchmark_results.json', help='Where to write the results')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help=f"Store these results in the baseline (kept at {BASELINE_SIZES})")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed relative drop in rows/sec or growth in peak RSS')
+    parser.add_argument('--work-dir', default=None,
+                        help='Where synthetic inputs are written and kept for later runs '
+                             '(default: a temporary directory)')
+    args = parser.parse_args()
+
+    names = [name for name in STAGES if any(fnmatch.fnmatch(name, pattern) for pattern in args.stages)]
+    if not names:
+        parser.error(f"no stage matches {' '.join(args.stages)}")
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+
+    workdir = args.work_dir or tempfile.mkdtemp(prefix='spam_benchmark_')
+    os.makedirs(workdir, exist_ok=True)
+    print(f"{'Stage':<30} {'Rows':>5} {'Time':>11} {'Throughput':>21} {'Peak RSS':>11}")
+    try:
+        results = run_benchmarks(names, sizes, workdir)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(workdir)
+
+    report = {'version': RESULTS_VERSION, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'machine': machine_info(), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(merge_baseline(baseline, report) if baseline else report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to store one")
+        return
+    if baseline['machine'] != report['machine']:
+        print(f"Note: the baseline was measured on a different setup ({baseline['machine']['platform']}, "
+              f"{baseline['machine']['cpus']} CPUs, pandas {baseline['machine']['pandas']})")
+    missing = missing_baseline(results, baseline)
+    if missing:
+        print(f"\n{len(missing)} results with no baseline entry (not compared):")
+        for result in missing:
+            print(f"  {result['stage']} at {size_label(result['rows'])}")
+    regressions = compare(results, baseline, args.tolerance)
+    if not regressions:
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+        return
+    print(f"\n{len(regressions)} regressions against {args.baseline}:")
+    for result, before, reasons in regressions:
+        print(f"  {result['stage']} at {size_label(result['rows'])}: {'; '.join(reasons)}")
+    parser.exit(1)
+
+
+if __name__ == "__main__":
+    run(main)
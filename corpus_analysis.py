@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Analyze every dataset CSV in parallel and merge the results into one report.
+
+Files are discovered in the data directory (No_Action-v*, No_Action_100_v*,
+no_action_*, spam_*, *_combined, ...), and each one is read once in a worker
+process and converted to the spec dtypes (signal_schema.py). Each file's
+schema family is detected from its columns (see no_action_rules.json), and
+the family's rule set runs through the compiled rule engine in
+signal_rules.py. Workers also collect label counts, missing values,
+within-file duplicates, authentication pass rates and columns whose values
+do not fit their spec dtype.
+
+Per-file results are merged into a JSON report with totals per family and
+label, and a summary table is printed. Files are handed out largest first,
+so wall time follows the core count rather than the file count.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_paths import DATA_DIR, dataset_files
+from dataset_cache import load_dataset
+from instrumentation import run, stage
+from row_fingerprint import frame_fingerprints
+from schema_migration import MAPPINGS_FILE, frame_to_canonical, load_mappings, measured_columns
+from signal_schema import apply_signal_dtypes
+from signal_rules import (RULES_FILE, compile_rules, evaluate, issue_messages, load_rules, parse_overrides,
+                          schema_family)
+from signal_spec import LABEL_COLUMN, canonical_header
+
+REPORT_FILE = os.path.join(DATA_DIR, 'corpus_report.json')
+UNKNOWN_FAMILY = 'unknown'
+MISSING_LABEL = '<missing>'
+MALFORMED_LABEL = '<malformed>'
+# Columns listed in the summary's spec dtype line
+DTYPE_COLUMNS_SHOWN = 10
+# Text results counted as a pass, and 0/1 flag columns, for the auth pass rates
+AUTH_RESULT_COLUMNS = ['spf_result', 'dkim_result', 'dmarc_result']
+AUTH_FLAG_COLUMNS = ['email_authentication_spf_pass', 'email_authentication_dkim_pass',
+                     'email_authentication_dmarc_pass']
+
+
+def label_counts(df):
+    """Records per class label (matched case-insensitively to the label column)
+
+    Malformed rows, whose extra fields read_dataset folded into the last
+    column, have no usable label and are counted under MALFORMED_LABEL.
+    """
+    for name in df.columns:
+        if str(name).strip().lower() == LABEL_COLUMN:
+            labels = df[name].astype(object).fillna(MISSING_LABEL).astype(str).to_numpy(dtype=object)
+            labels[df.attrs.get('folded_rows', [])] = MALFORMED_LABEL
+            counts = pd.Series(labels).value_counts()
+            return {label: int(count) for label, count in counts.items()}
+    return {}
+
+
+def auth_pass_rates(df):
+    """Share of records passing SPF/DKIM/DMARC, for whichever encoding the file uses"""
+    rates = {}
+    columns = measured_columns(df)
+    for column in AUTH_RESULT_COLUMNS:
+        if column in columns:
+            rates[column] = round(float((df[column] == 'pass').mean()), 4) if len(df) else None
+    for column in AUTH_FLAG_COLUMNS:
+        if column in columns:
+            rates[column] = round(float((df[column] == 1).mean()), 4) if len(df) else None
+    return rates
+
+
+def analyze_path(task):
+    """Analyze one file (runs in a worker process)"""
+    path, config, overrides, mappings = task
+    started = time.perf_counter()
+    result = {'file': os.path.basename(path), 'path': os.path.abspath(path), 'size_bytes': os.path.getsize(path)}
+    try:
+        df = load_dataset(path)
+        # Fingerprint the parsed values, so duplicates match check_duplicates.py
+        fingerprints = frame_fingerprints(df)
+        if mappings is not None:
+            df = frame_to_canonical(df, mappings)
+        df = apply_signal_dtypes(df)
+        family = schema_family(config, df.columns)
+        result.update({
+            'rows': len(df),
+            'columns': len(df.columns),
+            'canonical_header': [str(name).strip() for name in df.columns] == canonical_header(),
+            'migrated_from': df.attrs.get('migrated_from'),
+            'family': family or UNKNOWN_FAMILY,
+            'labels': label_counts(df),
+            'malformed_rows': len(df.attrs.get('folded_rows', [])),
+            'missing_values': int(df.isna().to_numpy().sum()),
+            'within_file_duplicates': int(len(fingerprints) - len(np.unique(fingerprints))),
+            'auth_pass_rates': auth_pass_rates(df),
+            'dtype_errors': df.attrs['dtype_errors'],
+        })
+        if family is not None:
+            plan = compile_rules(config, family, measured_columns(df), overrides)
+            evaluation = evaluate(plan, df)
+            result['rows_with_issues'] = evaluation['rows_with_issues']
+            result['rules'] = {rule['name']: count for rule, count in zip(plan['rules'], evaluation['counts'])}
+            result['issues'] = issue_messages(plan, evaluation)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def analyze_corpus(paths, config, overrides=None, workers=None, mappings=None):
+    """Per-file results for paths, in path order, computed by a process pool
+
+    With mappings, legacy schema files are migrated to the canonical schema
+    (schema_migration.py) before the rules run; columns the migration filled
+    with defaults are not checked.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Largest files first, so one big file does not start last and hold up the pool
+    tasks = [(path, config, overrides, mappings) for path in sorted(paths, key=os.path.getsize, reverse=True)]
+    if workers > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(workers, len(tasks))) as pool:
+            results = list(pool.imap_unordered(analyze_path, tasks))
+    else:
+        results = [analyze_path(task) for task in tasks]
+    order = {os.path.abspath(path): index for index, path in enumerate(paths)}
+    return sorted(results, key=lambda result: order[result['path']])
+
+
+def merge_results(results):
+    """Corpus totals per family and label from per-file results"""
+    totals = {'files': len(results), 'rows': 0, 'malformed_rows': 0, 'labels': {}, 'families': {}, 'errors': 0,
+              'dtype_errors': {}}
+    for result in results:
+        if 'error' in result:
+            totals['errors'] += 1
+            continue
+        totals['rows'] += result['rows']
+        totals['malformed_rows'] += result['malformed_rows']
+        for column in result['dtype_errors']:
+            totals['dtype_errors'][column] = totals['dtype_errors'].get(column, 0) + 1
+        for label, count in result['labels'].items():
+            totals['labels'][label] = totals['labels'].get(label, 0) + count
+        family = totals['families'].setdefault(result['family'], {
+            'files': 0, 'rows': 0, 'rows_with_issues': 0, 'within_file_duplicates': 0, 'rules': {}})
+        family['files'] += 1
+        family['rows'] += result['rows']
+        family['within_file_duplicates'] += result['within_file_duplicates']
+        family['rows_with_issues'] += result.get('rows_with_issues', 0)
+        for name, count in result.get('rules', {}).items():
+            family['rules'][name] = family['rules'].get(name, 0) + count
+    return totals
+
+
+def print_summary(results, totals):
+    """Summary table of the per-file results and corpus totals"""
+    width = max([len(result['file']) for result in results] + [4])
+    print(f"{'File':<{width}}  {'Family':<9} {'Rows':>7} {'Cols':>5} {'Dups':>5} {'Issues':>7}  Labels")
+    print('-' * (width + 50))
+    for result in results:
+        if 'error' in result:
+            print(f"{result['file']:<{width}}  ERROR: {result['error']}")
+            continue
+        labels = ', '.join(f"{label}={count}" for label, count in result['labels'].items())
+        issues = result.get('rows_with_issues', '-')
+        print(f"{result['file']:<{width}}  {result['family']:<9} {result['rows']:>7} {result['columns']:>5} "
+              f"{result['within_file_duplicates']:>5} {issues:>7}  {labels}")
+
+    print(f"\nTotal: {totals['rows']} records ({totals['malformed_rows']} malformed) in {totals['files']} files "
+          f"({totals['errors']} failed)")
+    for label, count in sorted(totals['labels'].items(), key=lambda item: -item[1]):
+        print(f"  {label}: {count}")
+    if totals['dtype_errors']:
+        ranked = sorted(totals['dtype_errors'].items(), key=lambda item: -item[1])
+        more = f" (+{len(ranked) - DTYPE_COLUMNS_SHOWN} more columns)" if len(ranked) > DTYPE_COLUMNS_SHOWN else ""
+        print(f"\nValues outside the spec dtype (files): "
+              f"{', '.join(f'{column}={count}' for column, count in ranked[:DTYPE_COLUMNS_SHOWN])}{more}")
+    for name, family in totals['families'].items():
+        print(f"\n{name}: {family['files']} files, {family['rows']} records, "
+              f"{family['rows_with_issues']} with rule violations")
+        for rule, count in family['rules'].items():
+            if count:
+                print(f"  {rule}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='CSV files (default: every dataset CSV in --data-dir)')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--rules', default=RULES_FILE)
+    parser.add_argument('--set', dest='overrides', action='append', default=[], metavar='NAME=VALUE',
+                        help='Override a rule threshold, e.g. --set spam_score_threshold=0.4')
+    parser.add_argument('--canonical', action='store_true',
+                        help='Migrate legacy schema files to the canonical schema before analysis')
+    parser.add_argument('--mappings', default=MAPPINGS_FILE, help='Schema mappings file for --canonical')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--output', default=REPORT_FILE, help='JSON report path')
+    args = parser.parse_args()
+
+    config = load_rules(args.rules)
+    try:
+        overrides = parse_overrides(args.overrides, config.get('params', {}))
+    except ValueError as e:
+        parser.error(str(e))
+
+    paths = args.files or dataset_files(args.data_dir)
+    if not paths:
+        parser.error(f'no CSV files found in {args.data_dir}')
+
+    started = time.perf_counter()
+    mappings = load_mappings(args.mappings) if args.canonical else None
+    results = analyze_corpus(paths, config, overrides, args.workers, mappings)
+    totals = merge_results(results)
+    elapsed = time.perf_counter() - started
+
+    with stage('report'):
+        print_summary(results, totals)
+        report = {'data_dir': os.path.abspath(args.data_dir), 'params': {**config.get('params', {}), **overrides},
+                  'seconds': round(elapsed, 3), 'totals': totals, 'files': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nAnalyzed {len(paths)} files in {elapsed:.1f}s; report written to {args.output}")
+
+
+if __name__ == "__main__":
+    run(main)
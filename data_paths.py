@@ -0,0 +1,29 @@
+"""
+Where the scripts find their files.
+
+Config files (the signal spec, generator profiles, rules, schema mappings,
+the benchmark baseline) ship with the code in CODE_DIR. Dataset CSVs and
+everything built from them (the parse cache, dedup index, reports and
+generated files) live in DATA_DIR, which is CODE_DIR unless SPAM_DATA_ROOT
+points elsewhere (spam_data.py --data-root sets it).
+
+Standard library only, so light commands can use it without loading pandas.
+"""
+
+import glob
+import os
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.abspath(os.environ.get('SPAM_DATA_ROOT') or CODE_DIR)
+SPEC_FILE_NAME = 'Detection_Signals_Essentials_1.0.csv'
+
+
+def data_path(name):
+    """Path of a file in the data root"""
+    return os.path.join(DATA_DIR, name)
+
+
+def dataset_files(data_dir=DATA_DIR):
+    """Every dataset CSV in data_dir (the signal spec is not a dataset)"""
+    return sorted(path for path in glob.glob(os.path.join(data_dir, '*.csv'))
+                  if os.path.basename(path) != SPEC_FILE_NAME)
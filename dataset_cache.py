@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Binary columnar cache of parsed dataset CSVs.
+
+load_dataset() returns the same DataFrame as row_fingerprint.read_dataset(),
+but parses each CSV only once. The parsed frame is stored as an uncompressed
+.npz file keyed by the SHA-256 of the CSV's bytes. Numeric columns are saved
+as raw arrays, one block per dtype, and text columns (spf_result, tls_version,
+classification, ...) as integer codes plus their distinct values, so a later
+load is a few array reads with no text parsing or type inference.
+
+A changed CSV gets a new content hash and so misses the cache automatically.
+An index entry per path, (size, mtime) -> hash, avoids re-hashing files that
+have not been touched. Cache files and index entries are written atomically,
+and each source has its own entry file, so concurrent workers
+(corpus_analysis.py) can share a cache without overwriting each other.
+
+The cache lives in .dataset_cache/ next to the data; set SPAM_DATA_CACHE_DIR
+to move it, or to an empty string to always parse the CSVs.
+
+Usage:
+    python dataset_cache.py warm [files...]
+    python dataset_cache.py prune
+    python dataset_cache.py clear
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_paths import DATA_DIR, dataset_files
+from instrumentation import run, stage
+from row_fingerprint import read_dataset
+
+CACHE_DIR = os.environ.get('SPAM_DATA_CACHE_DIR', os.path.join(DATA_DIR, '.dataset_cache'))
+INDEX_SUFFIX = '.source.json'
+# Bump when read_dataset or the cache layout changes, so old entries are ignored
+CACHE_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(path):
+    """Cache key: SHA-256 of the file's bytes and the cache version"""
+    digest = hashlib.sha256(f"dataset-cache-v{CACHE_VERSION}\n".encode())
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def index_entry(cache_dir, key):
+    """File holding the index entry of one source path"""
+    return os.path.join(cache_dir, hashlib.sha256(key.encode()).hexdigest() + INDEX_SUFFIX)
+
+
+def read_entry(path):
+    """{'path', 'entry': [size, mtime_ns, hash]} of an index entry file, or None"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def load_index(cache_dir):
+    """path -> [size, mtime_ns, hash] for files hashed before"""
+    entries = [read_entry(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir)
+               if name.endswith(INDEX_SUFFIX)]
+    return {entry['path']: entry['entry'] for entry in entries if entry}
+
+
+def write_atomic(path, write):
+    """Write a file through a temporary name, so readers never see half of it"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def source_hash(path, cache_dir):
+    """Content hash of path, reusing the indexed hash while size and mtime match"""
+    key = os.path.abspath(path)
+    stat = os.stat(path)
+    entry_file = index_entry(cache_dir, key)
+    known = (read_entry(entry_file) or {}).get('entry')
+    if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return known[2]
+    digest = content_hash(path)
+    entry = {'path': key, 'entry': [stat.st_size, stat.st_mtime_ns, digest]}
+    write_atomic(entry_file, lambda f: f.write(json.dumps(entry).encode()))
+    return digest
+
+
+def save_frame(path, df):
+    """Store a parsed frame as a columnar .npz file
+
+    Numeric columns of one dtype are stacked into a single (columns x rows)
+    block, and text columns into one block of int32 codes, so loading builds
+    the frame from a handful of arrays instead of one array per column.
+    """
+    columns = []
+    blocks = {}
+    for name, values in df.items():
+        if isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biuf':
+            key = values.dtype.str
+            meta = {'name': name, 'block': key}
+            array = values.to_numpy()
+        else:
+            key = 'codes'
+            codes, distinct = pd.factorize(values)
+            meta = {'name': name, 'block': key, 'dtype': str(values.dtype), 'values': distinct.tolist()}
+            array = codes.astype(np.int32)
+        meta['row'] = len(blocks.setdefault(key, []))
+        blocks[key].append(array)
+        columns.append(meta)
+    arrays = {f"b{position}": np.stack(block) for position, block in enumerate(blocks.values())}
+    header = {'columns': columns, 'blocks': list(blocks), 'rows': len(df),
+              'folded_rows': df.attrs.get('folded_rows', [])}
+    arrays['header'] = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+    write_atomic(path, lambda f: np.savez(f, **arrays))
+
+
+def decode_codes(meta, codes):
+    """Text column from its factorize codes"""
+    # Code -1 (missing) picks the trailing NaN
+    values = np.array(meta['values'] + [np.nan], dtype=object)[codes]
+    return pd.array(values, dtype=meta['dtype'])
+
+
+def load_frame(path):
+    """Read a frame stored by save_frame"""
+    with np.load(path, allow_pickle=False) as data:
+        header = json.loads(data['header'].tobytes())
+        blocks = {key: data[f"b{position}"] for position, key in enumerate(header['blocks'])}
+    parts = []
+    for key, block in blocks.items():
+        members = [meta for meta in header['columns'] if meta['block'] == key]
+        if key == 'codes':
+            parts.append(pd.DataFrame({meta['name']: decode_codes(meta, block[meta['row']]) for meta in members},
+                                      index=pd.RangeIndex(header['rows'])))
+        else:
+            # The transpose is a view, so each block becomes one pandas block without a copy
+            parts.append(pd.DataFrame(block.T, columns=[meta['name'] for meta in members]))
+    if parts:
+        df = pd.concat(parts, axis=1)[[meta['name'] for meta in header['columns']]]
+    else:
+        df = pd.DataFrame(index=pd.RangeIndex(header['rows']))
+    df.attrs['folded_rows'] = header['folded_rows']
+    return df
+
+
+def cache_file(path, cache_dir=CACHE_DIR):
+    """Cache entry that holds path's current content"""
+    return os.path.join(cache_dir, f"{source_hash(path, cache_dir)}.npz")
+
+
+def load_dataset(path, cache_dir=CACHE_DIR):
+    """read_dataset(path), served from the cache when the CSV is unchanged"""
+    with stage('load') as record:
+        df = cached_dataset(path, cache_dir)
+        record['rows'] = len(df)
+    return df
+
+
+def cached_dataset(path, cache_dir):
+    """load_dataset() without instrumentation"""
+    if not cache_dir:
+        return read_dataset(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = cache_file(path, cache_dir)
+    if os.path.exists(entry):
+        try:
+            return load_frame(entry)
+        except (OSError, ValueError, KeyError):
+            # Unreadable entry (e.g. from a killed writer on another filesystem): rebuild it
+            pass
+    df = read_dataset(path)
+    save_frame(entry, df)
+    return df
+
+
+def prune_cache(cache_dir=CACHE_DIR):
+    """Remove index entries for missing files and cache files no index entry uses"""
+    index = load_index(cache_dir)
+    for path in [path for path in index if not os.path.exists(path)]:
+        os.remove(index_entry(cache_dir, path))
+        del index[path]
+    live = {f"{entry[2]}.npz" for entry in index.values()}
+    removed = [name for name in os.listdir(cache_dir) if name.endswith('.npz') and name not in live]
+    for name in removed:
+        os.remove(os.path.join(cache_dir, name))
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Binary cache of parsed dataset CSVs')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    warm = commands.add_parser('warm', help='parse CSVs into the cache')
+    warm.add_argument('files', nargs='*', help='CSV files (default: every dataset CSV in --data-dir)')
+    warm.add_argument('--data-dir', default=DATA_DIR)
+    commands.add_parser('prune', help='drop entries for deleted or changed CSVs')
+    commands.add_parser('clear', help='empty the cache')
+    args = parser.parse_args()
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    if args.command == 'warm':
+        paths = args.files or dataset_files(args.data_dir)
+        for path in paths:
+            df = load_dataset(path, args.cache_dir)
+            print(f"Cached {os.path.basename(path)}: {len(df)} records")
+    elif args.command == 'prune':
+        removed = prune_cache(args.cache_dir)
+        print(f"Removed {len(removed)} stale cache files")
+    else:
+        names = os.listdir(args.cache_dir)
+        for name in names:
+            os.remove(os.path.join(args.cache_dir, name))
+        print(f"Removed {len(names)} cache files")
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Persistent index of row fingerprints across the whole dataset corpus.
+
+The index is a SQLite database mapping every row fingerprint (see
+row_fingerprint.py) to the file (by absolute path, so same-named files in
+different directories stay apart) and row it came from. It is updated
+incrementally: a file is only re-read when its size or modification time
+changed and its content digest no longer matches, so refreshing the index
+after adding one CSV costs one file, not the corpus. Checking whether a new
+file duplicates anything already produced is then an indexed lookup per row
+of the new file.
+
+Usage:
+    python dedup_index.py update [files...]
+    python dedup_index.py check new.csv [--add]
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+from data_paths import DATA_DIR, dataset_files
+from dataset_cache import load_dataset
+from instrumentation import run
+from row_fingerprint import duplicate_groups, frame_fingerprints
+
+INDEX_FILE = os.path.join(DATA_DIR, 'dedup_index.sqlite')
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    rows INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    fingerprint INTEGER NOT NULL,
+    file TEXT NOT NULL,
+    row INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fingerprints_by_value ON fingerprints (fingerprint);
+CREATE INDEX IF NOT EXISTS fingerprints_by_file ON fingerprints (file);
+"""
+
+
+def open_index(path=INDEX_FILE):
+    """Open (creating if needed) the index database"""
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def file_digest(path):
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DIGEST_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprints(path):
+    """Fingerprints of a CSV's rows as SQLite integers, in row order"""
+    # SQLite integers are signed 64-bit, so store the hash bits as int64
+    return frame_fingerprints(load_dataset(path)).view(np.int64)
+
+
+def file_key(path):
+    """Name a file is indexed under"""
+    return os.path.abspath(path)
+
+
+def fingerprint_rows(name, fingerprints):
+    """(fingerprint, file, row) tuples, with rows numbered as in the file"""
+    # +2 because row 1 is header, data starts at row 2
+    return zip(fingerprints.tolist(), [name] * len(fingerprints), range(2, len(fingerprints) + 2))
+
+
+def index_file(conn, path, fingerprints=None):
+    """Add or refresh one file; returns True if its rows were (re)indexed"""
+    name = file_key(path)
+    stat = os.stat(path)
+    known = conn.execute('SELECT size, mtime_ns, digest FROM files WHERE name = ?', (name,)).fetchone()
+    if known and known[:2] == (stat.st_size, stat.st_mtime_ns):
+        return False
+    digest = file_digest(path)
+    if known and known[2] == digest:
+        # Touched but unchanged: only the stat needs refreshing
+        conn.execute('UPDATE files SET size = ?, mtime_ns = ? WHERE name = ?',
+                     (stat.st_size, stat.st_mtime_ns, name))
+        return False
+    if fingerprints is None:
+        fingerprints = file_fingerprints(path)
+    conn.execute('DELETE FROM fingerprints WHERE file = ?', (name,))
+    conn.executemany('INSERT INTO fingerprints VALUES (?, ?, ?)', fingerprint_rows(name, fingerprints))
+    conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                 (name, stat.st_size, stat.st_mtime_ns, digest, len(fingerprints)))
+    return True
+
+
+def forget_file(conn, name):
+    """Drop a file and its rows from the index"""
+    conn.execute('DELETE FROM fingerprints WHERE file = ?', (name,))
+    conn.execute('DELETE FROM files WHERE name = ?', (name,))
+
+
+def update_index(conn, paths, prune=False):
+    """Bring the index up to date with paths; returns (reindexed, removed) names"""
+    reindexed = []
+    with conn:
+        for path in paths:
+            if index_file(conn, path):
+                reindexed.append(file_key(path))
+        removed = []
+        if prune:
+            present = {file_key(path) for path in paths}
+            removed = [name for (name,) in conn.execute('SELECT name FROM files') if name not in present]
+            for name in removed:
+                forget_file(conn, name)
+    return reindexed, removed
+
+
+def find_matches(conn, fingerprints, exclude_file=None):
+    """Indexed (row, file, row) matches for a new file's fingerprints"""
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS probe (row INTEGER, fingerprint INTEGER)')
+    conn.execute('DELETE FROM probe')
+    conn.executemany('INSERT INTO probe VALUES (?, ?)',
+                     zip(range(2, len(fingerprints) + 2), fingerprints.tolist()))
+    matches = conn.execute(
+        'SELECT probe.row, fingerprints.file, fingerprints.row FROM probe '
+        'JOIN fingerprints ON fingerprints.fingerprint = probe.fingerprint '
+        'WHERE fingerprints.file IS NOT ? ORDER BY probe.row, fingerprints.file, fingerprints.row',
+        (exclude_file,)).fetchall()
+    conn.execute('DELETE FROM probe')
+    return matches
+
+
+def check_file(conn, path, add=False):
+    """Report rows of path that repeat within it or anywhere in the index"""
+    name = file_key(path)
+    fingerprints = file_fingerprints(path)
+    print(f"Checking {name}: {len(fingerprints)} records")
+
+    within = duplicate_groups(fingerprints)
+    for group in within:
+        rows = ', '.join(str(position + 2) for position in group)
+        print(f"  Repeated within {name}: rows {rows}")
+
+    # The file's own earlier version must not count as a duplicate of itself
+    matches = find_matches(conn, fingerprints, exclude_file=name)
+    for row, other_file, other_row in matches:
+        print(f"  Row {row} duplicates {other_file}, row {other_row}")
+
+    duplicate_rows = {row for row, _, _ in matches}
+    duplicate_rows.update(int(position) + 2 for group in within for position in group[1:])
+    if duplicate_rows:
+        print(f"✗ {len(duplicate_rows)} of {len(fingerprints)} records are duplicates")
+    else:
+        print(f"✓ All {len(fingerprints)} records are unique against the index")
+
+    if add:
+        with conn:
+            index_file(conn, path, fingerprints)
+        print(f"Added {name} to the index")
+    return not duplicate_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Persistent duplicate index for the dataset CSVs')
+    parser.add_argument('--index', default=INDEX_FILE, help='index database path')
+    commands = parser.add_subparsers(dest='command', required=True)
+    update = commands.add_parser('update', help='index new or changed CSVs')
+    update.add_argument('files', nargs='*',
+                        help='CSV files (default: every dataset CSV in --data-dir, pruning removed ones)')
+    update.add_argument('--data-dir', default=DATA_DIR)
+    check = commands.add_parser('check', help='check a CSV against the index')
+    check.add_argument('file')
+    check.add_argument('--add', action='store_true', help='index the file after checking it')
+    args = parser.parse_args()
+
+    conn = open_index(args.index)
+    try:
+        if args.command == 'update':
+            paths = args.files or dataset_files(args.data_dir)
+            reindexed, removed = update_index(conn, paths, prune=not args.files)
+            for name in reindexed:
+                print(f"Indexed {name}")
+            for name in removed:
+                print(f"Removed {name}")
+            files, rows = conn.execute('SELECT COUNT(*), COALESCE(SUM(rows), 0) FROM files').fetchone()
+            print(f"Index holds {rows} records from {files} files "
+                  f"({len(reindexed)} reindexed, {len(paths) - len(reindexed)} unchanged)")
+        else:
+            unique = check_file(conn, args.file, add=args.add)
+            raise SystemExit(0 if unique else 1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    run(main)
@@ -1,91 +1,102 @@
 import pandas as pd
 import numpy as np
 
-print("=== DETAILED ANALYSIS OF NO ACTION SIGNAL VALUES ===\n")
+from data_paths import data_path
+from instrumentation import run, stage
 
-# Analyze v1-v4 border cases
-for i in range(1, 5):
-    file_path = f"/home/u3/email_data/spam_data/No_Action_100_v{i}.csv"
-    print(f"\n--- Version {i} Border Cases ---")
+def main():
+    print("=== DETAILED ANALYSIS OF NO ACTION SIGNAL VALUES ===\n")
+
+    # Analyze v1-v4 border cases
+    for i in range(1, 5):
+        file_path = data_path(f"No_Action_100_v{i}.csv")
+        print(f"\n--- Version {i} Border Cases ---")
     
-    df = pd.read_csv(file_path)
+        with stage('load') as record:
+            df = pd.read_csv(file_path)
+            record['rows'] = len(df)
     
-    # Find rows with authentication issues
-    auth_issues = df[(df['spf_result'] != 'pass') | 
-                     (df['dkim_result'] != 'pass') | 
-                     (df['dmarc_result'] != 'pass')]
+        # Find rows with authentication issues
+        auth_issues = df[(df['spf_result'] != 'pass') | 
+                         (df['dkim_result'] != 'pass') | 
+                         (df['dmarc_result'] != 'pass')]
     
-    if len(auth_issues) > 0:
-        print(f"\nAuthentication Border Cases ({len(auth_issues)} total):")
-        # Check if these have compensating factors
-        for idx, row in auth_issues.head(5).iterrows():
-            compensating_factors = []
+        if len(auth_issues) > 0:
+            print(f"\nAuthentication Border Cases ({len(auth_issues)} total):")
+            # Check if these have compensating factors
+            for idx, row in auth_issues.head(5).iterrows():
+                compensating_factors = []
             
-            # Good reputation scores
-            if row['sender_domain_reputation_score'] < 0.1:
-                compensating_factors.append("good sender domain reputation")
-            if row['smtp_ip_reputation_score'] > 0.9:
-                compensating_factors.append("good IP reputation")
+                # Good reputation scores
+                if row['sender_domain_reputation_score'] < 0.1:
+                    compensating_factors.append("good sender domain reputation")
+                if row['smtp_ip_reputation_score'] > 0.9:
+                    compensating_factors.append("good IP reputation")
                 
-            # Low spam score
-            if row['content_spam_score'] < 0.1:
-                compensating_factors.append("low spam score")
+                # Low spam score
+                if row['content_spam_score'] < 0.1:
+                    compensating_factors.append("low spam score")
                 
-            # No malicious indicators
-            if row['sender_known_malicious'] == 0 and row['domain_known_malicious'] == 0:
-                compensating_factors.append("no malicious indicators")
+                # No malicious indicators
+                if row['sender_known_malicious'] == 0 and row['domain_known_malicious'] == 0:
+                    compensating_factors.append("no malicious indicators")
                 
-            print(f"  Row {idx+2}: SPF={row['spf_result']}, DKIM={row['dkim_result']}, DMARC={row['dmarc_result']}")
-            print(f"    Compensating factors: {', '.join(compensating_factors) if compensating_factors else 'None'}")
-            print(f"    Spam score: {row['content_spam_score']}, Sender reputation: {row['sender_domain_reputation_score']}")
+                print(f"  Row {idx+2}: SPF={row['spf_result']}, DKIM={row['dkim_result']}, DMARC={row['dmarc_result']}")
+                print(f"    Compensating factors: {', '.join(compensating_factors) if compensating_factors else 'None'}")
+                print(f"    Spam score: {row['content_spam_score']}, Sender reputation: {row['sender_domain_reputation_score']}")
     
-    # Check return path mismatches
-    if 'return_path_mismatch_with_from' in df.columns:
-        mismatches = df[df['return_path_mismatch_with_from'] == 1]
-        if len(mismatches) > 0:
-            print(f"\nReturn Path Mismatch Cases ({len(mismatches)} total):")
-            for idx, row in mismatches.head(3).iterrows():
-                print(f"  Row {idx+2}: return_path_reputation={row['return_path_reputation_score']:.2f}, "
-                      f"sender_reputation={row['sender_domain_reputation_score']:.2f}, "
-                      f"spam_score={row['content_spam_score']:.2f}")
+        # Check return path mismatches
+        if 'return_path_mismatch_with_from' in df.columns:
+            mismatches = df[df['return_path_mismatch_with_from'] == 1]
+            if len(mismatches) > 0:
+                print(f"\nReturn Path Mismatch Cases ({len(mismatches)} total):")
+                for idx, row in mismatches.head(3).iterrows():
+                    print(f"  Row {idx+2}: return_path_reputation={row['return_path_reputation_score']:.2f}, "
+                          f"sender_reputation={row['sender_domain_reputation_score']:.2f}, "
+                          f"spam_score={row['content_spam_score']:.2f}")
 
-# Analyze v5-v9 issues
-print("\n\n--- Version 5-9 Critical Issues ---")
+    # Analyze v5-v9 issues
+    print("\n\n--- Version 5-9 Critical Issues ---")
 
-for i in range(5, 10):
-    file_path = f"/home/u3/email_data/spam_data/No_Action_100_v{i}.csv"
-    df = pd.read_csv(file_path)
+    for i in range(5, 10):
+        file_path = data_path(f"No_Action_100_v{i}.csv")
+        with stage('load') as record:
+            df = pd.read_csv(file_path)
+            record['rows'] = len(df)
     
-    print(f"\nVersion {i}:")
+        print(f"\nVersion {i}:")
     
-    # Check DKIM issue
-    dkim_pass_count = df['email_authentication_dkim_pass'].sum()
-    print(f"  DKIM Pass Count: {dkim_pass_count} out of {len(df)} (CRITICAL ISSUE - All fail!)")
+        # Check DKIM issue
+        dkim_pass_count = df['email_authentication_dkim_pass'].sum()
+        print(f"  DKIM Pass Count: {dkim_pass_count} out of {len(df)} (CRITICAL ISSUE - All fail!)")
     
-    # Check sender reputation = 1 cases
-    bad_rep = df[df['sender_domain_reputation_score'] == 1]
-    if len(bad_rep) > 0:
-        print(f"  Bad Sender Reputation Cases: {len(bad_rep)}")
-        # Check if these have other good indicators
-        for idx, row in bad_rep.head(3).iterrows():
-            other_indicators = []
-            if row['attachment_malicious_score'] == 0:
-                other_indicators.append("no malicious attachments")
-            if row['url_malicious_score'] == 0:
-                other_indicators.append("no malicious URLs")
-            if row['email_authentication_spf_pass'] == 1:
-                other_indicators.append("SPF passes")
-            if row['email_authentication_dmarc_pass'] == 1:
-                other_indicators.append("DMARC passes")
-            print(f"    Row {idx+2}: Other positive indicators: {', '.join(other_indicators)}")
+        # Check sender reputation = 1 cases
+        bad_rep = df[df['sender_domain_reputation_score'] == 1]
+        if len(bad_rep) > 0:
+            print(f"  Bad Sender Reputation Cases: {len(bad_rep)}")
+            # Check if these have other good indicators
+            for idx, row in bad_rep.head(3).iterrows():
+                other_indicators = []
+                if row['attachment_malicious_score'] == 0:
+                    other_indicators.append("no malicious attachments")
+                if row['url_malicious_score'] == 0:
+                    other_indicators.append("no malicious URLs")
+                if row['email_authentication_spf_pass'] == 1:
+                    other_indicators.append("SPF passes")
+                if row['email_authentication_dmarc_pass'] == 1:
+                    other_indicators.append("DMARC passes")
+                print(f"    Row {idx+2}: Other positive indicators: {', '.join(other_indicators)}")
+
+    print("\n\n=== SUMMARY OF FINDINGS ===")
+    print("\n1. CRITICAL ISSUE: Files v5-v9 have ALL emails failing DKIM authentication (100% failure rate)")
+    print("   This is completely inappropriate for 'No Action' classification")
+    print("\n2. PROBLEMATIC: 33% of emails in v5-v9 have sender_domain_reputation_score=1 (worst reputation)")
+    print("   Even with other good indicators, this is too high for legitimate emails")
+    print("\n3. MINOR ISSUES in v1-v4:")
+    print("   - Some authentication failures (10-20%) but with compensating factors")
+    print("   - These could be considered border cases for 'No Action'")
+    print("\n4. RECOMMENDATION: v5-v9 data is NOT appropriate for 'No Action' classification")
+    print("   The 100% DKIM failure rate alone disqualifies these as legitimate emails")
 
-print("\n\n=== SUMMARY OF FINDINGS ===")
-print("\n1. CRITICAL ISSUE: Files v5-v9 have ALL emails failing DKIM authentication (100% failure rate)")
-print("   This is completely inappropriate for 'No Action' classification")
-print("\n2. PROBLEMATIC: 33% of emails in v5-v9 have sender_domain_reputation_score=1 (worst reputation)")
-print("   Even with other good indicators, this is too high for legitimate emails")
-print("\n3. MINOR ISSUES in v1-v4:")
-print("   - Some authentication failures (10-20%) but with compensating factors")
-print("   - These could be considered border cases for 'No Action'")
-print("\n4. RECOMMENDATION: v5-v9 data is NOT appropriate for 'No Action' classification")
-print("   The 100% DKIM failure rate alone disqualifies these as legitimate emails")
\ No newline at end of file
+if __name__ == "__main__":
+    run(main)
\ No newline at end of file
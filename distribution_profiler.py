@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Per-class distribution profile of a dataset, checked against a generator profile.
+
+profile_dataset() tabulates every column for every class at once. Each row
+gets a class code and each value a bin code (its distinct value for flags,
+counts and enums; its histogram bin for scores), and one np.bincount per
+column counts all (class, bin) pairs in a single vectorized pass.
+
+With --profile, the class the generator profile produces is compared with
+the targets the profile declares (generator_profiles.json):
+
+- sub-type and quota counts are scaled to the class's row count the way
+  batch_generator.py does, and are exact (170/80 bulk_message_indicator,
+  100/150 low/high smtp_ip_geo, 60/140/50 content_spam_score bands)
+- choice, randint and bernoulli specs give expected value frequencies
+- uniform specs give expected band occupancy; edges are the declared range
+  ends, and rounding to the spec's decimals is accounted for (a moderate
+  content_spam_score of 0.8 lands in the clear band)
+
+Every bin gets an expected count and variance (a sum of binomials, one per
+sub-type or quota branch). Bins off by more than --z-limit standard
+deviations, and any miss of an exact target (values out of range, unknown
+enum values, wrong quota counts), are reported as deviations. Targets hold
+for a whole run, so check merged output rather than --per-shard-files.
+
+Usage:
+    python distribution_profiler.py spam_250_v3_1000000.csv --profile spam_250_v3
+    python distribution_profiler.py [files...]    # profile only
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from batch_generator import (PROFILES_FILE, SUBTYPE_DIMENSION, compile_profile, compile_sampler, dimension_counts,
+                             load_profiles, resolve_profile)
+from data_paths import DATA_DIR, dataset_files
+from dataset_cache import load_dataset
+from instrumentation import run, stage
+from schema_migration import numeric
+from signal_spec import LABEL_COLUMN, load_signal_spec
+
+DEFAULT_Z_LIMIT = 4.0
+HISTOGRAM_BINS = 10
+# Distinct values up to which a column outside the spec is profiled as an enum
+MAX_ENUM_VALUES = 20
+VALUES_SHOWN = 4
+MISSING = '<missing>'
+# Text pandas reads as missing (e.g. unique_parent_process_names' 'NULL')
+NA_TEXT = {'', 'NA', 'N/A', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+
+
+def label_column(df):
+    """Name of the classification column, or None"""
+    labels = [name for name in df.columns if str(name).strip().lower() == LABEL_COLUMN]
+    return labels[0] if labels else None
+
+
+def is_discrete(column, values, signal_spec):
+    """Whether a column is profiled by distinct value (else by histogram)"""
+    signal = signal_spec.get(column)
+    if signal is not None:
+        return signal['type'] != 'float'
+    return values.dtype.kind not in 'iuf' or values.nunique() <= MAX_ENUM_VALUES
+
+
+def histogram_edges(numbers):
+    """HISTOGRAM_BINS equal-width bin edges spanning the values"""
+    present = numbers[~np.isnan(numbers)]
+    if not len(present):
+        return [0.0, 1.0]
+    return np.linspace(present.min(), present.max(), HISTOGRAM_BINS + 1).tolist()
+
+
+def bin_codes(numbers, edges):
+    """Bin of each value: [e0, e1), ..., [e(m-1), em]; m for out of range, m + 1 for missing"""
+    edges = np.asarray(edges, dtype=np.float64)
+    last = len(edges) - 2
+    codes = np.searchsorted(edges, numbers, side='right') - 1
+    codes[numbers == edges[-1]] = last
+    codes[(codes < 0) | (codes > last)] = last + 1
+    codes[np.isnan(numbers)] = last + 2
+    return codes
+
+
+def class_counts(class_codes, n_classes, codes, width):
+    """(classes x width) counts of codes per class, in one bincount"""
+    return np.bincount(class_codes * width + codes, minlength=n_classes * width).reshape(n_classes, width)
+
+
+def profile_dataset(df, edges=None, signal_spec=None):
+    """Per-class value frequencies and histograms of every column
+
+    edges maps a column to the histogram edges to use for it (e.g. a
+    profile's bands); other score columns get HISTOGRAM_BINS equal bins.
+    """
+    signal_spec = signal_spec or load_signal_spec()
+    edges = edges or {}
+    label = label_column(df)
+    if label is None:
+        class_codes, classes = np.zeros(len(df), dtype=np.int64), [MISSING]
+    else:
+        class_codes, classes = pd.factorize(df[label].astype(object).fillna(MISSING))
+        classes = [str(value) for value in classes]
+
+    columns = {}
+    for name, values in df.items():
+        if name == label:
+            continue
+        column = str(name).strip()
+        if is_discrete(column, values, signal_spec):
+            codes, distinct = pd.factorize(values)
+            width = len(distinct) + 1
+            # Missing values (code -1) are counted in the last slot
+            counts = class_counts(class_codes, len(classes), np.where(codes < 0, width - 1, codes), width)
+            columns[column] = {'kind': 'values', 'values': distinct.tolist(),
+                               'counts': {c: row[:-1].tolist() for c, row in zip(classes, counts)},
+                               'missing': {c: int(row[-1]) for c, row in zip(classes, counts)}}
+        else:
+            numbers = numeric(values)
+            column_edges = list(edges.get(column) or histogram_edges(numbers))
+            width = len(column_edges) + 1
+            counts = class_counts(class_codes, len(classes), bin_codes(numbers, column_edges), width)
+            columns[column] = {'kind': 'histogram', 'edges': column_edges,
+                               'counts': {c: row[:-2].tolist() for c, row in zip(classes, counts)},
+                               'out_of_range': {c: int(row[-2]) for c, row in zip(classes, counts)},
+                               'missing': {c: int(row[-1]) for c, row in zip(classes, counts)}}
+    return {
+        'rows': len(df),
+        'classes': dict(zip(classes, np.bincount(class_codes, minlength=len(classes)).tolist())),
+        'columns': columns,
+    }
+
+
+def value_key(value):
+    """Comparable form of a data or profile value (1, 1.0 and '1' alike for numbers)"""
+    if isinstance(value, str) and value in NA_TEXT:
+        return MISSING
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def column_components(profile, column, counts):
+    """[(rows, sampler)] mixture a column is drawn from, and what sets the row counts
+
+    counts are the run's exact sub-type and quota counts (dimension_counts()).
+    """
+    spec = profile['columns'][column]
+    if 'quota' in spec:
+        return [(int(count), compile_sampler(branch))
+                for count, (_, branch) in zip(counts[column], spec['quota'])], 'quota'
+    subtypes = list(profile['subtypes'])
+    if any(column in profile['overrides'].get(subtype, {}) for subtype in subtypes):
+        return [(int(count), compile_sampler(profile['overrides'].get(subtype, {}).get(column, spec)))
+                for count, subtype in zip(counts[SUBTYPE_DIMENSION], subtypes)], 'subtypes'
+    return [(int(counts[SUBTYPE_DIMENSION].sum()), compile_sampler(spec))], None
+
+
+def sampler_points(sampler):
+    """(values, probabilities) of a discrete sampler, or None for uniform"""
+    kind = sampler[0]
+    if kind == 'const':
+        return [sampler[1]], np.ones(1)
+    if kind == 'choice':
+        _, values, cumulative = sampler
+        if cumulative is None:
+            return values.tolist(), np.full(len(values), 1 / len(values))
+        return values.tolist(), np.diff(cumulative, prepend=0.0)
+    if kind == 'randint':
+        values = list(range(sampler[1], sampler[2]))
+        return values, np.full(len(values), 1 / len(values))
+    if kind == 'bernoulli':
+        return [0, 1], np.array([1 - sampler[1], sampler[1]])
+    return None
+
+
+def probability_below(sampler, edge):
+    """P(drawn and rounded value < edge)"""
+    points = sampler_points(sampler)
+    if points is not None:
+        values, probabilities = points
+        return float(probabilities[np.array([value_key(value) < edge for value in values])].sum())
+    _, low, high, decimals = sampler
+    # Rounding to the grid moves everything below edge - step / 2 under the edge
+    cut = edge - 0.5 * 10.0 ** -decimals
+    if high == low:
+        return float(low < cut)
+    return float(np.clip((cut - low) / (high - low), 0.0, 1.0))
+
+
+def column_targets(components, discrete):
+    """Expected count and variance per value (discrete) or per band"""
+    if discrete:
+        bins = {}
+        for rows, sampler in components:
+            points = sampler_points(sampler)
+            if points is None:
+                raise ValueError(f"uniform spec {sampler!r} on a discrete column")
+            for value, p in zip(*points):
+                expected, variance = bins.get(value_key(value), (0.0, 0.0))
+                bins[value_key(value)] = (expected + rows * p, variance + rows * p * (1 - p))
+        return {'kind': 'values', 'bins': bins}
+
+    edges = set()
+    for _, sampler in components:
+        points = sampler_points(sampler)
+        edges.update([sampler[1], sampler[2]] if points is None else [value_key(value) for value in points[0]])
+    edges = sorted(edges)
+    if len(edges) == 1:
+        edges = edges * 2
+    bins = []
+    for index in range(len(edges) - 1):
+        expected = variance = 0.0
+        for rows, sampler in components:
+            upper = 1.0 if index == len(edges) - 2 else probability_below(sampler, edges[index + 1])
+            p = upper - probability_below(sampler, edges[index])
+            expected += rows * p
+            variance += rows * p * (1 - p)
+        bins.append((expected, variance))
+    return {'kind': 'histogram', 'edges': edges, 'bins': bins}
+
+
+def profile_targets(profile, counts, signal_spec=None):
+    """{column: targets} for a resolved generator profile with the given exact counts"""
+    signal_spec = signal_spec or load_signal_spec()
+    targets = {}
+    for column in profile['columns']:
+        components, counted_by = column_components(profile, column, counts)
+        discrete = signal_spec[column]['type'] != 'float' if column in signal_spec else True
+        targets[column] = dict(column_targets(components, discrete), counted_by=counted_by)
+    return targets
+
+
+def deviation(observed, expected, variance, z_limit):
+    """z-score (None for an exact target) and whether the count is within the limit"""
+    if variance <= 1e-12:
+        return None, abs(observed - expected) < 0.5
+    # Continuity correction: counts are integers
+    z = np.sign(observed - expected) * max(abs(observed - expected) - 0.5, 0.0) / variance ** 0.5
+    return float(z), abs(z) <= z_limit
+
+
+def bin_name(edges, index):
+    """Display name of histogram bin index"""
+    close = ']' if index == len(edges) - 2 else ')'
+    return f"[{edges[index]:g}, {edges[index + 1]:g}{close}"
+
+
+def check_targets(result, targets, label, z_limit=DEFAULT_Z_LIMIT):
+    """One check per target bin: {'column', 'bin', 'observed', 'expected', 'z', 'ok', 'counted_by'}"""
+    checks = []
+
+    def add(column, name, observed, expected, variance=0.0):
+        z, ok = deviation(observed, expected, variance, z_limit)
+        checks.append({'column': column, 'bin': name, 'observed': int(observed), 'expected': expected, 'z': z,
+                       'ok': ok, 'counted_by': targets[column]['counted_by']})
+
+    for column, target in targets.items():
+        if column not in result['columns']:
+            checks.append({'column': column, 'bin': 'column', 'observed': 0, 'expected': None, 'z': None,
+                           'ok': False, 'counted_by': None})
+            continue
+        profiled = result['columns'][column]
+        if target['kind'] == 'values':
+            observed = {MISSING: profiled['missing'][label]}
+            if profiled['kind'] == 'values':
+                for value, count in zip(profiled['values'], profiled['counts'][label]):
+                    observed[value_key(value)] = observed.get(value_key(value), 0) + count
+            for key, (expected, variance) in target['bins'].items():
+                add(column, f"= {shown_value(key)}", observed.pop(key, 0), expected, variance)
+            for key, count in observed.items():
+                if count:
+                    add(column, 'missing' if key == MISSING else f"unexpected {shown_value(key)}", count, 0.0)
+        else:
+            for index, (expected, variance) in enumerate(target['bins']):
+                add(column, bin_name(target['edges'], index), profiled['counts'][label][index], expected, variance)
+            if profiled['out_of_range'][label]:
+                add(column, 'out of range', profiled['out_of_range'][label], 0.0)
+            if profiled['missing'][label]:
+                add(column, 'missing', profiled['missing'][label], 0.0)
+    return checks
+
+
+def validate_dataset(df, config, profile_name, z_limit=DEFAULT_Z_LIMIT, signal_spec=None):
+    """(profile result, checks) for df against a generator profile's targets for its class"""
+    signal_spec = signal_spec or load_signal_spec()
+    profile = resolve_profile(config, profile_name)
+    label = profile['classification']
+    counts = df[label_column(df)].value_counts() if label_column(df) is not None else pd.Series(dtype=int)
+    n_rows = int(counts.get(label, 0))
+    if not n_rows:
+        raise ValueError(f"no '{label}' records to check against profile '{profile_name}'")
+    plan = compile_profile(config, profile_name, signal_spec)
+    targets = profile_targets(profile, dimension_counts(plan, n_rows), signal_spec)
+    edges = {column: target['edges'] for column, target in targets.items() if target['kind'] == 'histogram'}
+    result = profile_dataset(df, edges, signal_spec)
+    return result, check_targets(result, targets, label, z_limit)
+
+
+def column_line(profiled, label, rows):
+    """Most common values or bins of a column within one class"""
+    if profiled['kind'] == 'values':
+        names = [shown_value(value) for value in profiled['values']]
+    else:
+        names = [bin_name(profiled['edges'], index) for index in range(len(profiled['edges']) - 1)]
+    counts = profiled['counts'][label]
+    ranked = sorted((item for item in zip(names, counts) if item[1]), key=lambda item: -item[1])
+    parts = [f"{name} {count / rows:.1%}" for name, count in ranked[:VALUES_SHOWN]]
+    if len(ranked) > VALUES_SHOWN:
+        parts.append(f"+{len(ranked) - VALUES_SHOWN} more")
+    for key in ('out_of_range', 'missing'):
+        if profiled.get(key, {}).get(label):
+            parts.append(f"{key.replace('_', ' ')} {profiled[key][label]}")
+    return ', '.join(parts)
+
+
+def shown_value(value):
+    """Value as it appears in the CSV"""
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def print_profile(result):
+    """Per-class listing of every column"""
+    for label, rows in result['classes'].items():
+        print(f"\nClass '{label}' ({rows} records):")
+        width = max([len(column) for column in result['columns']] + [6])
+        for column, profiled in result['columns'].items():
+            print(f"  {column:<{width}} {column_line(profiled, label, rows) or '-'}")
+
+
+def print_checks(checks, profile_name, z_limit):
+    """Declared sub-type/quota targets and every deviation"""
+    print(f"\nTargets of profile '{profile_name}':")
+    for check in checks:
+        if check['counted_by'] and check['expected']:
+            status = 'ok' if check['ok'] else 'DEVIATION'
+            print(f"  {check['column']} {check['bin']}: {check['observed']} "
+                  f"(target {check['expected']:.1f}, by {check['counted_by']})  {status}")
+    deviations = [check for check in checks if not check['ok']]
+    print(f"\nChecked {len(checks)} bins in {len({check['column'] for check in checks})} columns: "
+          f"{len(deviations)} deviation(s) (|z| > {z_limit:g} or exact target missed)")
+    for check in deviations:
+        expected = 'column missing' if check['expected'] is None else f"target {check['expected']:.1f}"
+        z = f", z = {check['z']:+.1f}" if check['z'] is not None else ' (exact)'
+        print(f"  - {check['column']} {check['bin']}: {check['observed']} records, {expected}{z}")
+    return deviations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='CSV files (default: every dataset CSV in --data-dir)')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--profile', default=None, help='Generator profile whose targets the files must meet')
+    parser.add_argument('--profiles-file', default=PROFILES_FILE)
+    parser.add_argument('--z-limit', type=float, default=DEFAULT_Z_LIMIT,
+                        help='Standard deviations a random count may stray from its target')
+    parser.add_argument('--deviations-only', action='store_true', help='Skip the per-class column listing')
+    parser.add_argument('--output', default=None, help='Write profiles and checks as JSON')
+    args = parser.parse_args()
+    if args.profile and not args.files:
+        parser.error('--profile needs the files to check')
+
+    config = load_profiles(args.profiles_file) if args.profile else None
+    signal_spec = load_signal_spec()
+    report = {}
+    failed = 0
+    for path in args.files or dataset_files(args.data_dir):
+        df = load_dataset(path)
+        name = os.path.basename(path)
+        with stage('analyze', rows=len(df)):
+            checks = None
+            if args.profile:
+                try:
+                    result, checks = validate_dataset(df, config, args.profile, args.z_limit, signal_spec)
+                except ValueError as e:
+                    print(f"\n{name}: {e}")
+                    failed += 1
+                    continue
+            else:
+                result = profile_dataset(df, signal_spec=signal_spec)
+        with stage('report'):
+            classes = ', '.join(f"{label} {rows}" for label, rows in result['classes'].items())
+            print(f"\n=== {name}: {result['rows']} records ({classes}) ===")
+            if not args.deviations_only:
+                print_profile(result)
+            if checks is not None:
+                failed += bool(print_checks(checks, args.profile, args.z_limit))
+            report[name] = {'profile': result, 'checks': checks}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+    if failed:
+        parser.exit(1, f"\n{failed} file(s) deviate from profile '{args.profile}'\n")
+
+
+if __name__ == "__main__":
+    run(main)
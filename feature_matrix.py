@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Numeric design matrix of the canonical schema, for model training.
+
+feature_layout() fixes one encoding of the 68 signals, derived from the
+signal spec alone, so every corpus gets the same feature columns:
+
+    numeric   float32, one column per bool, verdict, int and float signal;
+              verdicts as 1 (yes) / 0 (no); NaN where a value is missing
+              or does not fit the signal's type
+    onehot    sparse CSR, one column per value of each categorical signal's
+              vocabulary (signal_spec.signal_vocabulary), plus '<other>'
+              for values the spec does not list (e.g. dmarc_result
+              'softfail'); a missing value has no entry
+    labels    int8 index into signal_spec.CLASSES (signal_schema.class_codes),
+              -1 where the label is not a class
+
+stream_features() yields the three blocks split by split
+(merge_corpus.source_chunks, so legacy families can be migrated on the
+way, with the columns a migration defaults left missing); nothing larger
+than one split's blocks is ever held, and the one-hot block is never
+dense. materialize() appends them to part files and writes a directory:
+
+    numeric.npy, labels.npy   rows in source order (np.load, mmap_mode='r')
+    onehot.npz                the CSR arrays in the scipy.sparse.save_npz
+                              layout (scipy.sparse.load_npz reads it)
+    features.json             feature names, vocabularies, counts, sources
+
+Usage:
+    python feature_matrix.py spam_master_combined.csv no_action_50.csv [...] --output features [--migrate]
+"""
+
+import argparse
+import importlib
+import json
+import os
+import shutil
+import zipfile
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import run, stage
+from matrix_store import COPY_BUFFER_SIZE, DEFAULT_CHUNK_MB, float_values, source_plans, write_array, write_parts
+from merge_corpus import source_chunks
+from record_writer import fsync_dir, partial_path
+from schema_migration import MAPPINGS_FILE, blank_defaulted, load_mappings
+from signal_schema import BOOL_VALUES, class_codes
+from signal_spec import CLASSES, LABEL_COLUMN, load_signal_spec, signal_vocabulary
+
+FEATURES_FILE_NAME = 'features.json'
+# Bump when the encoding changes; load_features() rejects other versions
+FEATURES_VERSION = 1
+NUMERIC_TYPES = ('bool', 'verdict', 'int', 'float')
+# Verdict signals: 1 - Yes; 2 - No
+VERDICT_YES = 1
+VERDICT_NO = 2
+OTHER_VALUE = '<other>'
+CSR_FORMAT = b'csr'
+# CSR arrays -> dtype, as part files and .npz members
+CSR_DTYPES = {'data': np.float32, 'indices': np.int32, 'indptr': np.int64}
+COLUMNS_SHOWN = 5
+
+
+def feature_layout(signal_spec=None):
+    """Feature columns of the spec signals
+
+    Returns {'numeric': [{'name', 'type'}], 'categorical': [{'name',
+    'values', 'offset'}], 'onehot': [feature names]}. A categorical
+    signal's one-hot columns start at its offset: one per vocabulary value,
+    then OTHER_VALUE.
+    """
+    signal_spec = signal_spec or load_signal_spec()
+    layout = {'numeric': [], 'categorical': [], 'onehot': []}
+    for name, signal in signal_spec.items():
+        if signal['type'] in NUMERIC_TYPES:
+            layout['numeric'].append({'name': name, 'type': signal['type']})
+        else:
+            values = signal_vocabulary(signal)
+            layout['categorical'].append({'name': name, 'values': values, 'offset': len(layout['onehot'])})
+            layout['onehot'] += [f"{name}={value}" for value in values + [OTHER_VALUE]]
+    return layout
+
+
+def flag_values(values, signal_type):
+    """0/1 float32 values of a bool or verdict column and how many do not fit (stored as NaN)"""
+    # One hashing pass; only the few distinct values are converted
+    codes, distinct = pd.factorize(values)
+    numbers = pd.to_numeric(pd.Series(distinct, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+    if signal_type == 'verdict':
+        numbers = np.select([numbers == VERDICT_YES, numbers == VERDICT_NO], [1.0, 0.0], np.nan)
+    else:
+        numbers = np.where(np.isin(numbers, BOOL_VALUES), numbers, np.nan)
+    result = np.append(numbers, np.nan).astype(np.float32)[codes]
+    return result, int(np.count_nonzero(np.isnan(result) & (codes >= 0)))
+
+
+def numeric_block(df, layout, invalid):
+    """float32 (rows x numeric features) of a canonical frame; values that do not fit are counted into invalid"""
+    block = np.empty((len(df), len(layout['numeric'])), dtype=np.float32)
+    for position, feature in enumerate(layout['numeric']):
+        values = df[feature['name']]
+        if feature['type'] in ('int', 'float'):
+            block[:, position], bad = float_values(values)
+        else:
+            block[:, position], bad = flag_values(values, feature['type'])
+        if bad:
+            invalid[feature['name']] += bad
+    return block
+
+
+def onehot_block(df, layout):
+    """{'data', 'indices', 'indptr', 'shape'}: the one-hot features of a canonical frame as CSR arrays"""
+    columns = np.empty((len(df), len(layout['categorical'])), dtype=np.int32)
+    for position, feature in enumerate(layout['categorical']):
+        codes, distinct = pd.factorize(df[feature['name']])
+        slots = {value: index for index, value in enumerate(feature['values'])}
+        other = len(feature['values'])
+        lookup = np.array([feature['offset'] + slots.get(str(value).strip(), other) for value in distinct] + [-1],
+                          dtype=np.int32)
+        columns[:, position] = lookup[codes]
+    present = columns >= 0
+    indptr = np.zeros(len(df) + 1, dtype=np.int64)
+    np.cumsum(np.count_nonzero(present, axis=1), out=indptr[1:])
+    # Row-major selection: row by row, each row's columns ascending as CSR expects
+    indices = columns[present]
+    return {'data': np.ones(len(indices), dtype=np.float32), 'indices': indices, 'indptr': indptr,
+            'shape': (len(df), len(layout['onehot']))}
+
+
+def frame_features(df, layout, invalid=None):
+    """{'numeric', 'onehot', 'labels'} of a canonical frame"""
+    invalid = Counter() if invalid is None else invalid
+    return {'numeric': numeric_block(df, layout, invalid), 'onehot': onehot_block(df, layout),
+            'labels': class_codes(df[LABEL_COLUMN])}
+
+
+def stream_features(plans, chunk_bytes=DEFAULT_CHUNK_MB * 1024 * 1024, layout=None, invalid=None):
+    """frame_features() of every split of the sources (merge_corpus.source_plan() plans)
+
+    Each item also names its 'source' (index into plans) and counts the
+    'malformed' rows (extra fields) left out of it.
+    """
+    layout = layout or feature_layout()
+    for index, plan in enumerate(plans):
+        for chunk in source_chunks(plan, chunk_bytes):
+            df = blank_defaulted(chunk['frame'], plan['migration'])
+            with stage('encode', rows=len(df)):
+                features = frame_features(df, layout, invalid)
+            features['source'] = index
+            features['malformed'] = chunk['malformed']
+            yield features
+
+
+def is_features(path):
+    """Whether path is a directory written by materialize()"""
+    return os.path.isfile(os.path.join(path, FEATURES_FILE_NAME))
+
+
+def write_csr(path, parts, rows, nnz, width):
+    """onehot.npz from the CSR part files, streamed into an uncompressed archive"""
+    shapes = {'data': (nnz,), 'indices': (nnz,), 'indptr': (rows + 1,)}
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, dtype in CSR_DTYPES.items():
+            with archive.open(f"{name}.npy", 'w', force_zip64=True) as f:
+                write_parts(f, dtype, shapes[name], [parts[name]])
+        with archive.open('format.npy', 'w') as f:
+            np.lib.format.write_array(f, np.array(CSR_FORMAT))
+        with archive.open('shape.npy', 'w') as f:
+            np.lib.format.write_array(f, np.array([rows, width], dtype=np.int64))
+
+
+def materialize(paths, output, chunk_bytes=DEFAULT_CHUNK_MB * 1024 * 1024, mappings=None, skip_invalid=False):
+    """Write the design matrix of the source CSVs to a directory at output
+
+    Built in <output>.partial and then moved into place. Returns the
+    features.json header.
+    """
+    if os.path.exists(output) and not is_features(output):
+        raise ValueError(f"{output} exists and is not a feature matrix")
+    plans, skipped = source_plans(paths, mappings, skip_invalid)
+
+    layout = feature_layout()
+    building = partial_path(output)
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(os.path.join(building, 'parts'))
+    names = ['numeric', 'labels', *CSR_DTYPES]
+    parts = {name: os.path.join(building, 'parts', f"{name}.bin") for name in names}
+    files = {name: open(path, 'wb', buffering=COPY_BUFFER_SIZE) for name, path in parts.items()}
+    invalid = Counter()
+    onehot_counts = np.zeros(len(layout['onehot']), dtype=np.int64)
+    sources = [{'name': plan['name'], 'path': os.path.abspath(plan['path']),
+                'migrated_from': plan['migration']['family'] if plan['migration'] else None,
+                'rows': 0, 'malformed': 0} for plan in plans]
+    rows = 0
+    nnz = 0
+    try:
+        files['indptr'].write(np.zeros(1, dtype=np.int64).tobytes())
+        for features in stream_features(plans, chunk_bytes, layout, invalid):
+            onehot = features['onehot']
+            count = len(features['labels'])
+            with stage('write', rows=count):
+                files['numeric'].write(features['numeric'].tobytes())
+                files['labels'].write(features['labels'].tobytes())
+                files['data'].write(onehot['data'].tobytes())
+                files['indices'].write(onehot['indices'].tobytes())
+                files['indptr'].write((onehot['indptr'][1:] + nnz).tobytes())
+            onehot_counts += np.bincount(onehot['indices'], minlength=len(onehot_counts))
+            source = sources[features['source']]
+            source['rows'] += count
+            source['malformed'] += features['malformed']
+            rows += count
+            nnz += len(onehot['indices'])
+    finally:
+        for f in files.values():
+            f.close()
+
+    with stage('write', rows=rows):
+        write_array(os.path.join(building, 'numeric.npy'), np.float32, (rows, len(layout['numeric'])),
+                    [parts['numeric']])
+        write_array(os.path.join(building, 'labels.npy'), np.int8, (rows,), [parts['labels']])
+        write_csr(os.path.join(building, 'onehot.npz'), parts, rows, nnz, len(layout['onehot']))
+    shutil.rmtree(os.path.join(building, 'parts'))
+
+    labels = np.load(os.path.join(building, 'labels.npy'), mmap_mode='r')
+    label_counts = np.bincount(labels.astype(np.int64) + 1, minlength=len(CLASSES) + 1)
+    header = {
+        'version': FEATURES_VERSION,
+        'rows': rows,
+        'nnz': nnz,
+        'classes': CLASSES,
+        'class_rows': {name: int(label_counts[index + 1]) for index, name in enumerate(CLASSES)},
+        'unlabeled': int(label_counts[0]),
+        'numeric': layout['numeric'],
+        'categorical': layout['categorical'],
+        'onehot': layout['onehot'],
+        'onehot_counts': onehot_counts.tolist(),
+        'invalid': dict(invalid),
+        'sources': sources,
+        'skipped': skipped,
+    }
+    with open(os.path.join(building, FEATURES_FILE_NAME), 'w') as f:
+        json.dump(header, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    if os.path.exists(output):
+        shutil.rmtree(output)
+    os.replace(building, output)
+    fsync_dir(output)
+    return header
+
+
+def load_features(path):
+    """{'header', 'numeric' and 'labels' (memory-mapped), 'onehot' (CSR arrays)} of a materialized directory"""
+    with open(os.path.join(path, FEATURES_FILE_NAME)) as f:
+        header = json.load(f)
+    if header.get('version') != FEATURES_VERSION:
+        raise ValueError(f"{path}: feature matrix version {header.get('version')}, expected {FEATURES_VERSION}")
+    with np.load(os.path.join(path, 'onehot.npz')) as data:
+        onehot = {name: data[name] for name in CSR_DTYPES}
+        onehot['shape'] = tuple(data['shape'].tolist())
+    return {'header': header, 'onehot': onehot,
+            'numeric': np.load(os.path.join(path, 'numeric.npy'), mmap_mode='r'),
+            'labels': np.load(os.path.join(path, 'labels.npy'), mmap_mode='r')}
+
+
+def to_scipy(onehot):
+    """CSR arrays as a scipy.sparse.csr_matrix (scipy is only needed for this)"""
+    sparse = importlib.import_module('scipy.sparse')
+    return sparse.csr_matrix((onehot['data'], onehot['indices'], onehot['indptr']), shape=onehot['shape'])
+
+
+def listed(names):
+    """Names for a message, the first few and a count of the rest"""
+    names = list(names)
+    more = f" (+{len(names) - COLUMNS_SHOWN} more)" if len(names) > COLUMNS_SHOWN else ''
+    return ', '.join(names[:COLUMNS_SHOWN]) + more
+
+
+def print_header(header, output):
+    """Shape, classes and value problems of a materialized design matrix"""
+    print(f"{output}: {header['rows']} records x {len(header['numeric'])} numeric + "
+          f"{len(header['onehot'])} one-hot features ({header['nnz']} one-hot entries)")
+    counts = ', '.join(f"{name} {count}" for name, count in header['class_rows'].items())
+    print(f"  classes: {counts}, unlabeled {header['unlabeled']}")
+    for feature in header['categorical']:
+        other = header['onehot_counts'][feature['offset'] + len(feature['values'])]
+        if other:
+            print(f"  {feature['name']}: {other} values outside the spec vocabulary ({OTHER_VALUE})")
+    for name, count in header['invalid'].items():
+        print(f"  {name}: {count} values stored as NaN (do not fit the signal type)")
+    for source in header['sources']:
+        migrated = f" [migrated from {source['migrated_from']}]" if source['migrated_from'] else ''
+        print(f"  {source['name']}{migrated}: {source['rows']} records, {source['malformed']} malformed left out")
+    for message in header['skipped']:
+        print(f"  Skipped {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Materialize a numeric design matrix with sparse one-hot enums')
+    parser.add_argument('files', nargs='+', help='Source CSVs, in row order')
+    parser.add_argument('--output', required=True, help='Output directory')
+    parser.add_argument('--chunk-mb', type=float, default=DEFAULT_CHUNK_MB, help='Bytes of a source read at a time')
+    parser.add_argument('--migrate', action='store_true', help='Convert legacy schema files instead of rejecting them')
+    parser.add_argument('--mappings', default=MAPPINGS_FILE, help='Schema mappings file for --migrate')
+    parser.add_argument('--skip-invalid', action='store_true', help='Leave out sources whose header does not match')
+    args = parser.parse_args()
+
+    mappings = load_mappings(args.mappings) if args.migrate else None
+    try:
+        header = materialize(args.files, args.output, int(args.chunk_mb * 1024 * 1024), mappings, args.skip_invalid)
+    except (OSError, ValueError) as e:
+        parser.exit(1, f"Error: {e}\n")
+    print_header(header, args.output)
+
+
+if __name__ == "__main__":
+    run(main)
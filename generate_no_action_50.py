@@ -1,5 +1,10 @@
 import csv
 import random
+from collections import Counter
+
+from data_paths import data_path
+from instrumentation import run, stage
+from record_writer import draw_quota, open_csv
 
 # Define the header
 header = [
@@ -116,24 +121,28 @@ def generate_no_action_record(is_border_case=False):
     
     return record
 
-# Generate records
-all_records = []
-
-# Generate 30 clear No Action records
-for i in range(30):
-    all_records.append(generate_no_action_record(is_border_case=False))
+# Generate records in chunks; each chunk draws its share of clear/border cases
+# without replacement, so only one chunk is ever held in memory
+CHUNK_SIZE = 10000
 
-# Generate 20 border case No Action records
-for i in range(20):
-    all_records.append(generate_no_action_record(is_border_case=True))
+def main():
+    # 30 clear No Action records and 20 border case No Action records
+    border_cases = Counter({False: 30, True: 20})
+    total_records = sum(border_cases.values())
 
-# Shuffle all records
-random.shuffle(all_records)
+    # Write to CSV
+    with open_csv(data_path('no_action_50.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for start in range(0, total_records, CHUNK_SIZE):
+            n = min(CHUNK_SIZE, total_records - start)
+            with stage('generate', rows=n):
+                rows = [generate_no_action_record(is_border_case=is_border_case)
+                        for is_border_case in draw_quota(border_cases, n)]
+            with stage('write', rows=n):
+                writer.writerows(rows)
 
-# Write to CSV
-with open('/home/u3/email_data/spam_data/no_action_50.csv', 'w', newline='') as f:
-    writer = csv.writer(f)
-    writer.writerow(header)
-    writer.writerows(all_records)
+    print("Successfully created no_action_50.csv with 50 unique No Action records (30 clear + 20 border cases)")
 
-print("Successfully created no_action_50.csv with 50 unique No Action records (30 clear + 20 border cases)")
\ No newline at end of file
+if __name__ == "__main__":
+    run(main)
\ No newline at end of file
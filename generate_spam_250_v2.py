@@ -1,5 +1,10 @@
 import csv
 import random
+from collections import Counter
+
+from data_paths import data_path
+from instrumentation import run, stage
+from record_writer import draw_quota, open_csv
 
 # Define the header
 header = [
@@ -118,32 +123,32 @@ def generate_spam_record(spam_type, bulk_indicator):
     
     return record
 
-# Generate records
-all_records = []
-
-# Create distribution for bulk_message_indicator
-bulk_indicators = [1] * 170 + [0] * 80
-random.shuffle(bulk_indicators)
-
-# Generate 60 clear spam records
-for i in range(60):
-    all_records.append(generate_spam_record('clear', bulk_indicators[i]))
+# Generate records in chunks; each chunk draws its share of every quota
+# without replacement, so only one chunk is ever held in memory
+CHUNK_SIZE = 10000
 
-# Generate 140 moderate spam records
-for i in range(60, 200):
-    all_records.append(generate_spam_record('moderate', bulk_indicators[i]))
+def main():
+    # Distribution of spam types (60 clear, 140 moderate, 50 borderline)
+    spam_types = Counter({'clear': 60, 'moderate': 140, 'borderline': 50})
+    total_records = sum(spam_types.values())
 
-# Generate 50 borderline spam records
-for i in range(200, 250):
-    all_records.append(generate_spam_record('borderline', bulk_indicators[i]))
+    # Create distribution for bulk_message_indicator
+    bulk_indicators = Counter({1: 170, 0: 80})
 
-# Shuffle all records
-random.shuffle(all_records)
+    # Write to CSV
+    with open_csv(data_path('spam_new_250_v2.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for start in range(0, total_records, CHUNK_SIZE):
+            n = min(CHUNK_SIZE, total_records - start)
+            with stage('generate', rows=n):
+                rows = [generate_spam_record(spam_type, bulk_indicator)
+                        for spam_type, bulk_indicator in zip(draw_quota(spam_types, n),
+                                                             draw_quota(bulk_indicators, n))]
+            with stage('write', rows=n):
+                writer.writerows(rows)
 
-# Write to CSV
-with open('/home/u3/email_data/spam_data/spam_new_250_v2.csv', 'w', newline='') as f:
-    writer = csv.writer(f)
-    writer.writerow(header)
-    writer.writerows(all_records)
+    print("Successfully created spam_new_250_v2.csv with 250 unique spam records")
 
-print("Successfully created spam_new_250_v2.csv with 250 unique spam records")
\ No newline at end of file
+if __name__ == "__main__":
+    run(main)
\ No newline at end of file
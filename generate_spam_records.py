@@ -5,15 +5,31 @@ Distribution:
 - 60 clear spam (0.8-0.98)
 - 140 moderate spam (0.6-0.8)
 - 50 borderline spam (0.5-0.6)
+
+Each batch is written to a copy of the file (spam_new_250.csv.partial),
+fsync'd and checkpointed with the RNG state, then moved into place, so the
+file only ever holds whole batches. An interrupted run picks up after the
+last completed batch the next time it is started. Staging copies the file,
+so a batch costs time in proportion to the file size; batch_generator.py
+writes large outputs.
 """
 
 import csv
+import os
 import random
+from collections import Counter
 from datetime import datetime
 
+from data_paths import data_path
+from instrumentation import run, stage
+from record_writer import (checkpoint_path, draw_quota, load_checkpoint, partial_path, publish, random_state_from_json,
+                           random_state_to_json, replace_output, save_checkpoint, start_append)
+
 # Constants
-OUTPUT_FILE = '/home/u3/email_data/spam_data/spam_new_250.csv'
+OUTPUT_FILE = data_path('spam_new_250.csv')
 BATCH_SIZE = 50
+CHECKPOINT_FILE = checkpoint_path(OUTPUT_FILE)
+PARTIAL_FILE = partial_path(OUTPUT_FILE)
 
 # Enum values
 SPF_RESULTS = ['pass', 'fail', 'softfail', 'neutral', 'none']
@@ -122,43 +138,60 @@ def main():
         reader = csv.DictReader(f)
         fieldnames = reader.fieldnames
     
-    # Generate records
-    all_records = []
-    
-    # Generate 60 clear spam records
-    print("Generating 60 clear spam records (0.8-0.98)...")
-    for i in range(60):
-        all_records.append(generate_spam_record('clear', i))
-    
-    # Generate 140 moderate spam records
-    print("Generating 140 moderate spam records (0.6-0.8)...")
-    for i in range(140):
-        all_records.append(generate_spam_record('moderate', i + 60))
-    
-    # Generate 50 borderline spam records
-    print("Generating 50 borderline spam records (0.5-0.6)...")
-    for i in range(50):
-        all_records.append(generate_spam_record('borderline', i + 200))
-    
-    # Shuffle to mix the types
-    random.shuffle(all_records)
+    # Spam type quotas: 60 clear (0.8-0.98), 140 moderate (0.6-0.8), 50 borderline (0.5-0.6)
+    total_records = 250
+    state = load_checkpoint(CHECKPOINT_FILE)
+    if state:
+        # Resume an interrupted run: a batch that was checkpointed but not yet
+        # moved into place is published, a half-staged one is dropped, and the
+        # run continues from the last completed batch with the saved RNG state
+        if os.path.exists(PARTIAL_FILE):
+            if os.path.getsize(PARTIAL_FILE) == state['size']:
+                replace_output(PARTIAL_FILE, OUTPUT_FILE)
+            else:
+                os.remove(PARTIAL_FILE)
+        random.setstate(random_state_from_json(state['rng']))
+        print(f"Resuming after batch {state['batch']} ({state['written']} records already appended)...")
+    else:
+        state = {
+            'batch': 0,
+            'written': 0,
+            'bulk_count': 0,
+            'remaining': {'clear': 60, 'moderate': 140, 'borderline': 50},
+            'size': os.path.getsize(OUTPUT_FILE),
+        }
+        save_checkpoint(CHECKPOINT_FILE, dict(state, rng=random_state_to_json(random.getstate())))
+    remaining = Counter(state['remaining'])
     
-    # Write in batches
-    print(f"\nAppending {len(all_records)} records to {OUTPUT_FILE} in batches of {BATCH_SIZE}...")
+    # Stream batches: each batch draws its spam types from the remaining quota
+    # in random order, so nothing beyond one batch is held in memory
+    print(f"Appending {total_records - state['written']} records to {OUTPUT_FILE} in batches of {BATCH_SIZE}...")
     
-    with open(OUTPUT_FILE, 'a', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        
-        for i in range(0, len(all_records), BATCH_SIZE):
-            batch = all_records[i:i + BATCH_SIZE]
-            writer.writerows(batch)
-            print(f"  Batch {i//BATCH_SIZE + 1}: Appended {len(batch)} records")
+    for i in range(state['written'], total_records, BATCH_SIZE):
+        with stage('generate', rows=min(BATCH_SIZE, total_records - i)):
+            spam_types = draw_quota(remaining, min(BATCH_SIZE, total_records - i))
+            batch = [generate_spam_record(spam_type, i + j) for j, spam_type in enumerate(spam_types)]
+        with stage('write', rows=len(batch)):
+            with start_append(OUTPUT_FILE) as f:
+                csv.DictWriter(f, fieldnames=fieldnames).writerows(batch)
+                
+                # Publish the batch: fsync the staged copy, record it in the
+                # checkpoint, then move it into place
+                state['batch'] += 1
+                state['written'] += len(batch)
+                state['bulk_count'] += sum(1 for r in batch if r['bulk_message_indicator'] == 1)
+                state['remaining'] = dict(remaining)
+                state['rng'] = random_state_to_json(random.getstate())
+                publish(f, CHECKPOINT_FILE, state)
+            replace_output(PARTIAL_FILE, OUTPUT_FILE)
+        print(f"  Batch {state['batch']}: Appended {len(batch)} records")
     
-    print(f"\nSuccessfully appended {len(all_records)} unique spam records!")
+    os.remove(CHECKPOINT_FILE)
+    print(f"\nSuccessfully appended {total_records} unique spam records!")
     
     # Verify bulk_message_indicator distribution
-    bulk_count = sum(1 for r in all_records if r['bulk_message_indicator'] == 1)
-    print(f"\nBulk message indicator distribution: {bulk_count} with 1, {250 - bulk_count} with 0")
+    bulk_count = state['bulk_count']
+    print(f"\nBulk message indicator distribution: {bulk_count} with 1, {total_records - bulk_count} with 0")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run(main)
\ No newline at end of file
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Opt-in timing and memory instrumentation for the pipeline scripts.
+
+Scripts mark their stages:
+
+    with stage('load') as record:
+        df = read_dataset(path)
+        record['rows'] = len(df)
+
+and start through run(main). Nothing is recorded unless SPAM_DATA_TRACE is
+set, and stage() then costs one check. With SPAM_DATA_TRACE=<file> (or '-'
+for stderr) every stage appends one JSON line when it ends:
+
+    {"event": "stage", "script": "check_duplicates", "stage": "hash", "parent": null,
+     "wall_s": 0.21, "cpu_s": 0.2, "rows": 100000, "peak_rss_mb": 135.2, "rss_growth_mb": 12.1, "pid": 4242}
+
+and one "summary" line per stage name (calls, total wall and CPU time,
+rows) when the script exits. peak_rss_mb is the process peak so far and
+rss_growth_mb how far the stage raised it. SPAM_DATA_TRACE_MEMORY=1 also
+traces Python and NumPy allocations (tracemalloc, several times slower) and
+adds each stage's peak_alloc_mb. SPAM_DATA_PROFILE=<file> runs main() under
+cProfile and dumps the stats there (read them with python -m pstats).
+
+Stages used across the scripts: generate, shuffle, write, load, hash,
+rule-evaluate and report, plus migrate, encode and analyze (statistics,
+profiles, clustering, validation). A stage entered inside one of the same
+name (e.g. the CSV parse inside a cache load) is counted once, as the outer
+stage.
+"""
+
+import atexit
+import contextlib
+import cProfile
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+TRACE_PATH = os.environ.get('SPAM_DATA_TRACE') or None
+TRACE_MEMORY = os.environ.get('SPAM_DATA_TRACE_MEMORY') == '1'
+PROFILE_PATH = os.environ.get('SPAM_DATA_PROFILE') or None
+MB = 1024 * 1024
+
+# Per-process trace state: output stream, open stages (innermost last) and per-stage totals
+TRACE = {'stream': None, 'script': None, 'active': [], 'totals': {}}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    return peak / (MB if platform.system() == 'Darwin' else 1024)
+
+
+def script_name():
+    """Name the trace lines of this process carry"""
+    if TRACE['script'] is None:
+        # 'check_duplicates' for a script, 'spam_data dedup' through the command-line tool
+        TRACE['script'] = os.path.basename(sys.argv[0] or 'python').replace('.py', '')
+    return TRACE['script']
+
+
+def emit(line):
+    """Append one JSON line to the trace"""
+    if TRACE['stream'] is None:
+        TRACE['stream'] = sys.stderr if TRACE_PATH == '-' else open(TRACE_PATH, 'a', buffering=1)
+        atexit.register(emit_summary)
+        if TRACE_MEMORY and not tracemalloc.is_tracing():
+            tracemalloc.start()
+    TRACE['stream'].write(json.dumps(line) + '\n')
+
+
+def emit_summary():
+    """One summary line per stage name, at exit"""
+    for name, totals in TRACE['totals'].items():
+        emit({'event': 'summary', 'script': script_name(), 'stage': name, **totals, 'pid': os.getpid()})
+    TRACE['totals'] = {}
+    if TRACE['stream'] is not None and TRACE['stream'] is not sys.stderr:
+        TRACE['stream'].flush()
+
+
+def stage(name, rows=None):
+    """Context manager recording a stage; set 'rows' on the record it yields (a no-op unless tracing)"""
+    if TRACE_PATH is None or any(entry['name'] == name for entry in TRACE['active']):
+        return contextlib.nullcontext({})
+    return traced_stage(name, rows)
+
+
+@contextlib.contextmanager
+def traced_stage(name, rows):
+    """stage() while tracing"""
+    if TRACE['stream'] is None:
+        # Opens the trace (and starts tracemalloc) before the first measurement
+        emit({'event': 'start', 'script': script_name(), 'argv': sys.argv[1:], 'pid': os.getpid()})
+    record = {'rows': rows}
+    active = TRACE['active']
+    if TRACE_MEMORY:
+        if active:
+            active[-1]['alloc_peak'] = max(active[-1]['alloc_peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    entry = {'name': name, 'alloc_peak': 0}
+    active.append(entry)
+    rss_before = peak_rss_mb()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        active.pop()
+        rss = peak_rss_mb()
+        line = {'event': 'stage', 'script': script_name(), 'stage': name,
+                'parent': active[-1]['name'] if active else None,
+                'wall_s': round(wall, 6), 'cpu_s': round(cpu, 6), 'rows': record['rows'],
+                'peak_rss_mb': round(rss, 1), 'rss_growth_mb': round(rss - rss_before, 1)}
+        if TRACE_MEMORY:
+            alloc_peak = max(entry['alloc_peak'], tracemalloc.get_traced_memory()[1])
+            line['peak_alloc_mb'] = round(alloc_peak / MB, 1)
+            if active:
+                active[-1]['alloc_peak'] = max(active[-1]['alloc_peak'], alloc_peak)
+        line['pid'] = os.getpid()
+        emit(line)
+        totals = TRACE['totals'].setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows': 0})
+        totals['calls'] += 1
+        totals['wall_s'] = round(totals['wall_s'] + wall, 6)
+        totals['cpu_s'] = round(totals['cpu_s'] + cpu, 6)
+        totals['rows'] += record['rows'] or 0
+
+
+def run(main):
+    """Run a script's main(), under cProfile when SPAM_DATA_PROFILE is set"""
+    if PROFILE_PATH is None:
+        return main()
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(main)
+    finally:
+        profiler.dump_stats(PROFILE_PATH)
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped matrix store of the corpus, for model training.
+
+export_store() converts dataset CSVs into a directory of .npy arrays that
+np.load(mmap_mode='r') maps without parsing or copying:
+
+    floats.npy    float32 (rows x float and int signals), NaN = missing
+    flags.npy     uint8 (rows x bool and verdict signals), 255 = missing
+    codes.npy     int16 (rows x categorical signals): index into the
+                  column's vocabulary, -1 = missing
+    labels.npy    uint8: index into signal_spec.CLASSES
+    sources.npy   uint16: index of the source file
+    store.json    the schema: each column's array, position and vocabulary,
+                  the row range of each class and the sources
+
+Arrays are row-major and rows are grouped by class, so a range of rows, a
+whole class or a column of any array is a view of the mapped file (see
+open_store() and its helpers). Mapped read-only, the pages are shared by
+every process on the node that opens the store.
+
+Sources are streamed split by split (merge_corpus.source_chunks): each
+split is encoded and its rows appended to one part file per class and
+array, and the parts are joined behind .npy headers at the end, so memory
+depends on --chunk-mb, not the corpus size. Categorical vocabularies start
+with the spec's values and are extended with any other value found (e.g.
+dmarc_result 'softfail'). Values that do not fit a column's type (text in
+a numeric column, a flag other than 0/1) are stored as missing and counted
+per column; rows whose label is not one of the classes are left out.
+Columns a migration filled with defaults are stored as missing.
+
+Usage:
+    python matrix_store.py export spam_master_combined.csv no_action_50.csv [...] --output corpus.store --migrate
+    python matrix_store.py info corpus.store
+"""
+
+import argparse
+import json
+import os
+import shutil
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import run, stage
+from merge_corpus import source_chunks, source_plan
+from record_writer import fsync_dir, partial_path
+from schema_migration import MAPPINGS_FILE, blank_defaulted, load_mappings
+from signal_schema import BOOL_VALUES, class_codes
+from signal_spec import CLASSES, LABEL_COLUMN, load_signal_spec
+
+HEADER_FILE_NAME = 'store.json'
+# Bump when the layout changes; open_store() rejects other versions
+STORE_VERSION = 1
+# array -> dtype, in file order
+ARRAY_DTYPES = {
+    'floats': np.float32,
+    'flags': np.uint8,
+    'codes': np.int16,
+    'labels': np.uint8,
+    'sources': np.uint16,
+}
+# Spec type -> the matrix its columns are stored in
+TYPE_ARRAYS = {'float': 'floats', 'int': 'floats', 'bool': 'flags', 'verdict': 'flags', 'categorical': 'codes'}
+MISSING_FLAG = 255
+MISSING_CODE = -1
+DEFAULT_CHUNK_MB = 16
+COPY_BUFFER_SIZE = 1024 * 1024
+COLUMNS_SHOWN = 5
+
+
+def store_columns(signal_spec=None):
+    """Column name -> {'type', 'array', 'index'} for every spec signal, in spec order
+
+    Categorical columns also get 'values' (their vocabulary, starting with
+    the spec's values) and 'spec_values' (how many of them the spec lists).
+    """
+    signal_spec = signal_spec or load_signal_spec()
+    widths = Counter()
+    columns = {}
+    for name, signal in signal_spec.items():
+        array = TYPE_ARRAYS[signal['type']]
+        columns[name] = {'type': signal['type'], 'array': array, 'index': widths[array]}
+        if array == 'codes':
+            columns[name]['values'] = list(signal['values'] or [])
+            columns[name]['spec_values'] = len(columns[name]['values'])
+        widths[array] += 1
+    return columns
+
+
+def array_widths(columns):
+    """Columns per matrix"""
+    widths = Counter(meta['array'] for meta in columns.values())
+    return {array: widths[array] for array in ('floats', 'flags', 'codes')}
+
+
+def float_values(values):
+    """float32 values of a column and how many of them are not numbers (stored as NaN)"""
+    try:
+        return values.to_numpy(dtype=np.float32), 0
+    except (TypeError, ValueError):
+        # Some text in the column: the slower element-wise conversion
+        numbers = pd.to_numeric(values, errors='coerce')
+        return numbers.to_numpy(dtype=np.float32, na_value=np.nan), int((numbers.isna() & values.notna()).sum())
+
+
+def flag_codes(distinct, allowed):
+    """uint8 value of each distinct flag value, MISSING_FLAG where it is not an allowed number"""
+    numbers = pd.to_numeric(pd.Series(distinct, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+    return np.where(np.isin(numbers, allowed), numbers, MISSING_FLAG).astype(np.uint8)
+
+
+def vocabulary_codes(distinct, meta):
+    """Vocabulary index of each distinct value, adding values the vocabulary lacks"""
+    position = {value: index for index, value in enumerate(meta['values'])}
+    for value in distinct:
+        if value not in position:
+            position[value] = len(meta['values'])
+            meta['values'].append(value)
+    if len(meta['values']) > np.iinfo(np.int16).max:
+        raise ValueError(f"{len(meta['values'])} distinct values in a categorical column; "
+                         f"the store holds at most {np.iinfo(np.int16).max}")
+    return np.array([position[value] for value in distinct], dtype=np.int16)
+
+
+def encode_frame(df, columns, coerced, signal_spec=None):
+    """Class index per row (-1 = not a class) and the floats, flags and codes matrices of a canonical frame
+
+    Vocabularies in columns grow with new values; values stored as missing
+    because they do not fit their column are counted into coerced.
+    """
+    signal_spec = signal_spec or load_signal_spec()
+    labels = class_codes(df[LABEL_COLUMN])
+    matrices = {array: np.empty((len(df), width), dtype=ARRAY_DTYPES[array])
+                for array, width in array_widths(columns).items()}
+    for name, meta in columns.items():
+        values = df[name]
+        if meta['array'] == 'floats':
+            matrices['floats'][:, meta['index']], bad = float_values(values)
+        else:
+            # One hashing pass; only the few distinct values are converted
+            codes, distinct = pd.factorize(values)
+            if meta['array'] == 'flags':
+                allowed = BOOL_VALUES if meta['type'] == 'bool' else signal_spec[name]['values']
+                lookup = np.append(flag_codes(distinct, allowed), MISSING_FLAG)
+                bad = int(np.count_nonzero(lookup[codes[codes >= 0]] == MISSING_FLAG))
+            else:
+                lookup = np.append(vocabulary_codes(distinct, meta), MISSING_CODE)
+                bad = 0
+            matrices[meta['array']][:, meta['index']] = lookup[codes]
+        if bad:
+            coerced[name] += bad
+    return labels, matrices
+
+
+def part_path(directory, array, label):
+    """Part file holding one class's rows of one array"""
+    return os.path.join(directory, 'parts', f"{array}.{label}.bin")
+
+
+def write_parts(f, dtype, shape, parts):
+    """.npy content of the given shape whose data is the part files joined in order"""
+    np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                             'fortran_order': False, 'shape': shape})
+    for part in parts:
+        with open(part, 'rb') as source:
+            shutil.copyfileobj(source, f, COPY_BUFFER_SIZE)
+
+
+def write_array(path, dtype, shape, parts):
+    """A .npy file of the given shape whose data is the part files joined in order"""
+    with open(path, 'wb') as f:
+        write_parts(f, dtype, shape, parts)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def is_store(path):
+    """Whether path is a directory written by export_store()"""
+    return os.path.isfile(os.path.join(path, HEADER_FILE_NAME))
+
+
+def source_plans(paths, mappings=None, skip_invalid=False):
+    """merge_corpus.source_plan() of each path and the problems of those skipped
+
+    Raises ValueError for a source that does not match the canonical schema
+    unless skip_invalid.
+    """
+    skipped = []
+    plans = []
+    for path in paths:
+        try:
+            plans.append(source_plan(path, mappings))
+        except ValueError as e:
+            skipped.append(str(e))
+    if skipped and not skip_invalid:
+        raise ValueError('\n'.join(skipped))
+    return plans, skipped
+
+
+def export_store(paths, output, chunk_bytes=DEFAULT_CHUNK_MB * 1024 * 1024, mappings=None, skip_invalid=False):
+    """Write the rows of the source CSVs to a matrix store at output (a directory)
+
+    The store is built in <output>.partial and then moved into place, so
+    readers never see half of it. Returns the store header.
+    """
+    if os.path.exists(output) and not is_store(output):
+        raise ValueError(f"{output} exists and is not a matrix store")
+    if len(paths) > np.iinfo(np.uint16).max:
+        raise ValueError(f"{len(paths)} sources; the store holds at most {np.iinfo(np.uint16).max}")
+    plans, skipped = source_plans(paths, mappings, skip_invalid)
+
+    signal_spec = load_signal_spec()
+    columns = store_columns(signal_spec)
+    widths = array_widths(columns)
+    building = partial_path(output)
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(os.path.join(building, 'parts'))
+    parts = {(array, label): open(part_path(building, array, label), 'wb', buffering=COPY_BUFFER_SIZE)
+             for array in ARRAY_DTYPES for label in range(len(CLASSES))}
+    class_rows = Counter()
+    coerced = Counter()
+    sources = []
+    try:
+        for index, plan in enumerate(plans):
+            migration = plan['migration']
+            source = {'name': plan['name'], 'path': os.path.abspath(plan['path']),
+                      'migrated_from': migration['family'] if migration else None,
+                      'rows': 0, 'malformed': 0, 'unlabeled': 0, 'written': 0}
+            for chunk in source_chunks(plan, chunk_bytes):
+                df = blank_defaulted(chunk['frame'], migration)
+                source['rows'] += len(df) + chunk['malformed']
+                source['malformed'] += chunk['malformed']
+                with stage('encode', rows=len(df)):
+                    labels, matrices = encode_frame(df, columns, coerced, signal_spec)
+                    matrices['labels'] = labels.astype(np.uint8)
+                    matrices['sources'] = np.full(len(df), index, dtype=np.uint16)
+                with stage('write', rows=len(df)):
+                    for label in range(len(CLASSES)):
+                        rows = labels == label
+                        if not rows.any():
+                            continue
+                        for array, matrix in matrices.items():
+                            parts[array, label].write(np.ascontiguousarray(matrix[rows]).tobytes())
+                        class_rows[label] += int(np.count_nonzero(rows))
+                source['unlabeled'] += int(np.count_nonzero(labels < 0))
+                source['written'] = source['rows'] - source['malformed'] - source['unlabeled']
+            sources.append(source)
+    finally:
+        for f in parts.values():
+            f.close()
+
+    total = sum(class_rows.values())
+    with stage('write', rows=total):
+        for array, dtype in ARRAY_DTYPES.items():
+            shape = (total, widths[array]) if array in widths else (total,)
+            write_array(os.path.join(building, f"{array}.npy"), dtype, shape,
+                        [part_path(building, array, label) for label in range(len(CLASSES))])
+    shutil.rmtree(os.path.join(building, 'parts'))
+
+    starts = np.cumsum([0] + [class_rows[label] for label in range(len(CLASSES))]).tolist()
+    header = {
+        'version': STORE_VERSION,
+        'rows': total,
+        'classes': {name: [starts[label], starts[label + 1]] for label, name in enumerate(CLASSES)},
+        'arrays': {array: {'file': f"{array}.npy", 'dtype': np.dtype(dtype).name}
+                   for array, dtype in ARRAY_DTYPES.items()},
+        'missing': {'floats': 'nan', 'flags': MISSING_FLAG, 'codes': MISSING_CODE},
+        'columns': columns,
+        'coerced': dict(coerced),
+        'sources': sources,
+        'skipped': skipped,
+    }
+    with open(os.path.join(building, HEADER_FILE_NAME), 'w') as f:
+        json.dump(header, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    # Processes that still map the old arrays keep reading them until they reopen the store
+    if os.path.exists(output):
+        shutil.rmtree(output)
+    os.replace(building, output)
+    fsync_dir(output)
+    return header
+
+
+def open_store(path):
+    """{'header', and one read-only memory-mapped array per ARRAY_DTYPES name} of a store"""
+    with open(os.path.join(path, HEADER_FILE_NAME)) as f:
+        header = json.load(f)
+    if header.get('version') != STORE_VERSION:
+        raise ValueError(f"{path}: store version {header.get('version')}, expected {STORE_VERSION}")
+    store = {'header': header}
+    for array, meta in header['arrays'].items():
+        store[array] = np.load(os.path.join(path, meta['file']), mmap_mode='r')
+    return store
+
+
+def class_rows(store, label):
+    """Row slice holding every row of one class"""
+    start, stop = store['header']['classes'][label]
+    return slice(start, stop)
+
+
+def store_rows(store, rows):
+    """Views of every array for a row slice (e.g. class_rows(store, 'Spam'))"""
+    return {array: store[array][rows] for array in ARRAY_DTYPES}
+
+
+def column(store, name, rows=slice(None)):
+    """View of one column, or of a row slice of it"""
+    meta = store['header']['columns'][name]
+    return store[meta['array']][rows, meta['index']]
+
+
+def column_values(store, name, rows=slice(None)):
+    """A categorical column decoded to its values (a copy; missing = None)"""
+    meta = store['header']['columns'][name]
+    vocabulary = np.array(meta['values'] + [None], dtype=object)
+    return vocabulary[column(store, name, rows)]
+
+
+def listed(names):
+    """Names for a message, the first few and a count of the rest"""
+    names = list(names)
+    more = f" (+{len(names) - COLUMNS_SHOWN} more)" if len(names) > COLUMNS_SHOWN else ''
+    return ', '.join(names[:COLUMNS_SHOWN]) + more
+
+
+def print_header(store, path):
+    """Layout, class ranges and sources of a store"""
+    header = store['header']
+    print(f"{path}: {header['rows']} records")
+    for array in ARRAY_DTYPES:
+        values = store[array]
+        names = [name for name, meta in header['columns'].items() if meta['array'] == array]
+        print(f"  {array:8} {values.dtype.name:8} {str(values.shape):14} {values.nbytes / (1024 * 1024):9.2f} MB"
+              + (f"  {listed(names)}" if names else ''))
+    for name, (start, stop) in header['classes'].items():
+        print(f"  {name:12} rows {start}-{stop} ({stop - start} records)")
+    extended = {name: meta['values'][meta['spec_values']:] for name, meta in header['columns'].items()
+                if meta['array'] == 'codes' and len(meta['values']) > meta['spec_values']}
+    for name, values in extended.items():
+        print(f"  {name}: {len(values)} values not in the spec: {listed(str(value) for value in values)}")
+    for name, count in header['coerced'].items():
+        print(f"  {name}: {count} values stored as missing (do not fit the column type)")
+    for source in header['sources']:
+        migrated = f" [migrated from {source['migrated_from']}]" if source['migrated_from'] else ''
+        print(f"  {source['name']}{migrated}: {source['rows']} records, {source['malformed']} malformed, "
+              f"{source['unlabeled']} unlabeled -> {source['written']} stored")
+    for message in header['skipped']:
+        print(f"  Skipped {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory-mapped matrix store of dataset CSVs for training')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='convert CSVs into a store')
+    export.add_argument('files', nargs='+', help='Source CSVs')
+    export.add_argument('--output', required=True, help='Store directory')
+    export.add_argument('--chunk-mb', type=float, default=DEFAULT_CHUNK_MB, help='Bytes of a source read at a time')
+    export.add_argument('--migrate', action='store_true', help='Convert legacy schema files instead of rejecting them')
+    export.add_argument('--mappings', default=MAPPINGS_FILE, help='Schema mappings file for --migrate')
+    export.add_argument('--skip-invalid', action='store_true', help='Leave out sources whose header does not match')
+    info = commands.add_parser('info', help='show the layout of a store')
+    info.add_argument('store', help='Store directory')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'export':
+            mappings = load_mappings(args.mappings) if args.migrate else None
+            export_store(args.files, args.output, int(args.chunk_mb * 1024 * 1024), mappings, args.skip_invalid)
+            path = args.output
+        else:
+            path = args.store
+        store = open_store(path)
+    except (OSError, ValueError) as e:
+        parser.exit(1, f"Error: {e}\n")
+    print_header(store, path)
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Find near-duplicate records: rows that differ only by small numeric noise.
+
+Exact hashing (check_duplicates.py) misses rows such as content_spam_score
+0.85 vs 0.86 with everything else identical. Here every row is split into a
+numeric vector (score/count/flag columns) and a categorical key (enum and
+text columns, e.g. spf_result). Two rows are near-duplicates when their
+categorical keys are equal and every numeric column differs by at most the
+threshold (Chebyshev distance), and clusters are the connected components of
+that relation.
+
+Pairs are found without comparing all of them, with grid LSH: each hash
+table snaps the numeric vector to a randomly shifted grid of cells a few
+thresholds wide, and only rows that land in the same cell (with the same
+categorical key) are candidates. Candidates are checked against the exact
+distance. Cost is O(rows * tables * columns); a pair with noise in many
+columns can be missed by all tables, so raise --tables for higher recall.
+
+Files are compared with others of the same schema (column names, ignoring
+case and spaces); the label column is not compared but shown, so clusters
+with conflicting labels stand out.
+"""
+
+import argparse
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_paths import DATA_DIR, dataset_files
+from dataset_cache import load_dataset
+from instrumentation import run, stage
+from row_fingerprint import FINGERPRINT_PRIME, canonical_value, columns_fingerprints
+from signal_spec import LABEL_COLUMN
+
+DEFAULT_THRESHOLD = 0.02
+DEFAULT_TABLES = 8
+# Grid cell width in thresholds; wider cells miss fewer pairs but make bigger buckets
+DEFAULT_CELL_FACTOR = 4
+# Neighbours compared per row inside a bucket (sorted along a random projection)
+DEFAULT_WINDOW = 8
+DEFAULT_SHOW = 20
+# Missing numeric values only match other missing values
+MISSING_VALUE = -1e12
+# float32 vectors: allow for rounding when comparing against the threshold
+DISTANCE_TOLERANCE = 1e-5
+
+
+def column_key(name):
+    """Column name as compared across files ('Classification' == 'classification')"""
+    return str(name).strip().replace(' ', '_').lower()
+
+
+def schema_groups(paths):
+    """Read each file once and group the frames by schema"""
+    groups = {}
+    for path in paths:
+        df = load_dataset(path)
+        schema = tuple(column_key(name) for name in df.columns)
+        groups.setdefault(schema, []).append((os.path.basename(path), df))
+    return groups
+
+
+def signal_vectors(schema, frames):
+    """Numeric matrix, categorical key, labels and (file, row) sources for a schema group"""
+    numeric_columns = []
+    categorical_columns = []
+    labels = None
+    for position, name in enumerate(schema):
+        parts = [df.iloc[:, position] for _, df in frames]
+        if name == LABEL_COLUMN:
+            labels = pd.concat(parts, ignore_index=True).astype(str).to_numpy()
+        elif all(pd.api.types.is_numeric_dtype(part) or pd.api.types.is_bool_dtype(part) for part in parts):
+            values = np.concatenate([part.to_numpy(dtype=np.float64, na_value=np.nan) for part in parts])
+            numeric_columns.append(np.where(np.isnan(values), MISSING_VALUE, values).astype(np.float32))
+        else:
+            values = pd.concat(parts, ignore_index=True).to_numpy(dtype=object)
+            categorical_columns.append(values)
+
+    n_rows = sum(len(df) for _, df in frames)
+    numeric = np.column_stack(numeric_columns) if numeric_columns else np.zeros((n_rows, 0), dtype=np.float32)
+    if categorical_columns:
+        # canonical_value makes 'NULL', 'None' and '' the same missing value
+        canonical = [pd.Series(values).map(canonical_value).to_numpy(dtype=object) for values in categorical_columns]
+        categorical = columns_fingerprints(canonical)
+    else:
+        categorical = np.zeros(n_rows, dtype=np.uint64)
+    if labels is None:
+        labels = np.full(n_rows, '', dtype=object)
+    file_index = np.repeat(np.arange(len(frames)), [len(df) for _, df in frames])
+    # +2 because row 1 is header, data starts at row 2
+    row_numbers = np.concatenate([np.arange(len(df)) + 2 for _, df in frames])
+    return numeric, categorical, labels, (file_index, row_numbers)
+
+
+def cell_keys(numeric, categorical, cell_width, rng):
+    """Bucket key of every row for one randomly shifted grid"""
+    keys = categorical.copy()
+    shifts = rng.uniform(0, cell_width, numeric.shape[1])
+    for column in range(numeric.shape[1]):
+        cells = np.floor((numeric[:, column] + shifts[column]) / cell_width).astype(np.int64)
+        keys ^= cells.view(np.uint64)
+        keys *= FINGERPRINT_PRIME
+    return keys
+
+
+def close_pairs(numeric, categorical, first, second, threshold):
+    """Which candidate pairs are within the threshold"""
+    if not len(first):
+        return np.zeros(0, dtype=bool)
+    distance = np.abs(numeric[first] - numeric[second]).max(axis=1, initial=0)
+    return (categorical[first] == categorical[second]) & (distance <= threshold + DISTANCE_TOLERANCE)
+
+
+def bucket_pairs(keys, projection, window):
+    """Candidate pairs: rows up to window apart within a bucket, ordered by projection"""
+    order = np.lexsort((projection, keys))
+    ordered = keys[order]
+    firsts, seconds = [], []
+    for offset in range(1, window + 1):
+        same = np.flatnonzero(ordered[offset:] == ordered[:-offset])
+        if not len(same):
+            # Keys are sorted: no equal keys at this distance means none further apart
+            break
+        firsts.append(order[same])
+        seconds.append(order[same + offset])
+    if not firsts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def connected_components(n, first, second):
+    """Component label (smallest member) of every node of an undirected graph"""
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[first], labels[second])
+        updated = labels.copy()
+        np.minimum.at(updated, first, low)
+        np.minimum.at(updated, second, low)
+        # Pointer jumping: follow labels to their own labels until they settle
+        while True:
+            jumped = updated[updated]
+            if np.array_equal(jumped, updated):
+                break
+            updated = jumped
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def near_duplicate_clusters(numeric, categorical, threshold=DEFAULT_THRESHOLD, tables=DEFAULT_TABLES,
+                            cell_factor=DEFAULT_CELL_FACTOR, window=DEFAULT_WINDOW, seed=0):
+    """Cluster label of every row; rows alone in their cluster are not near-duplicates"""
+    # Identical vectors collapse to one point first, so repeats never blow up a bucket
+    fingerprints = columns_fingerprints([categorical] + [numeric[:, column] for column in range(numeric.shape[1])])
+    _, first_rows, point_of_row = np.unique(fingerprints, return_index=True, return_inverse=True)
+    points = numeric[first_rows]
+    point_keys = categorical[first_rows]
+
+    rng = np.random.default_rng(seed)
+    cell_width = threshold * cell_factor
+    firsts, seconds = [], []
+    for _ in range(tables):
+        keys = cell_keys(points, point_keys, cell_width, rng)
+        projection = points.astype(np.float64) @ rng.normal(size=points.shape[1])
+        first, second = bucket_pairs(keys, projection, window)
+        close = close_pairs(points, point_keys, first, second, threshold)
+        firsts.append(first[close])
+        seconds.append(second[close])
+    components = connected_components(len(points), np.concatenate(firsts), np.concatenate(seconds))
+    return components[point_of_row]
+
+
+def cluster_members(clusters):
+    """Row positions of every cluster with more than one row, largest first"""
+    order = np.argsort(clusters, kind='stable')
+    ordered = clusters[order]
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    members = [group for group in np.split(order, starts[1:]) if len(group) > 1]
+    members.sort(key=lambda group: (-len(group), group[0]))
+    return members
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='CSV files (default: every dataset CSV in --data-dir)')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='largest per-column difference between near-duplicates')
+    parser.add_argument('--tables', type=int, default=DEFAULT_TABLES, help='LSH hash tables (recall vs time)')
+    parser.add_argument('--cell-factor', type=float, default=DEFAULT_CELL_FACTOR)
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--show', type=int, default=DEFAULT_SHOW, help='clusters to print')
+    parser.add_argument('--output', help='write cluster,file,row,label for every clustered row to this CSV')
+    args = parser.parse_args()
+    if args.threshold <= 0:
+        parser.error('--threshold must be positive')
+
+    files = args.files or dataset_files(args.data_dir)
+    if not files:
+        parser.error(f'no CSV files found in {args.data_dir}')
+
+    rows = []
+    total_clusters = total_rows = cross_file = conflicting = 0
+    for schema, frames in schema_groups(files).items():
+        names = [name for name, _ in frames]
+        numeric, categorical, labels, (file_index, row_numbers) = signal_vectors(schema, frames)
+        print(f"\n{'='*60}")
+        print(f"Schema with {len(schema)} columns: {len(numeric)} records in {len(frames)} file(s)")
+        print(f"  {numeric.shape[1]} numeric columns, {len(schema) - numeric.shape[1] - (LABEL_COLUMN in schema)} "
+              f"categorical columns")
+
+        with stage('analyze', rows=len(numeric)):
+            clusters = near_duplicate_clusters(numeric, categorical, args.threshold, args.tables,
+                                               args.cell_factor, args.window, args.seed)
+        members = cluster_members(clusters)
+        print(f"  Near-duplicate clusters: {len(members)} ({sum(len(group) for group in members)} records)")
+        for number, group in enumerate(members):
+            spread = np.abs(numeric[group] - numeric[group[0]]).max(initial=0)
+            total_clusters += 1
+            total_rows += len(group)
+            cross_file += len(set(file_index[group])) > 1
+            conflicting += len(set(labels[group])) > 1
+            if number < args.show:
+                print(f"\n  Cluster of {len(group)} records (max difference from first: {spread:.4g}):")
+                for position in group:
+                    print(f"    - {names[file_index[position]]}, row {row_numbers[position]} ({labels[position]})")
+            for position in group:
+                rows.append((total_clusters, names[file_index[position]], row_numbers[position], labels[position]))
+        if len(members) > args.show:
+            print(f"\n  ... {len(members) - args.show} more clusters")
+
+    with stage('report'):
+        print(f"\n{'='*60}")
+        print("SUMMARY:")
+        print(f"  Near-duplicate clusters: {total_clusters} covering {total_rows} records")
+        print(f"  Clusters spanning several files: {cross_file}")
+        print(f"  Clusters with conflicting labels: {conflicting}")
+
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['cluster', 'file', 'row', 'label'])
+            writer.writerows(rows)
+        print(f"  Cluster assignments written to {args.output}")
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Exact-count allocation of rows to quota cells.
+
+A generation run has several labelled dimensions: the sub-type and every
+quota column (each quota branch is a category). Constraints fix row counts
+per category of one dimension (a marginal, e.g. 170/80 bulk_message_indicator)
+or per cell of several dimensions (a joint table, e.g. sub-type x bulk flag).
+
+Dimensions linked by joint tables form a block. joint_table() turns a
+block's constraints into one integer table over all its dimensions, scaled
+to the run's row count, that meets every constraint exactly: the first table
+is scaled by largest remainder, and every later one is scaled within the
+cells it shares with what has been built, then split across the existing
+cells in proportion. That needs each joint table to share dimensions with
+only one earlier table (no cycles), which validate_constraints() checks.
+
+Rows are then labelled from the cell counts alone: take_counts() splits a
+table into exact shares for shards and batches, and assign_rows() turns a
+share into per-row labels with one repeat, one shuffle and one
+unravel_index, all O(N) NumPy operations. A block of one dimension draws
+exactly what the per-column quotas always drew, so existing seeds keep
+their output.
+"""
+
+import numpy as np
+
+
+def scale_counts(counts, n_rows):
+    """Scale integer counts to sum exactly to n_rows (largest remainder)"""
+    counts = np.asarray(counts, dtype=np.int64)
+    total = counts.sum()
+    if total == n_rows:
+        return counts.copy()
+    exact = counts * n_rows / total
+    scaled = np.floor(exact).astype(np.int64)
+    shortfall = n_rows - scaled.sum()
+    if shortfall:
+        # Stable sort keeps ties in declaration order
+        order = np.argsort(-(exact - scaled), kind='stable')
+        scaled[order[:shortfall]] += 1
+    return scaled
+
+
+def take_counts(left, n, rng):
+    """Take an exact n-row share of the counts left (updates left in place)"""
+    if n == left.sum():
+        take = left.copy()
+    else:
+        # Same per-chunk counts as slicing a globally shuffled quota list
+        take = rng.multivariate_hypergeometric(left, n)
+    left -= take
+    return take
+
+
+def shuffled_labels(counts, rng):
+    """Label array with exactly counts[k] rows of label k, in random order"""
+    labels = np.repeat(np.arange(len(counts)), counts)
+    rng.shuffle(labels)
+    return labels
+
+
+def marginal(table, axes, keep):
+    """Sums of a table over axes (its dimensions) down to the dimensions in keep, in keep's order"""
+    summed = table.sum(axis=tuple(position for position, axis in enumerate(axes) if axis not in keep))
+    kept = [axis for axis in axes if axis in keep]
+    return np.transpose(summed, [kept.index(axis) for axis in keep])
+
+
+def validate_constraints(sizes, constraints, names=None):
+    """Errors in constraints [(dimension indices, counts)] over dimensions of the given sizes"""
+    names = names or [f"#{axis}" for axis in range(len(sizes))]
+
+    def listed(axes):
+        return ' x '.join(names[axis] for axis in axes)
+
+    errors = []
+    for axes, counts in constraints:
+        counts = np.asarray(counts)
+        if len(set(axes)) != len(axes):
+            errors.append(f"{listed(axes)}: a dimension is repeated")
+        elif counts.shape != tuple(sizes[axis] for axis in axes):
+            errors.append(f"{listed(axes)}: counts have shape {counts.shape}, "
+                          f"expected {tuple(sizes[axis] for axis in axes)}")
+        elif counts.dtype.kind not in 'iu' or (counts < 0).any():
+            errors.append(f"{listed(axes)}: counts must be non-negative integers")
+    if errors:
+        return errors
+
+    for position, (axes, counts) in enumerate(constraints):
+        earlier = [other_axes for other_axes, _ in constraints[:position]]
+        for other_axes, other_counts in constraints[:position]:
+            shared = [axis for axis in axes if axis in other_axes]
+            if shared and (marginal(np.asarray(counts), axes, shared) !=
+                           marginal(np.asarray(other_counts), other_axes, shared)).any():
+                errors.append(f"{listed(axes)}: counts disagree with {listed(other_axes)} on {listed(shared)}")
+        shared = {axis for axis in axes if any(axis in other_axes for other_axes in earlier)}
+        if shared and not any(shared <= set(other_axes) for other_axes in earlier):
+            errors.append(f"{listed(axes)}: overlaps more than one earlier table; "
+                          f"order joint tables so each overlaps a single earlier one")
+    return errors
+
+
+def constraint_blocks(n_dims, constraints):
+    """Group constraints into blocks of linked dimensions, ordered by their first dimension
+
+    Returns [{'dims': sorted dimension indices, 'constraints': [(block-local
+    axes, counts)]}]; joint tables keep their order ahead of marginals.
+    """
+    owner = list(range(n_dims))
+
+    def root(dim):
+        while owner[dim] != dim:
+            dim = owner[dim]
+        return dim
+
+    for axes, _ in constraints:
+        for axis in axes[1:]:
+            owner[root(axis)] = root(axes[0])
+    blocks = {}
+    for dim in range(n_dims):
+        blocks.setdefault(root(dim), []).append(dim)
+    ordered = sorted(blocks.values())
+    result = []
+    for dims in ordered:
+        members = [(axes, counts) for axes, counts in constraints if axes[0] in dims]
+        members.sort(key=lambda member: len(member[0]) == 1)
+        result.append({'dims': dims,
+                       'constraints': [(tuple(dims.index(axis) for axis in axes), np.asarray(counts, dtype=np.int64))
+                                       for axes, counts in members]})
+    return result
+
+
+def split_cells(fixed, target):
+    """Integer table with row sums fixed and column sums target, each row in proportion to what is left"""
+    out = np.zeros((len(fixed), len(target)), dtype=np.int64)
+    left = np.array(target, dtype=np.int64)
+    for row, count in enumerate(fixed):
+        if count:
+            out[row] = scale_counts(left, count)
+            left -= out[row]
+    return out
+
+
+def joint_table(sizes, constraints, n_rows):
+    """Integer table over every dimension of a block, n_rows in total, meeting each (scaled) constraint
+
+    sizes are the block's dimension sizes and constraints its [(axes,
+    counts)] as returned by constraint_blocks().
+    """
+    first_axes, first_counts = constraints[0]
+    table = scale_counts(first_counts.ravel(), n_rows).reshape(first_counts.shape)
+    current = list(first_axes)
+    for axes, counts in constraints[1:]:
+        new = [axis for axis in axes if axis not in current]
+        if not new:
+            # Implied by an earlier table (validate_constraints checked they agree)
+            continue
+        shared = [axis for axis in axes if axis in current]
+        rest = [axis for axis in current if axis not in shared]
+        groups = int(np.prod([sizes[axis] for axis in shared]))
+        wanted = np.moveaxis(counts, [axes.index(axis) for axis in shared], range(len(shared))).reshape(groups, -1)
+        have = np.moveaxis(table, [current.index(axis) for axis in shared], range(len(shared))).reshape(groups, -1)
+        cells = np.zeros((groups, have.shape[1], wanted.shape[1]), dtype=np.int64)
+        for group in range(groups):
+            fixed = have[group].sum()
+            if fixed:
+                cells[group] = split_cells(have[group], scale_counts(wanted[group], fixed))
+        current = shared + rest + new
+        table = cells.reshape([sizes[axis] for axis in current])
+    missing = [axis for axis in range(len(sizes)) if axis not in current]
+    if missing:
+        raise ValueError(f"dimensions {missing} have no counts")
+    return np.ascontiguousarray(np.transpose(table, [current.index(axis) for axis in range(len(sizes))]))
+
+
+def assign_rows(table, rng):
+    """Per-dimension label arrays for a row of every cell of a table, in random order"""
+    cells = shuffled_labels(table.ravel(), rng)
+    return np.unravel_index(cells, table.shape)
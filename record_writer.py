@@ -0,0 +1,123 @@
+"""
+Helpers for streaming generated records to CSV in constant memory.
+
+Instead of building every record, shuffling the full list and then writing it,
+records are generated chunk by chunk. Each chunk takes its share of the exact
+class/quota counts by sampling without replacement from what is left. That
+gives every chunk the same composition as the matching slice of a globally
+shuffled list, so the quotas hold for the whole stream while only one chunk
+is held in memory.
+"""
+
+import json
+import os
+import random
+import shutil
+from collections import Counter
+
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def open_csv(path, mode='w'):
+    """Open a CSV file for writing with a large output buffer"""
+    return open(path, mode, newline='', buffering=WRITE_BUFFER_SIZE)
+
+
+def draw_quota(remaining, k, rng=random):
+    """Draw k labels without replacement from a {label: count} quota, in random order"""
+    labels = rng.sample(list(remaining), counts=list(remaining.values()), k=k)
+    remaining.subtract(Counter(labels))
+    return labels
+
+
+# Checkpointed output: every published batch is fsync'd and recorded in a
+# checkpoint (file size plus generator state) that is replaced atomically.
+# After a crash the output is truncated back to the last published size,
+# which drops any half-written batch, and generation resumes from the saved
+# state without regenerating or re-reading the rows already written.
+# Appending to an existing file instead stages each batch in a partial copy
+# of it (start_append) and moves that into place (replace_output), so the
+# file itself only ever holds whole batches.
+
+def checkpoint_path(path):
+    """Checkpoint file that tracks progress for an output file"""
+    return path + '.ckpt'
+
+
+def partial_path(path):
+    """Temporary file a new output is written to until it is complete"""
+    return path + '.partial'
+
+
+def fsync_dir(path):
+    """Make a rename or new file in path's directory durable"""
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def save_checkpoint(path, state):
+    """Atomically replace the checkpoint at path with state"""
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fsync_dir(path)
+
+
+def load_checkpoint(path):
+    """The saved checkpoint state, or None if there is none"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def publish(f, checkpoint, state):
+    """Make everything written to f durable, then record it in the checkpoint"""
+    f.flush()
+    os.fsync(f.fileno())
+    state['size'] = os.fstat(f.fileno()).st_size
+    save_checkpoint(checkpoint, state)
+
+
+def rollback(path, size):
+    """Drop anything written to path after the last published size"""
+    with open(path, 'r+b') as f:
+        f.truncate(size)
+        os.fsync(f.fileno())
+
+
+def start_append(path):
+    """Open a partial copy of path to append a batch to (publish it with replace_output)"""
+    partial = partial_path(path)
+    shutil.copyfile(path, partial)
+    return open_csv(partial, 'a')
+
+
+def replace_output(partial, output):
+    """Atomically move a partial file into place"""
+    os.replace(partial, output)
+    fsync_dir(output)
+
+
+def finish(partial, output, checkpoint):
+    """Atomically move a completed partial file into place and clear its checkpoint"""
+    replace_output(partial, output)
+    os.remove(checkpoint)
+
+
+def random_state_to_json(state):
+    """random.getstate() in a JSON-serializable form"""
+    version, internal, gauss = state
+    return [version, list(internal), gauss]
+
+
+def random_state_from_json(state):
+    """Inverse of random_state_to_json, for random.setstate()"""
+    version, internal, gauss = state
+    return version, tuple(internal), gauss
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Rule-based reference class for every row, to audit dataset labels.
+
+A scoring file (see reference_scoring.json) gives each class of
+base_documeant.txt but No Action a "min_score" and weighted evidence rules
+in the signal_rules.py language:
+
+    {"columns": [c1, c2, ...], "test": [op, value], "weight": w, "message": "..."}
+
+The rules of every class are compiled into one signal_rules plan, so a
+split is scored in a single evaluate() pass: its per-row rule hits times the
+(rules x classes) weight matrix give each row's score for every class. A
+class is reached when its score is at least its min_score; the first
+"precedence" tier holding a reached class decides (harm outranks suspicion
+and bulk), within the tier the class with the highest score relative to its
+min_score wins, and a row that reaches no class is No Action.
+
+A class's evidence is its score over twice its min_score, capped at 1, so
+a reached class has evidence 0.5-1. The confidence of a row is the
+evidence for its reference class, or for No Action 1 minus the strongest
+evidence for any class.
+
+Rows whose classification differs from the reference class with at least
+--min-confidence are disagreements. They are counted per source and listed
+with --report as CSV (source row, both classes, confidence, the rules that
+fired). Sources are streamed split by split (merge_corpus.source_chunks).
+
+Usage:
+    python reference_scorer.py spam_master_combined.csv no_action_50.csv [...] [--report disagreements.csv]
+"""
+
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+
+from data_paths import CODE_DIR, DATA_DIR, dataset_files
+from instrumentation import run, stage
+from matrix_store import DEFAULT_CHUNK_MB, source_plans
+from merge_corpus import READ_OPTIONS, source_chunks
+from near_duplicates import column_key
+from record_writer import open_csv
+from schema_migration import MAPPINGS_FILE, blank_defaulted, load_mappings
+from signal_rules import compile_rules, evaluate, load_rules, parse_overrides
+from signal_schema import class_codes
+from signal_spec import CLASSES, LABEL_COLUMN, canonical_header, load_signal_spec
+
+SCORING_FILE = os.path.join(CODE_DIR, 'reference_scoring.json')
+NO_ACTION = 'No Action'
+# A class's evidence reaches 1 at this multiple of its min_score
+EVIDENCE_SATURATION = 2
+DEFAULT_MIN_CONFIDENCE = 0.75
+REPORT_HEADER = ['source', 'source_row', 'classification', 'reference', 'confidence', 'rules']
+# Row label of the confusion matrix for labels that are not a class
+UNLABELED = '(no class)'
+RULES_SHOWN = 10
+
+
+def compile_scoring(config, columns, overrides=None):
+    """Plan for scoring frames with the given columns
+
+    Returns {'plan': the signal_rules plan of every class's rules,
+    'classes': scored classes in precedence order, 'codes': their CLASSES
+    indices, 'weights': (rules x classes), 'min_scores', 'tiers'}.
+    """
+    tiers = {name: tier for tier, names in enumerate(config['precedence']) for name in names}
+    classes = sorted(config['classes'], key=lambda name: tiers.get(name, len(config['precedence'])))
+    unknown = [name for name in classes if name not in CLASSES or name == NO_ACTION]
+    if unknown:
+        raise ValueError(f"Scoring rules for {', '.join(unknown)}; classes are scored "
+                         f"except {NO_ACTION}: {', '.join(CLASSES)}")
+    rules = [{**rule, 'class': name} for name in classes for rule in config['classes'][name]['rules']]
+    family = {'requires': [], 'rules': rules}
+    plan = compile_rules({'params': config.get('params', {}), 'families': {'reference': family}}, 'reference',
+                         columns, overrides)
+    weights = np.zeros((len(plan['rules']), len(classes)), dtype=np.float32)
+    for position, rule in enumerate(plan['rules']):
+        weights[position, classes.index(rule['source']['class'])] = rule['source']['weight']
+    return {
+        'plan': plan,
+        'classes': classes,
+        'codes': np.array([CLASSES.index(name) for name in classes], dtype=np.int8),
+        'weights': weights,
+        'min_scores': np.array([config['classes'][name]['min_score'] for name in classes], dtype=np.float32),
+        'tiers': np.array([tiers.get(name, len(config['precedence'])) for name in classes], dtype=np.float32),
+    }
+
+
+def score_frame(scoring, df):
+    """Reference class (CLASSES index) and confidence of every row, with the packed rule hits
+
+    Returns {'reference': int8, 'confidence': float32, 'bitmaps': evaluate()'s
+    per-row rule bitmaps}.
+    """
+    bitmaps = evaluate(scoring['plan'], df, bitmaps=True)['bitmaps']
+    with stage('analyze', rows=len(df)):
+        hits = np.unpackbits(bitmaps, axis=1, count=len(scoring['plan']['rules']), bitorder='little')
+        scores = hits.astype(np.float32) @ scoring['weights']
+        strength = scores / scoring['min_scores']
+        evidence = np.minimum(strength / EVIDENCE_SATURATION, 1)
+        reached = strength >= 1
+        tier = np.where(reached, scoring['tiers'], np.inf).min(axis=1, initial=np.inf)
+        # Within the deciding tier the strongest class wins (uncapped, so two saturated classes
+        # are still told apart); ties go to the earlier class in precedence order
+        best = np.where(reached & (scoring['tiers'] == tier[:, None]), strength, -np.inf).argmax(axis=1)
+        decided = reached.any(axis=1)
+        rows = np.arange(len(df))
+        reference = np.where(decided, scoring['codes'][best], CLASSES.index(NO_ACTION)).astype(np.int8)
+        confidence = np.where(decided, evidence[rows, best], 1 - evidence.max(axis=1, initial=0))
+    return {'reference': reference, 'confidence': confidence.astype(np.float32), 'bitmaps': bitmaps}
+
+
+def fired_rules(scoring, bitmaps):
+    """'; '-joined 'class: rule' names of the rules each row fired, built once per distinct pattern"""
+    rules = scoring['plan']['rules']
+    if not len(bitmaps):
+        return np.array([], dtype=object)
+    patterns, inverse = np.unique(bitmaps, axis=0, return_inverse=True)
+    names = []
+    for pattern in patterns:
+        hits = np.unpackbits(pattern, count=len(rules), bitorder='little')
+        names.append('; '.join(f"{rule['source']['class']}: {rule['name']}" for rule, hit in zip(rules, hits) if hit))
+    return np.array(names, dtype=object)[inverse.ravel()]
+
+
+def read_options(plan, signal_spec=None):
+    """read_split() options for a source: categorical signals parsed as categories, numbers inferred
+
+    Migrated sources are read as text, as migrate_frame() expects.
+    """
+    if plan['migration'] is not None:
+        return READ_OPTIONS
+    signal_spec = signal_spec or load_signal_spec()
+    categorical = {column_key(name) for name, signal in signal_spec.items() if signal['type'] == 'categorical'}
+    dtypes = {column: 'category' for column in plan['columns'] if column_key(column) in categorical}
+    return {'dtype': dtypes, 'keep_default_na': False, 'na_values': ['']}
+
+
+def new_summary(name, n_rules):
+    """Counts for one source"""
+    return {'name': name, 'rows': 0, 'malformed': 0, 'disagreements': 0,
+            # (label, reference) counts; label row len(CLASSES) holds labels that are not a class
+            'confusion': np.zeros((len(CLASSES) + 1, len(CLASSES)), dtype=np.int64),
+            # Rows among the disagreements that fired each rule
+            'rule_counts': np.zeros(n_rules, dtype=np.int64)}
+
+
+def score_sources(plans, scoring, chunk_bytes=DEFAULT_CHUNK_MB * 1024 * 1024, min_confidence=DEFAULT_MIN_CONFIDENCE,
+                  report=None):
+    """Per-source summaries of the reference classes; disagreements are written to the report csv.writer"""
+    summaries = []
+    for plan in plans:
+        summary = new_summary(plan['name'], len(scoring['plan']['rules']))
+        for chunk in source_chunks(plan, chunk_bytes, read_options(plan)):
+            df = blank_defaulted(chunk['frame'], plan['migration'])
+            scored = score_frame(scoring, df)
+            labels = class_codes(df[LABEL_COLUMN])
+            label_rows = np.where(labels < 0, len(CLASSES), labels)
+            summary['confusion'] += np.bincount(label_rows * len(CLASSES) + scored['reference'],
+                                                minlength=summary['confusion'].size).reshape(summary['confusion'].shape)
+            disagree = np.flatnonzero((labels != scored['reference']) & (scored['confidence'] >= min_confidence))
+            hits = np.unpackbits(scored['bitmaps'][disagree], axis=1, count=len(summary['rule_counts']),
+                                 bitorder='little')
+            summary['rule_counts'] += hits.sum(axis=0, dtype=np.int64)
+            summary['rows'] += len(df)
+            summary['malformed'] += chunk['malformed']
+            summary['disagreements'] += len(disagree)
+            if report is not None and len(disagree):
+                with stage('write', rows=len(disagree)):
+                    reasons = fired_rules(scoring, scored['bitmaps'][disagree])
+                    report.writerows(zip([plan['name']] * len(disagree), chunk['rows'][disagree].tolist(),
+                                         df[LABEL_COLUMN].to_numpy()[disagree].tolist(),
+                                         [CLASSES[code] for code in scored['reference'][disagree]],
+                                         np.round(scored['confidence'][disagree], 3).tolist(), reasons.tolist()))
+        summaries.append(summary)
+    return summaries
+
+
+def print_confusion(confusion):
+    """Reference class counts by labelled class"""
+    width = max(len(name) for name in [*CLASSES, UNLABELED]) + 2
+    print("Reference class (columns) by classification (rows):")
+    print(' ' * width + ''.join(f"{name:>{width}}" for name in CLASSES))
+    for name, counts in zip([*CLASSES, UNLABELED], confusion):
+        if counts.any():
+            print(f"{name:{width}}" + ''.join(f"{count:>{width}}" for count in counts))
+
+
+def print_summaries(summaries, scoring, min_confidence):
+    """Per-source agreement, the overall confusion matrix and the rules behind disagreements"""
+    for summary in summaries:
+        agree = int(np.trace(summary['confusion'][:len(CLASSES)]))
+        malformed = f", {summary['malformed']} malformed left out" if summary['malformed'] else ''
+        print(f"{summary['name']}: {summary['rows']} records, {agree} agree with the reference class, "
+              f"{summary['disagreements']} disagree with confidence >= {min_confidence}{malformed}")
+    print()
+    print_confusion(sum(summary['confusion'] for summary in summaries))
+    rule_counts = sum(summary['rule_counts'] for summary in summaries)
+    top = [position for position in np.argsort(-rule_counts, kind='stable')[:RULES_SHOWN] if rule_counts[position]]
+    if top:
+        print("\nRules fired most often in disagreements:")
+        for position in top:
+            rule = scoring['plan']['rules'][position]
+            print(f"  {rule['source']['class']}: {rule['name']}: {rule_counts[position]} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score rows with the reference rules and find label disagreements')
+    parser.add_argument('files', nargs='*', help='CSV files (default: every dataset CSV in --data-dir)')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--scoring', default=SCORING_FILE, help='Scoring file (weighted rules per class)')
+    parser.add_argument('--set', dest='overrides', action='append', default=[], metavar='NAME=VALUE',
+                        help='Override a rule threshold, e.g. --set spam_score_threshold=0.5')
+    parser.add_argument('--min-confidence', type=float, default=DEFAULT_MIN_CONFIDENCE,
+                        help='Reference confidence (0.5-1) from which a differing label is a disagreement')
+    parser.add_argument('--report', default=None, help='Write the disagreeing rows to this CSV')
+    parser.add_argument('--chunk-mb', type=float, default=DEFAULT_CHUNK_MB, help='Bytes of a source read at a time')
+    parser.add_argument('--migrate', action='store_true', help='Convert legacy schema files instead of rejecting them')
+    parser.add_argument('--mappings', default=MAPPINGS_FILE, help='Schema mappings file for --migrate')
+    parser.add_argument('--skip-invalid', action='store_true', help='Leave out sources whose header does not match')
+    args = parser.parse_args()
+
+    config = load_rules(args.scoring)
+    try:
+        overrides = parse_overrides(args.overrides, config.get('params', {}))
+        scoring = compile_scoring(config, canonical_header(), overrides)
+        mappings = load_mappings(args.mappings) if args.migrate else None
+        plans, skipped = source_plans(args.files or dataset_files(args.data_dir), mappings, args.skip_invalid)
+    except (OSError, ValueError) as e:
+        parser.exit(1, f"Error: {e}\n")
+
+    started = time.perf_counter()
+    report = None
+    if args.report:
+        report_file = open_csv(args.report)
+        report = csv.writer(report_file)
+        report.writerow(REPORT_HEADER)
+    try:
+        summaries = score_sources(plans, scoring, int(args.chunk_mb * 1024 * 1024), args.min_confidence, report)
+    finally:
+        if report is not None:
+            report_file.close()
+    elapsed = time.perf_counter() - started
+
+    with stage('report'):
+        for message in skipped:
+            print(f"Skipped {message}")
+        print_summaries(summaries, scoring, args.min_confidence)
+    rows = sum(summary['rows'] for summary in summaries)
+    disagreements = sum(summary['disagreements'] for summary in summaries)
+    print(f"\nScored {rows} records in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} records/s); "
+          f"{disagreements} disagreements")
+    if args.report:
+        print(f"Disagreements written to {args.report}")
+
+
+if __name__ == "__main__":
+    run(main)
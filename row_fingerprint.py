@@ -0,0 +1,132 @@
+"""
+Columnar row fingerprints for the dataset CSVs.
+
+A fingerprint is a 64-bit hash of every value in a row, computed for a whole
+DataFrame at once with pandas' vectorized hashing instead of building a string
+and an MD5 per row. Each column is factorized and only its distinct values are
+normalized and hashed: numbers hash by their float value (so 1 and 1.0 match),
+the NA markers pandas reads as missing ('NULL', 'None', '') all hash alike,
+and numeric text hashes like the number it parses to. That makes freshly
+generated columns fingerprint exactly like the same rows read back from CSV.
+Column names are ignored so files whose headers differ only in spelling
+('Classification' vs 'classification') still compare by content.
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+
+# Strings pandas.read_csv reads as missing by default
+NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+NA_TOKEN = '\x00NA'
+FINGERPRINT_SEED = np.uint64(0x9E3779B97F4A7C15)
+FINGERPRINT_PRIME = np.uint64(0x100000001B3)
+
+
+def read_dataset(path):
+    """Read a dataset CSV, keeping one frame row per data line
+
+    A few files have lines with more fields than the header. Rather than
+    dropping those lines (which would shift every later row number), the
+    extra fields are folded into the last column so the row is kept, intact
+    and distinct, at its original position. Positions of folded rows are
+    listed in df.attrs['folded_rows'].
+    """
+    with stage('load') as record:
+        df = read_folding(path, len(pd.read_csv(path, nrows=0).columns))
+        record['rows'] = len(df)
+    return df
+
+
+def read_folding(source, width, **kwargs):
+    """pd.read_csv(source, **kwargs), folding extra fields on long lines into the last of width columns"""
+    try:
+        df = pd.read_csv(source, **kwargs)
+        df.attrs['folded_rows'] = []
+        return df
+    except pd.errors.ParserError:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+    folded = set()
+
+    def fold_extra_fields(fields):
+        last = ','.join(fields[width - 1:])
+        folded.add(last)
+        return fields[:width - 1] + [last]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', pd.errors.ParserWarning)
+        df = pd.read_csv(source, engine='python', on_bad_lines=fold_extra_fields, **kwargs)
+    df.attrs['folded_rows'] = np.flatnonzero(df.iloc[:, -1].isin(folded)).tolist()
+    return df
+
+
+def canonical_value(value):
+    """Text a value hashes as, identical for a generated value and its CSV round trip"""
+    if value is None:
+        return NA_TOKEN
+    if isinstance(value, str):
+        if value in NA_VALUES:
+            return NA_TOKEN
+        try:
+            value = float(value)
+        except ValueError:
+            return value
+    elif isinstance(value, (bool, np.bool_)):
+        return str(bool(value))
+    if value != value:
+        return NA_TOKEN
+    return repr(float(value))
+
+
+def column_hashes(values):
+    """uint64 hash of every value in one column"""
+    codes, distinct = pd.factorize(np.asarray(values), use_na_sentinel=False)
+    canonical = np.array([canonical_value(value) for value in distinct.tolist()], dtype=object)
+    return pd.util.hash_array(canonical)[codes]
+
+
+def columns_fingerprints(columns):
+    """uint64 fingerprint of every row of a sequence of equal-length columns"""
+    fingerprints = None
+    with stage('hash') as record:
+        for values in columns:
+            hashes = column_hashes(values)
+            if fingerprints is None:
+                fingerprints = np.full(len(hashes), FINGERPRINT_SEED, dtype=np.uint64)
+            # Order-dependent combine, so swapping two columns changes the fingerprint
+            fingerprints ^= hashes
+            fingerprints *= FINGERPRINT_PRIME
+        record['rows'] = None if fingerprints is None else len(fingerprints)
+    return fingerprints
+
+
+def frame_fingerprints(df):
+    """uint64 fingerprint of every row of df, in row order"""
+    if not len(df.columns):
+        return np.zeros(len(df), dtype=np.uint64)
+    return columns_fingerprints(values.to_numpy() for _, values in df.items())
+
+
+def duplicate_groups(fingerprints):
+    """Positions of rows sharing a fingerprint, one array per group
+
+    Groups are ordered by their first occurrence and list positions in
+    ascending order, matching a dict of fingerprint -> positions built in
+    a single pass over the rows.
+    """
+    fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+    order = np.argsort(fingerprints, kind='stable')
+    ordered = fingerprints[order]
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    sizes = np.diff(np.r_[starts, len(ordered)])
+    repeated = sizes > 1
+    groups = [order[start:start + size] for start, size in zip(starts[repeated], sizes[repeated])]
+    groups.sort(key=lambda group: group[0])
+    return groups
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Convert legacy schema files into the canonical 69-column schema.
+
+A mappings file (see schema_mappings.json) lists, per source family, how
+each canonical column is filled from the source columns:
+
+    "target": "source"                                    copy a column
+    "target": {"from": ["a", "b"]}                        first non-missing of a, b
+    "target": {"from": "source", "scale": [a, b]}         a * x + b (e.g. [-1, 1] inverts a score)
+    "target": {"from": "source", "test": [op, value],
+               "then": x, "else": y}                      x where the test holds, else y
+    "target": {"value": x}                                constant
+
+A family is picked the same way as for the rules (the first family whose
+"requires" columns are all present). Canonical columns a family does not
+list are copied from a source column of the same name, and otherwise get
+the default for their spec type (signal not present in the legacy export).
+A family's optional "defaulted" list names canonical columns that always get
+the default, for source fields whose values cannot be trusted (e.g. fields
+that do not line up with their header).
+A family's optional "source_types" give spec types (e.g. "bool") to source
+columns, for signal_validator.py to check them.
+
+compile_mapping() resolves a family against a file's header once; then
+migrate_frame() converts a frame column by column with NumPy, and
+migrate_file() streams a CSV through it chunk by chunk, so memory depends
+on the chunk size, not the file size.
+
+Usage:
+    python schema_migration.py No_Action_100_v5.csv [...] [--output-dir DIR]
+"""
+
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_paths import CODE_DIR
+from instrumentation import run, stage
+from record_writer import open_csv, partial_path
+from signal_rules import OPERATORS, is_number, schema_family
+from signal_spec import canonical_header, load_signal_spec
+
+MAPPINGS_FILE = os.path.join(CODE_DIR, 'schema_mappings.json')
+DEFAULT_CHUNK_ROWS = 100000
+# Rounding applied to scaled values, so 1 - 0.96 is written as 0.04
+SCALE_DECIMALS = 10
+
+
+def load_mappings(path=MAPPINGS_FILE):
+    """Load a mappings file"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def default_value(column, config, signal_spec):
+    """Fill value for a canonical column no source column provides"""
+    defaults = config.get('defaults', {})
+    if column in defaults.get('columns', {}):
+        return defaults['columns'][column]
+    signal = signal_spec.get(column)
+    if signal is not None:
+        return defaults.get('types', {}).get(signal['type'])
+    return None
+
+
+def compile_mapping(config, family_name, columns, signal_spec=None):
+    """Plan for migrating files of one family with the given header
+
+    Returns {'family', 'header', 'steps': [(target, step)], 'dropped':
+    source columns not used, 'defaulted': targets filled with a default}.
+    """
+    signal_spec = signal_spec or load_signal_spec()
+    header = canonical_header()
+    present = {str(name).strip(): name for name in columns}
+    family = config['families'][family_name]
+    mapped = family['columns']
+    forced = set(family.get('defaulted', []))
+    unknown = [target for target in [*mapped, *forced] if target not in header]
+    if unknown:
+        raise ValueError(f"Family '{family_name}' maps columns that are not canonical: {', '.join(unknown)}")
+
+    steps = []
+    used = set()
+    defaulted = []
+    for target in header:
+        step = None if target in forced else mapped.get(target)
+        if isinstance(step, str):
+            step = {'from': step}
+        if step is None and target in present and target not in forced:
+            step = {'from': target}
+        if step is not None and 'from' in step:
+            sources = step['from'] if isinstance(step['from'], list) else [step['from']]
+            missing = [source for source in sources if source not in present]
+            if missing:
+                raise ValueError(f"{target}: source columns missing from the file: {', '.join(missing)}")
+            if 'test' in step and step['test'][0] not in OPERATORS:
+                raise ValueError(f"{target}: unknown operator {step['test'][0]!r}")
+            used.update(sources)
+            step = dict(step, sources=[present[source] for source in sources])
+        elif step is None:
+            step = {'value': default_value(target, config, signal_spec)}
+            defaulted.append(target)
+        steps.append((target, step))
+    return {
+        'family': family_name,
+        'header': header,
+        'steps': steps,
+        'dropped': [name for name in present if name not in used],
+        'defaulted': defaulted,
+    }
+
+
+def numeric(values):
+    """Column as float64, with text (e.g. a misaligned field) as NaN"""
+    if values.dtype.kind in 'biuf':
+        return values.to_numpy(dtype=np.float64)
+    return pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def apply_step(step, df):
+    """One canonical column of df, computed by a compiled step"""
+    if 'sources' not in step:
+        return np.full(len(df), step['value'] if step['value'] is not None else np.nan)
+    values = df[step['sources'][0]]
+    for source in step['sources'][1:]:
+        values = values.fillna(df[source])
+    if 'scale' in step:
+        scale, offset = step['scale']
+        return np.round(numeric(values) * scale + offset, SCALE_DECIMALS)
+    if 'test' in step:
+        op, value = step['test']
+        compare = numeric(values) if is_number(value) else values.to_numpy()
+        return np.where(OPERATORS[op](compare, value), step['then'], step['else'])
+    return values.to_numpy()
+
+
+def migrate_frame(plan, df):
+    """Canonical frame for a source frame of the plan's family"""
+    with stage('migrate', rows=len(df)):
+        columns = {target: apply_step(step, df) for target, step in plan['steps']}
+        return pd.DataFrame(columns, index=pd.RangeIndex(len(df)))
+
+
+def csv_fields(values):
+    """Column rendered as CSV fields through a table of its distinct values (missing as empty)"""
+    codes, distinct = pd.factorize(values)
+    # Code -1 (missing) picks the trailing empty field
+    table = np.array([str(value) for value in distinct.tolist()] + [''], dtype=object)
+    return table[codes]
+
+
+def frame_to_canonical(df, config, signal_spec=None):
+    """df in the canonical schema: migrated if a mapping family matches, else unchanged
+
+    A migrated frame names its source family in attrs['migrated_from'] and
+    the columns filled with defaults in attrs['defaulted'].
+    """
+    family = schema_family(config, df.columns)
+    if family is None:
+        return df
+    plan = compile_mapping(config, family, df.columns, signal_spec)
+    migrated = migrate_frame(plan, df)
+    migrated.attrs = {**df.attrs, 'migrated_from': family, 'defaulted': plan['defaulted']}
+    return migrated
+
+
+def measured_columns(df):
+    """Columns of a frame_to_canonical() frame that hold source values, not defaults"""
+    defaulted = set(df.attrs.get('defaulted', []))
+    return [column for column in df.columns if column not in defaulted]
+
+
+def blank_defaulted(df, plan):
+    """df with the columns a migration plan filled with defaults set to missing
+
+    A default stands in for a signal the legacy export lacks; tools that read
+    values as evidence or training data should not take it as measured.
+    """
+    if plan is None or not plan['defaulted']:
+        return df
+    return df.assign(**{column: np.nan for column in plan['defaulted']})
+
+
+def migrate_file(path, output, config, chunk_rows=DEFAULT_CHUNK_ROWS, signal_spec=None):
+    """Stream a source CSV into a canonical CSV; returns (plan, rows written)"""
+    columns = pd.read_csv(path, nrows=0).columns
+    family = schema_family(config, columns)
+    if family is None:
+        if [str(name).strip() for name in columns] == canonical_header():
+            raise ValueError(f"{path}: already in the canonical schema")
+        raise ValueError(f"{path}: no mapping family matches its columns")
+    plan = compile_mapping(config, family, columns, signal_spec)
+
+    rows = 0
+    partial = partial_path(output)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    try:
+        with open_csv(partial) as f:
+            writer = csv.writer(f)
+            writer.writerow(plan['header'])
+            # Only empty fields are missing, so text such as 'NULL' or 'None' is written back unchanged
+            for chunk in pd.read_csv(path, chunksize=chunk_rows, keep_default_na=False, na_values=['']):
+                migrated = migrate_frame(plan, chunk)
+                with stage('write', rows=len(chunk)):
+                    writer.writerows(zip(*(csv_fields(values) for _, values in migrated.items())))
+                rows += len(chunk)
+        os.replace(partial, output)
+    finally:
+        # A failed migration leaves no half-written output behind
+        if os.path.exists(partial):
+            os.remove(partial)
+    return plan, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate legacy schema CSVs to the canonical schema')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--mappings', default=MAPPINGS_FILE)
+    parser.add_argument('--output-dir', default=None, help='Where to write <name>_canonical.csv (default: next to input)')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    config = load_mappings(args.mappings)
+    for path in args.files:
+        directory = args.output_dir or os.path.dirname(os.path.abspath(path))
+        name = os.path.splitext(os.path.basename(path))[0]
+        output = os.path.join(directory, f"{name}_canonical.csv")
+        try:
+            plan, rows = migrate_file(path, output, config, args.chunk_rows)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            continue
+        print(f"{os.path.basename(path)} ({plan['family']}): {rows} records -> {output}")
+        print(f"  {len(plan['header']) - len(plan['defaulted'])} columns mapped, "
+              f"{len(plan['defaulted'])} filled with defaults, {len(plan['dropped'])} source columns dropped")
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,195 @@
+"""
+Declarative signal checks compiled into one vectorized evaluation.
+
+A rules file (see no_action_rules.json) lists, per schema family, checks of
+the form
+
+    {"column": c, "test": [op, value], "message": "..."}
+    {"columns": [c1, c2, ...], "test": [op, value], "message": "..."}
+    {"any": [{"column": c1, "test": [...]}, ...], "message": "..."}
+
+where op is one of > >= < <= == != and a value of "$name" refers to an entry
+of "params", so thresholds can be changed without touching the rules. A
+"columns" rule expands to one check per column; an "any" rule flags a row if
+any of its tests does and also counts each test separately ({counts[i]} in
+its message). Rules whose columns are missing from a file are skipped.
+
+compile_rules() turns the rules for one file's columns into a plan in which
+every distinct (column, op, value) test appears once. evaluate() then reads
+each column once, evaluates all of its tests into a boolean test matrix, and
+derives every rule's violation count (and, if asked, a packed per-row
+violation bitmap) from that matrix.
+"""
+
+import json
+import operator
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_paths import CODE_DIR
+from instrumentation import stage
+
+RULES_FILE = os.path.join(CODE_DIR, 'no_action_rules.json')
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+
+def load_rules(path=RULES_FILE):
+    """Load a rules file"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def schema_family(config, columns):
+    """Name of the first family whose required columns are all present, or None"""
+    columns = set(columns)
+    for name, family in config['families'].items():
+        if all(column in columns for column in family['requires']):
+            return name
+    return None
+
+
+def parse_overrides(assignments, params):
+    """NAME=VALUE threshold overrides (e.g. from --set) for names in params"""
+    overrides = {}
+    for assignment in assignments:
+        name, sep, value = assignment.partition('=')
+        name = name.strip()
+        if not sep:
+            raise ValueError(f"Expected NAME=VALUE, got {assignment!r}")
+        if name not in params:
+            raise ValueError(f"Unknown threshold {name!r}; known: {', '.join(params)}")
+        overrides[name] = float(value)
+    return overrides
+
+
+def resolve_value(value, params):
+    """A test value, with "$name" looked up in params"""
+    if isinstance(value, str) and value.startswith('$'):
+        if value[1:] not in params:
+            raise ValueError(f"Unknown rule parameter {value!r}")
+        return params[value[1:]]
+    return value
+
+
+def expand_rules(family):
+    """Normalize a family's rules to {'message', 'tests': [(column, op, value)], 'any', 'source': config entry}"""
+    rules = []
+    for rule in family['rules']:
+        if 'any' in rule:
+            tests = [(part['column'], *part['test']) for part in rule['any']]
+            rules.append({'message': rule['message'], 'tests': tests, 'any': True, 'source': rule})
+            continue
+        columns = rule['columns'] if 'columns' in rule else [rule['column']]
+        for column in columns:
+            rules.append({'message': rule['message'], 'tests': [(column, *rule['test'])], 'any': False,
+                          'source': rule})
+    return rules
+
+
+def compile_rules(config, family_name, columns, overrides=None):
+    """Plan for evaluating a family's rules against a file with the given columns"""
+    params = dict(config.get('params', {}))
+    params.update(overrides or {})
+    columns = set(columns)
+    tests = {}
+    rules = []
+    for rule in expand_rules(config['families'][family_name]):
+        resolved = []
+        for column, op, value in rule['tests']:
+            if op not in OPERATORS:
+                raise ValueError(f"Unknown operator {op!r} in rule for {column}")
+            resolved.append((column, op, resolve_value(value, params)))
+        if not all(column in columns for column, _, _ in resolved):
+            continue
+        # Identical tests shared by several rules are evaluated once
+        indices = [tests.setdefault(test, len(tests)) for test in resolved]
+        rules.append({'name': ' or '.join(f"{column} {op} {value}" for column, op, value in resolved),
+                      'message': rule['message'], 'tests': indices, 'any': rule['any'],
+                      'column': resolved[0][0], 'value': resolved[0][2], 'source': rule['source']})
+
+    by_column = {}
+    for (column, op, value), index in tests.items():
+        by_column.setdefault(column, []).append((index, OPERATORS[op], value))
+    return {'family': family_name, 'n_tests': len(tests), 'by_column': by_column, 'rules': rules}
+
+
+def is_number(value):
+    """True for int/float test values (not bools or strings)"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def evaluate(plan, df, bitmaps=False):
+    """Violation count of every rule in one pass over the columns
+
+    Returns {'counts': [per rule], 'test_counts': [per rule, per test],
+    'rows_with_issues': rows violating any rule, 'bitmaps': packed
+    (rows x ceil(rules / 8)) uint8 array, bit i of a row set when it violates
+    rule i (little-endian bit order), or None}.
+    """
+    with stage('rule-evaluate', rows=len(df)):
+        return evaluate_columns(plan, df, bitmaps)
+
+
+def evaluate_columns(plan, df, bitmaps=False):
+    """evaluate() without instrumentation"""
+    hits = np.zeros((len(df), plan['n_tests']), dtype=bool)
+    for column, tests in plan['by_column'].items():
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Equality tests on a categorical compare its small integer codes, not strings
+            codes = series.cat.codes.to_numpy()
+            categories = list(series.cat.categories)
+            for index, compare, value in tests:
+                if compare in (operator.eq, operator.ne):
+                    code = categories.index(value) if value in categories else -2
+                    hits[:, index] = compare(codes, code)
+                else:
+                    hits[:, index] = compare(series.to_numpy(dtype=object), value)
+            continue
+        values = series.to_numpy()
+        numeric = None
+        for index, compare, value in tests:
+            if is_number(value) and values.dtype.kind not in 'biuf':
+                # Text in a numeric check (e.g. a misaligned row) counts as missing, not as an error
+                if numeric is None:
+                    numeric = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                hits[:, index] = compare(numeric, value)
+            else:
+                hits[:, index] = compare(values, value)
+
+    test_counts = hits.sum(axis=0)
+    violations = np.zeros((len(df), len(plan['rules'])), dtype=bool)
+    for position, rule in enumerate(plan['rules']):
+        violations[:, position] = hits[:, rule['tests']].any(axis=1)
+    return {
+        'counts': violations.sum(axis=0).tolist(),
+        'test_counts': [test_counts[rule['tests']].tolist() for rule in plan['rules']],
+        'rows_with_issues': int(violations.any(axis=1).sum()),
+        'bitmaps': np.packbits(violations, axis=1, bitorder='little') if bitmaps else None,
+    }
+
+
+def rule_violations(bitmaps, rule_index):
+    """Row positions violating one rule, from evaluate()'s packed bitmaps"""
+    byte, bit = divmod(rule_index, 8)
+    return np.flatnonzero((bitmaps[:, byte] >> bit) & 1)
+
+
+def issue_messages(plan, result):
+    """Human-readable message for every rule with at least one violation"""
+    issues = []
+    for rule, count, counts in zip(plan['rules'], result['counts'], result['test_counts']):
+        if count > 0:
+            issues.append(rule['message'].format(column=rule['column'], value=rule['value'],
+                                                 count=count, counts=counts))
+    return issues
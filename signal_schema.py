@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Exact column dtypes for dataset frames, derived from the signal spec.
+
+pandas infers int64 for the 0/1 flags, float64 for scores and Python strings
+for enums such as spf_result. signal_dtypes() maps every spec signal to the
+dtype its type calls for instead:
+
+    bool         uint8 (0/1)
+    verdict      uint8 (1 = yes, 2 = no)
+    int          int32
+    float        float32
+    categorical  Categorical with the spec's values as fixed categories
+                 (categories taken from the data for open vocabularies)
+
+and the classification label to a Categorical of the four classes.
+
+apply_signal_dtypes() converts a parsed frame and checks every value on the
+way: a flag that is not 0/1, an enum value the spec does not list, text in a
+numeric column or a missing value in a flag is a malformed value. With
+strict=True they raise ValueError; otherwise the column keeps its parsed
+dtype and the problem is recorded in df.attrs['dtype_errors'].
+
+Usage:
+    python signal_schema.py [files...]   # check files and show memory saved
+"""
+
+import argparse
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from data_paths import DATA_DIR, dataset_files
+from dataset_cache import load_dataset
+from instrumentation import run
+from signal_spec import CLASSES, LABEL_COLUMN, load_signal_spec
+
+NUMPY_DTYPES = {
+    'bool': np.uint8,
+    'verdict': np.uint8,
+    'int': np.int32,
+    'float': np.float32,
+}
+BOOL_VALUES = [0, 1]
+# 'Spam Mail' in base_documeant.txt is the class 'Spam'
+CLASS_SUFFIX = re.compile(r'\s+mail$')
+# Invalid values quoted per column in an error message
+VALUES_SHOWN = 5
+VALUE_WIDTH = 40
+
+
+def signal_dtypes(signal_spec=None):
+    """Column name -> numpy dtype or CategoricalDtype for every spec signal and the label"""
+    signal_spec = signal_spec or load_signal_spec()
+    dtypes = {}
+    for column, signal in signal_spec.items():
+        if signal['type'] in NUMPY_DTYPES:
+            dtypes[column] = np.dtype(NUMPY_DTYPES[signal['type']])
+        else:
+            # Categories of an open vocabulary (values None) come from the data
+            dtypes[column] = pd.CategoricalDtype(signal['values'])
+    dtypes[LABEL_COLUMN] = pd.CategoricalDtype(CLASSES)
+    return dtypes
+
+
+def class_codes(labels):
+    """Index into CLASSES of each label, -1 where it is not a class
+
+    Labels match ignoring case, surrounding spaces, underscores and a
+    trailing ' Mail' (the class names of base_documeant.txt).
+    """
+    codes, distinct = pd.factorize(pd.Series(labels, dtype=object))
+    positions = {name.lower(): index for index, name in enumerate(CLASSES)}
+    lookup = [positions.get(CLASS_SUFFIX.sub('', str(label).replace('_', ' ').strip().lower()), -1)
+              for label in distinct]
+    return np.array(lookup + [-1], dtype=np.int8)[codes]
+
+
+def allowed_values(column, signal_spec):
+    """Integer values a uint8 column may hold, or None for any"""
+    signal = signal_spec.get(column)
+    if signal is None or signal['type'] not in ('bool', 'verdict'):
+        return None
+    return BOOL_VALUES if signal['type'] == 'bool' else signal['values']
+
+
+def shorten(text):
+    """Text cut to VALUE_WIDTH characters (e.g. a row folded into one field)"""
+    return text if len(text) <= VALUE_WIDTH else text[:VALUE_WIDTH - 3] + '...'
+
+
+def describe_invalid(values):
+    """Short listing of the distinct invalid values in a column"""
+    distinct = pd.unique(values)
+    shown = ', '.join(shorten(repr(value)) for value in distinct[:VALUES_SHOWN])
+    more = f" (+{len(distinct) - VALUES_SHOWN} more)" if len(distinct) > VALUES_SHOWN else ""
+    return f"{len(values)} rows with {shown}{more}"
+
+
+def convert_column(values, dtype, allowed=None):
+    """(converted values, None) or (None, problem) for one column"""
+    if isinstance(dtype, pd.CategoricalDtype):
+        # One hashing pass; only the few distinct values are checked against the categories
+        codes, distinct = pd.factorize(values)
+        if dtype.categories is None:
+            return pd.Categorical.from_codes(codes, categories=distinct), None
+        lookup = dtype.categories.get_indexer(distinct)
+        if (lookup == -1).any():
+            invalid = np.isin(codes, np.flatnonzero(lookup == -1))
+            return None, f"not in {list(dtype.categories)}: {describe_invalid(values[invalid])}"
+        return pd.Categorical.from_codes(np.append(lookup, -1)[codes], dtype=dtype), None
+
+    if values.dtype.kind not in 'biuf':
+        numeric = pd.to_numeric(values, errors='coerce')
+        text = numeric.isna() & values.notna()
+        if text.any():
+            return None, f"not numeric: {describe_invalid(values[text])}"
+        values = numeric
+    if dtype.kind == 'f':
+        return values.to_numpy(dtype=dtype), None
+    if values.isna().any():
+        return None, f"{int(values.isna().sum())} missing values"
+    numbers = values.to_numpy()
+    if allowed is not None:
+        invalid = ~np.isin(numbers, allowed)
+        if invalid.any():
+            return None, f"not in {allowed}: {describe_invalid(values[invalid])}"
+    else:
+        limits = np.iinfo(dtype)
+        invalid = (numbers != np.round(numbers)) | (numbers < limits.min) | (numbers > limits.max)
+        if invalid.any():
+            return None, f"not a {dtype.name} integer: {describe_invalid(values[invalid])}"
+    return numbers.astype(dtype), None
+
+
+def apply_signal_dtypes(df, strict=False, signal_spec=None):
+    """Frame with spec dtypes on every spec column (matched with surrounding spaces stripped)
+
+    Columns that are not in the spec (e.g. the v5-v9 schema) keep their
+    parsed dtype. Malformed values raise ValueError with strict=True and are
+    otherwise listed in df.attrs['dtype_errors'] as {column: problem}.
+    """
+    signal_spec = signal_spec or load_signal_spec()
+    dtypes = signal_dtypes(signal_spec)
+    converted = {}
+    errors = {}
+    for name, values in df.items():
+        column = str(name).strip()
+        if column not in dtypes:
+            continue
+        typed, problem = convert_column(values, dtypes[column], allowed_values(column, signal_spec))
+        if problem is None:
+            converted[name] = typed
+        else:
+            errors[column] = problem
+    if strict and errors:
+        raise ValueError("Malformed values:\n" + '\n'.join(f"  - {column}: {problem}"
+                                                            for column, problem in errors.items()))
+    typed = df.assign(**converted) if converted else df.copy()
+    typed.attrs = {**df.attrs, 'dtype_errors': errors}
+    return typed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check dataset CSVs against the spec dtypes')
+    parser.add_argument('files', nargs='*', help='CSV files (default: every dataset CSV in --data-dir)')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    args = parser.parse_args()
+
+    before_total = after_total = 0
+    for path in args.files or dataset_files(args.data_dir):
+        df = load_dataset(path)
+        typed = apply_signal_dtypes(df)
+        before = int(df.memory_usage(index=False, deep=True).sum())
+        after = int(typed.memory_usage(index=False, deep=True).sum())
+        before_total += before
+        after_total += after
+        print(f"{os.path.basename(path)}: {len(df)} records, {before / 1024:.0f} KiB -> {after / 1024:.0f} KiB")
+        for column, problem in typed.attrs['dtype_errors'].items():
+            print(f"  - {column}: {problem}")
+    if before_total:
+        print(f"\nTotal: {before_total / 1024:.0f} KiB -> {after_total / 1024:.0f} KiB "
+              f"({before_total / max(after_total, 1):.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,105 @@
+"""
+Reader for Detection_Signals_Essentials_1.0.csv, the signal specification.
+
+The spec lists the 68 detection signals in the same order as the canonical
+dataset header; the dataset adds a trailing 'classification' label column.
+"""
+
+import csv
+import functools
+import os
+import re
+
+from data_paths import CODE_DIR, SPEC_FILE_NAME
+
+SPEC_FILE = os.path.join(CODE_DIR, SPEC_FILE_NAME)
+
+LABEL_COLUMN = 'classification'
+# The four categories from base_documeant.txt
+CLASSES = ['No Action', 'Spam', 'Malicious', 'Warning']
+
+# Numbered enum entries look like '1.pass', '3. none' or '6:"document_download"'
+ENUM_ENTRY = re.compile(r'^\s*\d+\s*[.:]\s*"?([A-Za-z_][A-Za-z0-9_]*)"?')
+# 1 named as one end of a score's scale: '1(Good Reputation)', '1.0(matched)', '1- worst severity', '1-max'
+UNIT_SCALE_END = re.compile(r'(?<![\w.])1(?:\.0)?\s*[(-]')
+
+
+def signal_column_name(signal_name):
+    """Dataset column name for a spec signal name"""
+    return signal_name.strip().replace(' ', '_')
+
+
+def listed_values(explanation):
+    """Values of a bracketed listing such as '[TLS 1.3, SSL 3.0(outdated)]', notes dropped"""
+    listing = explanation.strip()[1:explanation.index(']')]
+    return [re.sub(r'\(.*?\)', '', value).strip() for value in listing.split(',')]
+
+
+def parse_signal_type(type_name, explanation):
+    """Normalized type and allowed values (None = open vocabulary)"""
+    type_name = type_name.strip().lower()
+    if type_name.startswith('verdict'):
+        # 'Analysis of the qrcode if present': 1 - Yes; 2 - No
+        return 'verdict', [1, 2]
+    if type_name in ('bool', 'int', 'float'):
+        return type_name, None
+    if explanation.strip().startswith('['):
+        values = listed_values(explanation)
+        if type_name == 'categorical' and explanation.rstrip().endswith('NULL'):
+            # Free-form list such as process names, or NULL
+            return 'categorical', None
+        return 'categorical', values
+    values = []
+    for line in explanation.splitlines():
+        match = ENUM_ENTRY.match(line)
+        if match:
+            values.append(match.group(1))
+    return 'categorical', values or None
+
+
+def parse_signal_range(type_name, explanation):
+    """[low, high] for a numeric signal (high None = unbounded), None for other types
+
+    Scores whose explanation names 1 as an end of the scale lie in [0, 1];
+    counts, times and other measures (entropy, risk categories) only >= 0.
+    """
+    type_name = type_name.strip().lower()
+    if type_name == 'float':
+        return [0.0, 1.0] if UNIT_SCALE_END.search(explanation) else [0.0, None]
+    if type_name == 'int':
+        return [0, None]
+    return None
+
+
+def signal_vocabulary(signal):
+    """Fixed values of a categorical signal
+
+    Its spec values, or for an open vocabulary ('[winword.exe, cmd.exe]. OR
+    NULL') the examples listed and NULL.
+    """
+    if signal['values'] is not None:
+        return list(signal['values'])
+    explanation = signal['explanation']
+    values = listed_values(explanation) if explanation.startswith('[') else []
+    return values + ['NULL'] if explanation.endswith('NULL') else values
+
+
+@functools.lru_cache(maxsize=None)
+def load_signal_spec(path=SPEC_FILE):
+    """Map column name -> {'type', 'values', 'range', 'explanation'} in spec order"""
+    spec = {}
+    with open(path, newline='', encoding='mac_roman') as f:
+        for row in csv.DictReader(f):
+            signal_type, values = parse_signal_type(row['Type'], row['Type Explanation'])
+            spec[signal_column_name(row['Signal Name'])] = {
+                'type': signal_type,
+                'values': values,
+                'range': parse_signal_range(row['Type'], row['Type Explanation']),
+                'explanation': row['Type Explanation'].strip(),
+            }
+    return spec
+
+
+def canonical_header(path=SPEC_FILE):
+    """The 69-column dataset header: every spec signal plus the label"""
+    return list(load_signal_spec(path)) + [LABEL_COLUMN]
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Vectorized checks of dataset values against the signal spec.
+
+compile_checks() turns Detection_Signals_Essentials_1.0.csv into one check
+per column of a file's header:
+
+    bool            0 or 1
+    verdict         1 (yes) or 2 (no)
+    int             a whole number >= 0
+    float           a number in the spec's range: [0, 1] for scores whose
+                    explanation names 1 as an end of the scale, >= 0 for
+                    other measures (entropy, seconds, risk categories)
+    categorical     one of the spec's values (any text for open vocabularies)
+    classification  one of the four classes
+
+Legacy files are checked on the columns their schema_mappings.json family
+gives "source_types", e.g. the v5-v9 auth flags, which hold fractional SPF
+and 1/2/3 DMARC values instead of 0/1.
+
+Every check runs on whole columns: numbers are compared as NumPy arrays and
+text columns are factorized, so only their distinct values are looked up.
+Violations are counted per column and kind (missing, not_numeric,
+not_integer, out_of_range, not_allowed), and the first --samples offending
+rows of each are kept with their CSV line numbers.
+
+Files are read split by split as in streaming_stats.py, optionally in a
+process pool, and '-' reads CSV from stdin, so memory depends on --split-mb
+and not on the input size.
+
+Usage:
+    python signal_validator.py [files...] [--workers N] [--samples N] [--strict]
+    python batch_generator.py ... --output /dev/stdout | python signal_validator.py -
+"""
+
+import argparse
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_paths import DATA_DIR, dataset_files
+from instrumentation import run, stage
+from schema_migration import MAPPINGS_FILE, load_mappings
+from signal_rules import schema_family
+from signal_schema import BOOL_VALUES
+from signal_spec import CLASSES, LABEL_COLUMN, load_signal_spec, parse_signal_range, parse_signal_type
+from streaming_stats import DEFAULT_SPLIT_MB, LINE_END, file_splits, read_block, read_split
+
+VIOLATION_KINDS = ('missing', 'not_numeric', 'not_integer', 'out_of_range', 'not_allowed')
+DEFAULT_SAMPLES = 5
+# Keep 'NULL' and 'None' as text: both are values of spec enums (tls_version, unique_parent_process_names)
+READ_OPTIONS = {'keep_default_na': False, 'na_values': ['']}
+VALUE_WIDTH = 40
+COLUMNS_SHOWN = 8
+STDIN_NAME = '<stdin>'
+
+
+def spec_column(name):
+    """Spec column a header name refers to (surrounding spaces stripped, any case of the label)"""
+    key = str(name).strip()
+    return LABEL_COLUMN if key.lower() == LABEL_COLUMN else key
+
+
+def value_check(signal_type, values=None, value_range=None):
+    """Check for one column of a spec type"""
+    return {'type': signal_type, 'values': BOOL_VALUES if signal_type == 'bool' else values, 'range': value_range}
+
+
+def compile_checks(header, signal_spec=None, mappings=None):
+    """Checks for the columns of a header
+
+    Returns {'family', 'checks': {header name: {'type', 'values', 'range'}},
+    'dtypes': read_csv dtypes, 'missing_columns': spec columns not in the
+    header, 'unchecked_columns': header columns with no check}.
+    """
+    signal_spec = signal_spec or load_signal_spec()
+    types = {column: value_check(signal['type'], signal['values'], signal['range'])
+             for column, signal in signal_spec.items()}
+    types[LABEL_COLUMN] = value_check('categorical', CLASSES)
+    family = schema_family(mappings, header) if mappings else None
+    if family is not None:
+        for column, type_name in mappings['families'][family].get('source_types', {}).items():
+            types.setdefault(column, value_check(*parse_signal_type(type_name, ''), parse_signal_range(type_name, '')))
+    checks = {name: types[spec_column(name)] for name in header if spec_column(name) in types}
+    present = {spec_column(name) for name in header}
+    return {
+        'family': family,
+        'checks': checks,
+        # The parser builds enum columns as categoricals, so checking them needs no hashing pass
+        'dtypes': {name: 'category' for name, check in checks.items() if check['type'] == 'categorical'},
+        'missing_columns': [column for column in [*signal_spec, LABEL_COLUMN] if column not in present],
+        'unchecked_columns': [str(name) for name in header if name not in checks],
+    }
+
+
+def column_violations(values, check):
+    """{kind: boolean row mask} of the violations in one column"""
+    if check['type'] == 'categorical':
+        # Only the distinct values are checked
+        codes, distinct = pd.factorize(values)
+        masks = {'missing': codes == -1}
+        if check['values'] is not None:
+            invalid = np.flatnonzero(~pd.Index(distinct).astype(str).isin(check['values']))
+            masks['not_allowed'] = np.isin(codes, invalid)
+        return masks
+
+    if values.dtype.kind in 'biuf':
+        numbers = values.to_numpy(dtype=np.float64)
+        masks = {'missing': np.isnan(numbers)}
+    else:
+        numbers = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)
+        missing = values.isna().to_numpy()
+        masks = {'missing': missing, 'not_numeric': np.isnan(numbers) & ~missing}
+    present = ~np.isnan(numbers)
+    if check['values'] is not None:
+        masks['not_allowed'] = present & ~np.isin(numbers, check['values'])
+    elif check['range'] is not None:
+        low, high = check['range']
+        if check['type'] == 'int':
+            masks['not_integer'] = present & (numbers != np.floor(numbers))
+        out_of_range = numbers < low
+        if high is not None:
+            out_of_range |= numbers > high
+        masks['out_of_range'] = out_of_range
+    return masks
+
+
+def sample_value(value):
+    """Text shown for an offending value; numbers print alike whichever dtype their split was parsed as"""
+    try:
+        return f"{float(value):.10g}"
+    except (TypeError, ValueError):
+        return shorten(str(value))
+
+
+def shorten(text):
+    """Text cut to VALUE_WIDTH characters (e.g. a row folded into one field)"""
+    return text if len(text) <= VALUE_WIDTH else text[:VALUE_WIDTH - 3] + '...'
+
+
+def new_result(name, validator, path=None):
+    """Empty result for one input (violations keyed by every checked column, in header order)"""
+    return {'file': name, 'path': path, 'family': validator['family'],
+            'missing_columns': validator['missing_columns'], 'unchecked_columns': validator['unchecked_columns'],
+            'rows': 0, 'rows_with_violations': 0,
+            'malformed_rows': 0, 'malformed_samples': [],
+            'violations': {column: {} for column in validator['checks']},
+            'samples': {column: {} for column in validator['checks']}}
+
+
+def frame_violations(df, validator, samples=DEFAULT_SAMPLES, name=None, path=None):
+    """Violation counts and sample rows (frame positions) for a frame"""
+    result = new_result(name, validator, path)
+    result['rows'] = len(df)
+    flagged = np.zeros(len(df), dtype=bool)
+    folded = df.attrs.get('folded_rows', [])
+    if folded:
+        flagged[folded] = True
+        result['malformed_rows'] = len(folded)
+        result['malformed_samples'] = folded[:samples]
+    for column, check in validator['checks'].items():
+        for kind, mask in column_violations(df[column], check).items():
+            count = int(np.count_nonzero(mask))
+            if not count:
+                continue
+            flagged |= mask
+            rows = np.flatnonzero(mask)[:samples]
+            values = df[column].to_numpy()[rows]
+            result['violations'][column][kind] = count
+            result['samples'][column][kind] = [
+                [int(row), '' if kind == 'missing' else sample_value(value)] for row, value in zip(rows, values)]
+    result['rows_with_violations'] = int(np.count_nonzero(flagged))
+    return result
+
+
+def split_violations(task):
+    """Violations in one split or stdin block (runs in a worker process)"""
+    path, source, header, validator, samples = task
+    name = os.path.basename(path)
+    if isinstance(source, bytes):
+        df = read_block(source, header, dtype=validator['dtypes'], **READ_OPTIONS)
+    else:
+        df = read_split(*source, header, dtype=validator['dtypes'], **READ_OPTIONS)
+    if df is None:
+        return new_result(name, validator, path)
+    with stage('analyze', rows=len(df)):
+        return frame_violations(df, validator, samples, name, path)
+
+
+def result_merge(a, b, samples=DEFAULT_SAMPLES):
+    """Merge the results of two consecutive parts of one input (b's rows follow a's)"""
+    offset = a['rows']
+    violations = {column: dict(kinds) for column, kinds in a['violations'].items()}
+    found = {column: {kind: list(rows) for kind, rows in kinds.items()} for column, kinds in a['samples'].items()}
+    for column, kinds in b['violations'].items():
+        for kind, count in kinds.items():
+            violations[column][kind] = violations[column].get(kind, 0) + count
+            kept = found[column].setdefault(kind, [])
+            kept += [[row + offset, value] for row, value in b['samples'][column][kind][:samples - len(kept)]]
+    malformed = a['malformed_samples'] + [row + offset for row in b['malformed_samples']]
+    return dict(a, rows=a['rows'] + b['rows'],
+                rows_with_violations=a['rows_with_violations'] + b['rows_with_violations'],
+                malformed_rows=a['malformed_rows'] + b['malformed_rows'], malformed_samples=malformed[:samples],
+                violations=violations, samples=found)
+
+
+def stream_blocks(f, block_bytes):
+    """Blocks of whole lines read from a binary stream, about block_bytes each"""
+    rest = b''
+    while True:
+        data = f.read(block_bytes)
+        if not data:
+            break
+        data = rest + data
+        # Cutting between the CR and LF of a CRLF only adds a blank line, which the parser skips
+        cut = max(data.rfind(b'\n'), data.rfind(b'\r')) + 1
+        rest = data[cut:]
+        if cut:
+            yield data[:cut]
+    if rest.strip():
+        yield rest
+
+
+def input_tasks(path, split_bytes, samples, mappings):
+    """Tasks covering one input: byte ranges of a file, or blocks of stdin for '-'"""
+    if path == '-':
+        blocks = stream_blocks(sys.stdin.buffer, split_bytes)
+        first = next(blocks, b'')
+        # The header may end in a lone CR, like any other line
+        match = LINE_END.search(first)
+        header_end = match.end() if match else len(first)
+        header = list(pd.read_csv(io.BytesIO(first[:header_end]), nrows=0).columns)
+        validator = compile_checks(header, mappings=mappings)
+        return ((STDIN_NAME, block, header, validator, samples)
+                for block in itertools.chain([first[header_end:]], blocks))
+    header = list(pd.read_csv(path, nrows=0).columns)
+    validator = compile_checks(header, mappings=mappings)
+    return [(os.path.abspath(path), split, header, validator, samples)
+            for split in file_splits(path, split_bytes)]
+
+
+def validate_inputs(paths, split_bytes, samples=DEFAULT_SAMPLES, mappings=None, workers=1):
+    """Per-input merged results for paths ('-' = stdin), computed split by split"""
+    # Results are keyed by absolute path, so a file named twice is checked once
+    paths = list(dict.fromkeys(path if path == '-' else os.path.abspath(path) for path in paths))
+    tasks = itertools.chain.from_iterable(input_tasks(path, split_bytes, samples, mappings) for path in paths)
+    # A pool would read all of stdin ahead of the workers
+    if workers > 1 and '-' not in paths:
+        with multiprocessing.Pool(workers) as pool:
+            return merge_by_input(pool.imap(split_violations, tasks), samples)
+    return merge_by_input(map(split_violations, tasks), samples)
+
+
+def merge_by_input(results, samples):
+    """Fold a stream of split results into one result per input path, in order"""
+    merged = {}
+    for result in results:
+        path = result['path']
+        merged[path] = result_merge(merged[path], result, samples) if path in merged else result
+    return merged
+
+
+def listed(names):
+    """Short listing of column names"""
+    more = f" (+{len(names) - COLUMNS_SHOWN} more)" if len(names) > COLUMNS_SHOWN else ''
+    return ', '.join(names[:COLUMNS_SHOWN]) + more
+
+
+def print_result(result):
+    """Violation summary of one input, with sample lines"""
+    print(f"\n=== {result['path']}: {result['rows']} records, {result['rows_with_violations']} with violations ===")
+    if result['family']:
+        print(f"  Legacy schema family '{result['family']}'")
+    if result['missing_columns']:
+        print(f"  Spec columns missing ({len(result['missing_columns'])}): {listed(result['missing_columns'])}")
+    if result['unchecked_columns']:
+        print(f"  Columns not checked ({len(result['unchecked_columns'])}): {listed(result['unchecked_columns'])}")
+    if result['malformed_rows']:
+        lines = ', '.join(str(row + 2) for row in result['malformed_samples'])
+        print(f"  Malformed rows (extra fields): {result['malformed_rows']} (lines {lines})")
+    for column, kinds in result['violations'].items():
+        for kind in [kind for kind in VIOLATION_KINDS if kind in kinds]:
+            shown = ', '.join(f"line {row + 2}: {value!r}" for row, value in result['samples'][column][kind])
+            print(f"  - {column}: {kinds[kind]} {kind.replace('_', ' ')} ({shown})")
+    if not any(result['violations'].values()) and not result['malformed_rows']:
+        print("  No violations")
+
+
+def report_entry(result):
+    """JSON form of a result: columns with violations only, sample rows as CSV line numbers"""
+    violations = {column: {kind: kinds[kind] for kind in VIOLATION_KINDS if kind in kinds}
+                  for column, kinds in result['violations'].items() if kinds}
+    samples = {column: {kind: [{'line': row + 2, 'value': value} for row, value in result['samples'][column][kind]]
+                        for kind in kinds}
+               for column, kinds in violations.items()}
+    return dict(result, malformed_samples=[row + 2 for row in result['malformed_samples']],
+                violations=violations, samples=samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help="CSV files, '-' for stdin (default: every dataset CSV in --data-dir)")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--split-mb', type=float, default=DEFAULT_SPLIT_MB, help='Bytes of CSV parsed at a time')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes (files only)')
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES, help='Offending rows kept per column and kind')
+    parser.add_argument('--mappings', default=MAPPINGS_FILE,
+                        help="Mappings file with legacy source_types ('' to check spec columns only)")
+    parser.add_argument('--output', default=None, help='Write the results as JSON')
+    parser.add_argument('--strict', action='store_true', help='Exit with status 1 if any value is invalid')
+    args = parser.parse_args()
+
+    paths = args.files or dataset_files(args.data_dir)
+    mappings = load_mappings(args.mappings) if args.mappings else None
+    started = time.perf_counter()
+    results = validate_inputs(paths, max(1, int(args.split_mb * 1024 * 1024)), args.samples, mappings,
+                              args.workers)
+    elapsed = time.perf_counter() - started
+
+    with stage('report'):
+        for result in results.values():
+            print_result(result)
+    rows = sum(result['rows'] for result in results.values())
+    invalid = sum(result['rows_with_violations'] for result in results.values())
+    print(f"\nChecked {rows} records in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} records/s); "
+          f"{invalid} with violations")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({path: report_entry(result) for path, result in results.items()}, f, indent=2)
+        print(f"Report written to {args.output}")
+    if args.strict and invalid:
+        parser.exit(1, f"{invalid} records with invalid values\n")
+
+
+if __name__ == "__main__":
+    run(main)
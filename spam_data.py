@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Single command-line entry point for the dataset scripts.
+
+    python spam_data.py [--data-root DIR] <command> [arguments...]
+
+Each command runs one script's main() with the remaining arguments, so
+`spam_data.py merge --help` lists merge_corpus.py's options. The command
+table is static and a script is imported only when its command runs: --help
+and the light commands (files, signals) never load NumPy or pandas.
+
+--data-root (or SPAM_DATA_ROOT) points every command at a directory of
+dataset CSVs other than the code directory (see data_paths.py).
+"""
+
+import argparse
+import importlib
+import os
+import sys
+
+# command -> (script module, help); the module is imported only when its command runs
+COMMANDS = {
+    'generate': ('batch_generator', 'generate records from a class profile'),
+    'analyze': ('analyze_no_action_signals', 'check No Action files against the signal rules'),
+    'analyze-details': ('detailed_analysis', 'border case report for the No_Action_100 files'),
+    'corpus': ('corpus_analysis', 'corpus-wide duplicate, schema and rule report'),
+    'dedup': ('check_duplicates', 'duplicate rows within and across files'),
+    'dedup-index': ('dedup_index', 'persistent duplicate index'),
+    'near-dups': ('near_duplicates', 'clusters of near-duplicate rows'),
+    'merge': ('merge_corpus', 'merge CSVs into one deduplicated file'),
+    'migrate': ('schema_migration', 'migrate legacy schema CSVs to the canonical schema'),
+    'profile': ('distribution_profiler', 'per-class value distributions'),
+    'features': ('feature_matrix', 'numeric design matrix with sparse one-hot enums'),
+    'stats': ('streaming_stats', 'chunked per-column statistics'),
+    'store': ('matrix_store', 'export or inspect the memory-mapped training matrix store'),
+    'schema': ('signal_schema', 'check CSVs against the spec dtypes'),
+    'validate': ('signal_validator', 'check values against the signal spec'),
+    'score': ('reference_scorer', 'rule-based reference class of every row, with disagreements'),
+    'cache': ('dataset_cache', 'warm, prune or clear the parsed CSV cache'),
+    'benchmark': ('benchmark', 'throughput benchmark'),
+    'spam-records': ('generate_spam_records', 'append 250 spam records to spam_new_250.csv'),
+    'spam-250-v2': ('generate_spam_250_v2', 'write spam_new_250_v2.csv'),
+    'spam-250-v3': ('generate_spam_250_v3', 'write spam_new_250_v3.csv'),
+    'no-action-50': ('generate_no_action_50', 'write no_action_50.csv'),
+}
+
+
+def list_files():
+    """Print every dataset CSV in the data root with its size"""
+    data_paths = importlib.import_module('data_paths')
+    paths = data_paths.dataset_files()
+    for path in paths:
+        print(f"{os.path.getsize(path) / (1024 * 1024):9.2f} MB  {os.path.basename(path)}")
+    print(f"{len(paths)} dataset files in {data_paths.DATA_DIR}")
+
+
+def list_signals():
+    """Print every spec signal with its type and allowed values"""
+    spec = importlib.import_module('signal_spec').load_signal_spec()
+    for name, signal in spec.items():
+        values = ', '.join(str(value) for value in signal['values']) if signal['values'] else '-'
+        print(f"{name:45} {signal['type']:12} {values}")
+    print(f"{len(spec)} signals")
+
+
+# Commands implemented here, on the standard library only: command -> (function, help)
+LIGHT_COMMANDS = {
+    'files': (list_files, 'list the dataset CSVs in the data root'),
+    'signals': (list_signals, 'list the spec signals with their types and values'),
+}
+
+
+def command_help():
+    """The command listing shown by --help"""
+    width = max(len(name) for name in [*COMMANDS, *LIGHT_COMMANDS])
+    lines = ['commands:']
+    lines += [f"  {name:{width}}  {text}" for name, (_, text) in [*COMMANDS.items(), *LIGHT_COMMANDS.items()]]
+    lines.append("\nRun '%(prog)s <command> --help' for a command's options.")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dataset generation, analysis and maintenance tools',
+                                     epilog=command_help(), formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-root', help='Directory holding the dataset CSVs (default: $SPAM_DATA_ROOT, '
+                                            'else the code directory)')
+    parser.add_argument('command', choices=[*COMMANDS, *LIGHT_COMMANDS], metavar='command',
+                        help='one of the commands below')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help="the command's own arguments")
+    args = parser.parse_args()
+
+    if args.data_root:
+        # Set before any script module is imported (they read it at import time);
+        # worker processes inherit it
+        os.environ['SPAM_DATA_ROOT'] = os.path.abspath(args.data_root)
+    if args.command in LIGHT_COMMANDS:
+        if args.arguments:
+            parser.error(f"{args.command} takes no arguments")
+        return LIGHT_COMMANDS[args.command][0]()
+    # The script parses the remaining arguments itself, under a prog name of '<prog> <command>'
+    sys.argv = [f"{parser.prog} {args.command}", *args.arguments]
+    main_function = importlib.import_module(COMMANDS[args.command][0]).main
+    return importlib.import_module('instrumentation').run(main_function)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+Mergeable column statistics for dataset files larger than memory.
+
+A file is cut into byte ranges ("splits") at line boundaries, and each split
+is parsed on its own, so memory depends on --split-mb, not the file size,
+and splits can run in a process pool. Every split reduces to accumulators
+that merge in any order:
+
+- per column: rows, missing values, and counts of non-numeric values
+- numeric values: count, sum, min, max, mean and variance (merged with
+  Chan et al.'s pairwise update, so no second pass is needed)
+- a KLL quantile sketch per numeric column: levels of sorted samples where
+  an item at level h stands for 2**h values, compacted lazily (only once
+  the whole sketch is over capacity), so it holds about 3k values
+  (k = --sketch-k) whatever the row count. Measured on 100k-3M rows, a
+  quantile is within 1.5/k of the true rank when the values are added
+  split by split, and within about 2/k after merging up to a thousand split
+  sketches (k = 200: 0.75% and 1%).
+- rule violation counts for the file's schema family (signal_rules.py)
+
+Results of splits, files and separate runs (via the saved JSON state)
+combine into the same counts, sums and extremes as one pass over all rows.
+Results are kept per file path, so same-named files in different
+directories stay apart. Fields with quoted line breaks would be split
+wrongly; the dataset CSVs have none.
+
+Usage:
+    python streaming_stats.py big_export.csv [more.csv ...] [--by-class] [--workers N]
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_paths import DATA_DIR, dataset_files
+from instrumentation import run, stage
+from row_fingerprint import read_folding
+from signal_rules import RULES_FILE, compile_rules, evaluate, load_rules, schema_family
+from signal_spec import LABEL_COLUMN
+
+DEFAULT_SPLIT_MB = 64
+DEFAULT_SKETCH_K = 200
+# Line ends pandas accepts (No_Action-v1.csv mixes lone CRs with LFs)
+LINE_END = re.compile(rb'\r\n|\r|\n')
+SCAN_BYTES = 64 * 1024
+# Capacity ratio between a KLL level and the one above it
+SKETCH_DECAY = 2 / 3
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+# Distinct text values counted per column before the counts are dropped (e.g. IDs)
+MAX_TEXT_VALUES = 10000
+TEXT_VALUES_SHOWN = 5
+
+
+def new_sketch(k=DEFAULT_SKETCH_K):
+    """Empty KLL quantile sketch"""
+    return {'k': k, 'n': 0, 'levels': [], 'parity': []}
+
+
+def level_capacity(sketch, level):
+    """Items a level may hold before it is compacted"""
+    depth = len(sketch['levels']) - 1 - level
+    return max(2, int(sketch['k'] * SKETCH_DECAY ** depth))
+
+
+def compact(sketch, level):
+    """Sort a level and promote every other item (alternating which half) to the next level"""
+    items = np.sort(sketch['levels'][level])
+    # An odd item out stays behind, so the weight of the sketch is preserved
+    keep = items[len(items) - len(items) % 2:]
+    items = items[:len(items) - len(items) % 2]
+    promoted = items[sketch['parity'][level]::2]
+    sketch['parity'][level] ^= 1
+    sketch['levels'][level] = keep
+    if level + 1 == len(sketch['levels']):
+        sketch['levels'].append(np.empty(0))
+        sketch['parity'].append(0)
+    sketch['levels'][level + 1] = np.concatenate([sketch['levels'][level + 1], promoted])
+
+
+def compress(sketch):
+    """Compact the lowest level at capacity until the sketch fits its total capacity"""
+    while True:
+        capacities = [level_capacity(sketch, level) for level in range(len(sketch['levels']))]
+        if sum(len(items) for items in sketch['levels']) <= sum(capacities):
+            return sketch
+        compact(sketch, next(level for level, items in enumerate(sketch['levels'])
+                             if len(items) >= capacities[level]))
+
+
+def sketch_add(sketch, values):
+    """Add a batch of (non-missing) values"""
+    if not len(values):
+        return sketch
+    if not sketch['levels']:
+        sketch['levels'].append(np.empty(0))
+        sketch['parity'].append(0)
+    sketch['levels'][0] = np.concatenate([sketch['levels'][0], np.asarray(values, dtype=np.float64)])
+    sketch['n'] += len(values)
+    return compress(sketch)
+
+
+def sketch_merge(a, b):
+    """Sketch of the union of two sketches' inputs"""
+    if a['k'] != b['k']:
+        raise ValueError(f"Cannot merge sketches with k={a['k']} and k={b['k']}")
+    merged = new_sketch(a['k'])
+    height = max(len(a['levels']), len(b['levels']))
+    for level in range(height):
+        parts = [sketch['levels'][level] for sketch in (a, b) if level < len(sketch['levels'])]
+        merged['levels'].append(np.concatenate(parts))
+        # Continue each level's alternation as if both sketches' compactions had been one sequence
+        merged['parity'].append(sum(sketch['parity'][level] for sketch in (a, b) if level < len(sketch['parity'])) % 2)
+    merged['n'] = a['n'] + b['n']
+    return compress(merged)
+
+
+def sketch_quantiles(sketch, quantiles=QUANTILES):
+    """Approximate value at each quantile (None for an empty sketch)"""
+    if not sketch['n']:
+        return [None] * len(quantiles)
+    items = np.concatenate(sketch['levels'])
+    weights = np.concatenate([np.full(len(level), 2.0 ** height)
+                              for height, level in enumerate(sketch['levels'])])
+    order = np.argsort(items, kind='stable')
+    ranks = np.cumsum(weights[order])
+    positions = np.searchsorted(ranks, np.asarray(quantiles) * ranks[-1], side='left')
+    return items[order][np.minimum(positions, len(items) - 1)].tolist()
+
+
+def new_moments():
+    """Empty count/sum/min/max/mean/variance accumulator"""
+    return {'n': 0, 'sum': 0.0, 'min': None, 'max': None, 'mean': 0.0, 'm2': 0.0}
+
+
+def array_moments(values):
+    """Accumulator for an array of (non-missing) values"""
+    if not len(values):
+        return new_moments()
+    mean = float(values.mean())
+    return {'n': len(values), 'sum': float(values.sum()), 'min': float(values.min()), 'max': float(values.max()),
+            'mean': mean, 'm2': float(((values - mean) ** 2).sum())}
+
+
+def moments_merge(a, b):
+    """Accumulator for the union of two accumulators' inputs"""
+    if not a['n']:
+        return dict(b)
+    if not b['n']:
+        return dict(a)
+    n = a['n'] + b['n']
+    delta = b['mean'] - a['mean']
+    return {
+        'n': n,
+        'sum': a['sum'] + b['sum'],
+        'min': min(a['min'], b['min']),
+        'max': max(a['max'], b['max']),
+        'mean': a['mean'] + delta * b['n'] / n,
+        'm2': a['m2'] + b['m2'] + delta * delta * a['n'] * b['n'] / n,
+    }
+
+
+def column_stats(values, k=DEFAULT_SKETCH_K):
+    """Accumulators for one column of one chunk"""
+    if values.dtype.kind in 'biuf':
+        numbers = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        missing = int(np.isnan(numbers).sum())
+        text = {}
+    else:
+        # Only the distinct values are parsed as numbers; the rest are counted from the codes
+        codes, distinct = pd.factorize(values)
+        distinct_numbers = pd.to_numeric(pd.Series(distinct, dtype=object), errors='coerce').to_numpy(
+            dtype=np.float64, na_value=np.nan)
+        numbers = np.append(distinct_numbers, np.nan)[codes]
+        missing = int((codes == -1).sum())
+        counts = np.bincount(codes[codes >= 0], minlength=len(distinct))
+        is_text = np.isnan(distinct_numbers)
+        text = {str(value): int(count) for value, count in zip(distinct[is_text], counts[is_text])}
+        if len(text) > MAX_TEXT_VALUES:
+            text = None
+    present = numbers[~np.isnan(numbers)]
+    return {
+        'rows': len(values),
+        'missing': missing,
+        'moments': array_moments(present),
+        'sketch': sketch_add(new_sketch(k), present),
+        'text': text,
+    }
+
+
+def column_merge(a, b):
+    """Column accumulators for the union of two inputs"""
+    if a['text'] is None or b['text'] is None:
+        text = None
+    else:
+        text = dict(a['text'])
+        for value, count in b['text'].items():
+            text[value] = text.get(value, 0) + count
+        if len(text) > MAX_TEXT_VALUES:
+            text = None
+    return {
+        'rows': a['rows'] + b['rows'],
+        'missing': a['missing'] + b['missing'],
+        'moments': moments_merge(a['moments'], b['moments']),
+        'sketch': sketch_merge(a['sketch'], b['sketch']),
+        'text': text,
+    }
+
+
+def frame_stats(df, k=DEFAULT_SKETCH_K):
+    """{column: accumulators} for a frame"""
+    return {str(name).strip(): column_stats(values, k) for name, values in df.items()}
+
+
+def stats_merge(a, b):
+    """Merge two {column: accumulators} maps (columns missing from one side are kept as they are)"""
+    merged = dict(a)
+    for column, accumulators in b.items():
+        merged[column] = column_merge(merged[column], accumulators) if column in merged else accumulators
+    return merged
+
+
+def line_start(f, position):
+    """Offset of the first line that starts at or after position (LF, CRLF and a lone CR all end a line)"""
+    if position == 0:
+        return 0
+    f.seek(position - 1)
+    window = b''
+    while True:
+        more = f.read(SCAN_BYTES)
+        window += more
+        match = LINE_END.search(window)
+        # A CR at the end of the window may be the first half of a CRLF
+        if match and (match.end() < len(window) or not more):
+            return position - 1 + match.end()
+        if not more:
+            return position - 1 + len(window)
+
+
+def file_splits(path, split_bytes):
+    """(path, start, end) byte ranges covering the data lines of a file, cut at line starts"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        cuts = [line_start(f, 1)]
+        while cuts[-1] < size:
+            cuts.append(line_start(f, cuts[-1] + split_bytes))
+    return [(path, start, end) for start, end in zip(cuts, cuts[1:])]
+
+
+def split_lines(path, start, end):
+    """Bytes of one split"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def read_split(path, start, end, header, **kwargs):
+    """Rows of one split as a frame named by header, or None if it holds no data lines
+
+    Long lines are folded as by read_dataset(); their positions in the
+    frame are listed in df.attrs['folded_rows'].
+    """
+    return read_block(split_lines(path, start, end), header, **kwargs)
+
+
+def read_block(block, header, **kwargs):
+    """read_split() for CSV data lines given as bytes"""
+    if not block.strip():
+        return None
+    # A leading row of empty fields: if every line of a split has extra fields, pandas would
+    # silently read the leading ones as an index instead of folding them as in the whole file
+    blank = b',' * (len(header) - 1) + b'\n'
+    with stage('load') as record:
+        df = read_folding(io.BytesIO(blank + block), len(header), header=None, names=header, **kwargs)
+        record['rows'] = len(df) - 1
+    folded = [position - 1 for position in df.attrs['folded_rows']]
+    df = df.iloc[1:].reset_index(drop=True)
+    df.attrs['folded_rows'] = folded
+    return df
+
+
+def split_stats(task):
+    """Accumulators for one split (runs in a worker process)"""
+    path, start, end, header, config, k, by_class = task
+    result = {'file': os.path.basename(path), 'path': os.path.abspath(path), 'rows': 0, 'malformed_rows': 0,
+              'columns': {}, 'classes': {}, 'rules': None}
+    df = read_split(path, start, end, header)
+    if df is None:
+        return result
+    result['rows'] = len(df)
+    result['malformed_rows'] = len(df.attrs['folded_rows'])
+    with stage('analyze', rows=len(df)):
+        result['columns'] = frame_stats(df, k)
+
+    labels = [name for name in df.columns if str(name).strip().lower() == LABEL_COLUMN]
+    if by_class and labels:
+        for label, group in df.groupby(df[labels[0]].fillna('<missing>').astype(str), sort=False):
+            result['classes'][label] = frame_stats(group, k)
+
+    family = schema_family(config, df.columns) if config else None
+    if family is not None:
+        plan = compile_rules(config, family, df.columns)
+        evaluation = evaluate(plan, df)
+        result['rules'] = {'family': family, 'rows_with_issues': evaluation['rows_with_issues'],
+                           'counts': {rule['name']: count for rule, count in zip(plan['rules'], evaluation['counts'])}}
+    return result
+
+
+def rules_merge(a, b):
+    """Rule violation counts for the union of two inputs"""
+    if a is None or b is None:
+        return a or b
+    counts = dict(a['counts'])
+    for name, count in b['counts'].items():
+        counts[name] = counts.get(name, 0) + count
+    return {'family': a['family'], 'rows_with_issues': a['rows_with_issues'] + b['rows_with_issues'],
+            'counts': counts}
+
+
+def result_merge(a, b):
+    """Merge two split (or file) results"""
+    classes = dict(a['classes'])
+    for label, stats in b['classes'].items():
+        classes[label] = stats_merge(classes[label], stats) if label in classes else stats
+    return {
+        'file': a['file'],
+        'path': a['path'],
+        'rows': a['rows'] + b['rows'],
+        'malformed_rows': a['malformed_rows'] + b['malformed_rows'],
+        'columns': stats_merge(a['columns'], b['columns']),
+        'classes': classes,
+        'rules': rules_merge(a['rules'], b['rules']),
+    }
+
+
+def stream_files(paths, split_bytes, config=None, k=DEFAULT_SKETCH_K, by_class=False, workers=1):
+    """Per-file merged results for paths, computed split by split"""
+    tasks = []
+    for path in paths:
+        header = list(pd.read_csv(path, nrows=0).columns)
+        tasks += [(*split, header, config, k, by_class) for split in file_splits(path, split_bytes)]
+    if workers > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(workers, len(tasks))) as pool:
+            results = pool.imap(split_stats, tasks)
+            return merge_by_file(results)
+    return merge_by_file(map(split_stats, tasks))
+
+
+def merge_by_file(results):
+    """Fold a stream of split results into one result per file path, in order"""
+    merged = {}
+    for result in results:
+        key = result['path']
+        merged[key] = result_merge(merged[key], result) if key in merged else result
+    return merged
+
+
+def column_summary(accumulators):
+    """JSON-friendly summary of a column's accumulators"""
+    moments = accumulators['moments']
+    summary = {'rows': accumulators['rows'], 'missing': accumulators['missing'], 'numeric': moments['n']}
+    if moments['n']:
+        summary.update({
+            'mean': moments['mean'],
+            'std': (moments['m2'] / (moments['n'] - 1)) ** 0.5 if moments['n'] > 1 else 0.0,
+            'min': moments['min'],
+            'max': moments['max'],
+            'quantiles': dict(zip([str(q) for q in QUANTILES], sketch_quantiles(accumulators['sketch']))),
+        })
+    if accumulators['text'] is None:
+        summary['text'] = 'too many distinct values'
+    elif accumulators['text']:
+        summary['text'] = dict(sorted(accumulators['text'].items(), key=lambda item: -item[1]))
+    return summary
+
+
+def state_to_json(result):
+    """A result with sketch levels as lists, so saved runs can be merged later"""
+    def columns_to_json(columns):
+        return {column: dict(acc, sketch=dict(acc['sketch'], levels=[level.tolist() for level in
+                                                                       acc['sketch']['levels']]))
+                for column, acc in columns.items()}
+    return dict(result, columns=columns_to_json(result['columns']),
+                classes={label: columns_to_json(columns) for label, columns in result['classes'].items()})
+
+
+def state_from_json(result):
+    """Inverse of state_to_json"""
+    def columns_from_json(columns):
+        return {column: dict(acc, sketch=dict(acc['sketch'], levels=[np.asarray(level, dtype=np.float64)
+                                                                       for level in acc['sketch']['levels']]))
+                for column, acc in columns.items()}
+    return dict(result, columns=columns_from_json(result['columns']),
+                classes={label: columns_from_json(columns) for label, columns in result['classes'].items()})
+
+
+def print_result(result):
+    """Per-column summary table of one (merged) result"""
+    print(f"\n=== {result['path']}: {result['rows']} records ({result['malformed_rows']} malformed) ===")
+    width = max([len(column) for column in result['columns']] + [6])
+    print(f"{'Column':<{width}} {'Missing':>7} {'Mean':>9} {'Std':>9} {'Min':>9} {'p50':>9} {'p99':>9} {'Max':>9}  Text")
+    for column, accumulators in result['columns'].items():
+        summary = column_summary(accumulators)
+        if summary['numeric']:
+            quantiles = summary['quantiles']
+            numbers = [summary['mean'], summary['std'], summary['min'], quantiles['0.5'], quantiles['0.99'],
+                       summary['max']]
+            cells = ' '.join(f"{value:>9.4g}" for value in numbers)
+        else:
+            cells = ' '.join(f"{'-':>9}" for _ in range(6))
+        text = summary.get('text', '')
+        if isinstance(text, dict):
+            shown = ', '.join(f"{value}={count}" for value, count in list(text.items())[:TEXT_VALUES_SHOWN])
+            text = shown + (f" (+{len(text) - TEXT_VALUES_SHOWN})" if len(text) > TEXT_VALUES_SHOWN else '')
+        print(f"{column:<{width}} {summary['missing']:>7} {cells}  {text}")
+    if result['rules']:
+        rules = result['rules']
+        print(f"\nRules ({rules['family']}): {rules['rows_with_issues']} records with violations")
+        for name, count in rules['counts'].items():
+            if count:
+                print(f"  {name}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='CSV files (default: every dataset CSV in --data-dir)')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--split-mb', type=float, default=DEFAULT_SPLIT_MB, help='Bytes of CSV parsed at a time')
+    parser.add_argument('--sketch-k', type=int, default=DEFAULT_SKETCH_K, help='Quantile sketch size')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes')
+    parser.add_argument('--by-class', action='store_true', help='Also keep statistics per class label')
+    parser.add_argument('--rules', default=RULES_FILE, help="Rules file for violation counts ('' to skip)")
+    parser.add_argument('--merge', action='store_true', help='Also merge every file into one total')
+    parser.add_argument('--state', default=None, help='Save mergeable state (sketches included) as JSON')
+    parser.add_argument('--load-state', nargs='+', default=[], metavar='JSON',
+                        help='Merge saved states into the results')
+    parser.add_argument('--output', default=None, help='Write the summaries as JSON')
+    args = parser.parse_args()
+
+    paths = args.files or ([] if args.load_state else dataset_files(args.data_dir))
+    config = load_rules(args.rules) if args.rules else None
+    started = time.perf_counter()
+    results = stream_files(paths, max(1, int(args.split_mb * 1024 * 1024)), config, args.sketch_k, args.by_class,
+                           args.workers)
+    for state_path in args.load_state:
+        with open(state_path) as f:
+            for name, saved in json.load(f).items():
+                saved = state_from_json(saved)
+                results[name] = result_merge(results[name], saved) if name in results else saved
+    if args.merge and len(results) > 1:
+        # Rule counts only add up within one schema family
+        total = None
+        for result in results.values():
+            total = result_merge(total, dict(result, rules=None)) if total else dict(result, rules=None)
+        results['<total>'] = dict(total, file='<total>', path='<total>')
+    elapsed = time.perf_counter() - started
+
+    with stage('report'):
+        for result in results.values():
+            print_result(result)
+    print(f"\nProcessed {sum(result['rows'] for name, result in results.items() if name != '<total>')} records "
+          f"in {elapsed:.1f}s")
+    if args.state:
+        with open(args.state, 'w') as f:
+            json.dump({name: state_to_json(result) for name, result in results.items() if name != '<total>'}, f)
+    if args.output:
+        report = {name: {'rows': result['rows'], 'malformed_rows': result['malformed_rows'], 'rules': result['rules'],
+                         'columns': {column: column_summary(acc) for column, acc in result['columns'].items()},
+                         'classes': {label: {column: column_summary(acc) for column, acc in columns.items()}
+                                     for label, columns in result['classes'].items()}}
+                  for name, result in results.items()}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,68 @@
+"""Migration of a known No_Action_100_v6 row to the canonical schema"""
+
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_paths import data_path  # noqa: E402
+from row_fingerprint import read_dataset  # noqa: E402
+from schema_migration import frame_to_canonical, load_mappings  # noqa: E402
+from signal_spec import canonical_header  # noqa: E402
+
+# First data row of No_Action_100_v6.csv (72 fields under a 73-column header)
+V6_FIRST_ROW = ('0,0,0,0.0,1,0,0,0.0,0,0,0,0,0,0,13.2,0.92,0,0.01,0,0,0,0,0.01,1,0.0,0,0,0.89,0.95,0,0.04,0,0,'
+                '0.94,0,0.03,0.06,0.96,0,2,0,1.0,0,0.0,0,none,0.02,0,0,0,0,0.09,0.95,0,pass,pass,pass,1,TLS 1.3,'
+                '2,0,0,0,0,0.97,valid,0.0,0.02,0,1,1,No Action')
+
+# Canonical values of that row: columns mapped from fields that line up with
+# the header, and defaults for the ones filled from misaligned fields
+EXPECTED = {
+    'sender_domain_reputation_score': 1.0,
+    'smtp_ip_reputation_score': 1.0,
+    'any_file_hash_malicious': 0,
+    'any_vbscript_javascript_detected': 0,
+    'final_url_known_malicious': 0,
+    'url_reputation_score': 1.0,
+    'url_shortener_detected': 0,
+    'urgency_keywords_present': 0,
+    'request_type': 'none',
+    'classification': 'No Action',
+    'spf_result': 'none',
+    'dkim_result': 'none',
+    'dmarc_result': 'none',
+    'has_executable_attachment': 0,
+    'smtp_ip_known_malicious': 0,
+    'total_links_detected': 0,
+    'url_redirect_chain_length': 0,
+    'return_path_mismatch_with_from': 0,
+    'reply_path_diff_from_sender': 0,
+    'ssl_validity_status': 'no_ssl',
+}
+DEFAULTED = ['spf_result', 'dkim_result', 'dmarc_result', 'has_executable_attachment', 'smtp_ip_known_malicious',
+             'total_links_detected', 'url_redirect_chain_length', 'return_path_mismatch_with_from',
+             'reply_path_diff_from_sender']
+
+
+def migrated_v6():
+    path = data_path('No_Action_100_v6.csv')
+    with open(path) as f:
+        f.readline()
+        assert f.readline().strip() == V6_FIRST_ROW
+    return frame_to_canonical(read_dataset(path), load_mappings())
+
+
+def test_v6_row_matches_expected_canonical_values():
+    df = migrated_v6()
+    assert list(df.columns) == canonical_header()
+    assert df.attrs['migrated_from'] == 'v5'
+    row = df.iloc[0]
+    assert {column: row[column] for column in EXPECTED} == EXPECTED
+    # No source provides a TLS version, and 'None' would claim no encryption
+    assert math.isnan(row['tls_version'])
+
+
+def test_misaligned_fields_are_defaulted():
+    df = migrated_v6()
+    assert set(DEFAULTED) <= set(df.attrs['defaulted'])